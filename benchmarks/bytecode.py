@@ -0,0 +1,140 @@
+"""
+Checks the MLIR bytecode writer of the xDSL backend against MLIR: every
+program of the corpus is compiled to the builtin dialect as text and as
+bytecode with a few compiler options, both are read and printed by
+`mlir-opt`, and the two printouts have to be the same. So do those of the
+parts `compile` splits a module with many functions into:
+
+    python -m benchmarks.bytecode
+    MLIR_OPT=/path/to/mlir-opt python -m benchmarks.bytecode --scale 2
+
+The check is skipped if `mlir-opt` (or `MLIR_OPT`) is not installed. The
+exit status is nonzero if any program differs or fails to compile or read.
+"""
+
+import argparse
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from .corpus import write_corpus
+
+CONFIGS: dict[str, list[str]] = {
+    "default": ["--eval-budget", "0"],
+    "partial-eval": [],
+    "no-affine": ["--no-affine", "--eval-budget", "0"],
+    "tape-stack": ["--tape", "stack", "--eval-budget", "0"],
+    "tape-heap": ["--tape", "heap", "--bounds", "check", "--eval-budget", "0"],
+    "small-functions": ["--outline-size", "50", "--eval-budget", "0"],
+}
+# The configs whose modules are also split, into parts of about this size.
+SPLIT_CONFIGS = {"small-functions"}
+PART_SIZE = 2000
+
+
+def compare(mlir_opt: str, text: pathlib.Path, bytecode: pathlib.Path) -> str | None:
+    """Returns how `mlir-opt` prints the two files differently, if it does."""
+    printed = []
+    for path in (text, bytecode):
+        result = subprocess.run([mlir_opt, str(path)], capture_output=True)
+        if result.returncode != 0:
+            error = result.stderr.decode().strip()
+            return f"{mlir_opt} failed on {path.name}: {error}"
+        printed.append(result.stdout)
+    expected, actual = printed
+    if expected != actual:
+        lines = zip(expected.splitlines(), actual.splitlines())
+        line, (expected, actual) = next(
+            ((line, pair) for line, pair in enumerate(lines, 1) if pair[0] != pair[1]),
+            (0, (b"", b"")),
+        )
+        return f"differs in line {line}: {expected!r} != {actual!r}"
+    return None
+
+
+def check_parts(mlir_opt: str, text: pathlib.Path) -> str | None:
+    """Splits the module in `text` like `compile` does and compares every part."""
+    from xdsl.dialects import llvm
+    from xdsl.parser import Parser
+    from xdsl.printer import Printer
+
+    from py_mlir_bf_compiler_xdsl.__main__ import context
+    from py_mlir_bf_compiler_xdsl.bytecode import write_bytecode
+    from py_mlir_bf_compiler_xdsl.split import split_module
+
+    # The lowering builds the casts to LLVM types of the output buffer.
+    ctx = context().clone()
+    ctx.load_dialect(llvm.LLVM)
+    module = Parser(ctx, text.read_text()).parse_module()
+    for index, part in enumerate(split_module(module, PART_SIZE)):
+        part_text = text.with_suffix(f".{index}.mlir")
+        with part_text.open("w") as stream:
+            Printer(stream=stream).print_op(part)
+        part_bytecode = text.with_suffix(f".{index}.mlirbc")
+        with part_bytecode.open("wb") as stream:
+            write_bytecode(part, stream)
+        error = compare(mlir_opt, part_text, part_bytecode)
+        if error is not None:
+            return f"part {index} {error}"
+    return None
+
+
+def check(
+    mlir_opt: str, source: pathlib.Path, options: list[str], split: bool
+) -> str | None:
+    """Compiles `source` once, returns why the bytecode differs, if it does."""
+    paths = []
+    for emit, suffix in (("text", ".mlir"), ("bytecode", ".mlirbc")):
+        output = source.with_suffix(suffix)
+        command = [sys.executable, "-m", "py_mlir_bf_compiler_xdsl", str(source)]
+        command += [*options, "--target", "builtin", "--emit", emit]
+        command += ["--output", str(output)]
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            return f"--emit {emit} failed: {result.stderr.strip()}"
+        paths.append(output)
+    error = compare(mlir_opt, *paths)
+    if error is None and split:
+        error = check_parts(mlir_opt, paths[0])
+    return error
+
+
+parser = argparse.ArgumentParser(
+    description="Check the bytecode writer of the xDSL backend against mlir-opt"
+)
+parser.add_argument(
+    "--scale",
+    type=int,
+    default=1,
+    help="Multiplies the work done by every program (default: 1)",
+)
+parser.add_argument(
+    "--config",
+    nargs="+",
+    choices=list(CONFIGS),
+    default=list(CONFIGS),
+    help="(default: all)",
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    mlir_opt = shutil.which(os.environ.get("MLIR_OPT", "mlir-opt"))
+    if mlir_opt is None:
+        print("mlir-opt not found, skipping the bytecode check", file=sys.stderr)
+        sys.exit(0)
+    status = 0
+    with tempfile.TemporaryDirectory() as directory:
+        for source in write_corpus(pathlib.Path(directory), args.scale):
+            for config in args.config:
+                error = check(
+                    mlir_opt, source, CONFIGS[config], config in SPLIT_CONFIGS
+                )
+                status |= error is not None
+                print(
+                    f"{'FAILED' if error else 'ok':<6} {source.stem:<10}"
+                    f" {config:<15} {error or ''}"
+                )
+    sys.exit(status)
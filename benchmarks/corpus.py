@@ -0,0 +1,376 @@
+"""
+Generates the Brainfuck programs of the benchmark corpus. Every workload is a
+function taking a `scale` that multiplies its amount of work, so that the
+same programs can be used for quick checks and for real measurements.
+"""
+
+import contextlib
+import pathlib
+import random
+from collections.abc import Iterator
+from typing import Callable
+
+
+class Builder:
+    """
+    Emits Brainfuck while tracking the pointer at generation time, so that
+    code can address cells by number. Every construct returns the pointer to
+    where it started, which keeps all loops balanced.
+    """
+
+    def __init__(self) -> None:
+        self.code: list[str] = []
+        self.position = 0
+        self._free: list[int] = []
+        self._next = 0
+
+    def __str__(self) -> str:
+        return "".join(self.code)
+
+    def alloc(self) -> int:
+        """Returns a cell that is zero and not used by anything else."""
+        if self._free:
+            return self._free.pop()
+        self._next += 1
+        return self._next - 1
+
+    def release(self, *cells: int):
+        """Returns cells to the pool, they must have been cleared."""
+        self._free.extend(cells)
+
+    @contextlib.contextmanager
+    def temporary(self) -> Iterator[int]:
+        cell = self.alloc()
+        yield cell
+        self.clear(cell)
+        self.release(cell)
+
+    def move(self, cell: int):
+        delta = cell - self.position
+        self.code.append(">" * delta if delta > 0 else "<" * -delta)
+        self.position = cell
+
+    def add(self, cell: int, amount: int):
+        self.move(cell)
+        amount = ((amount + 128) & 0xFF) - 128
+        self.code.append("+" * amount if amount > 0 else "-" * -amount)
+
+    def clear(self, cell: int):
+        self.move(cell)
+        self.code.append("[-]")
+
+    def set(self, cell: int, value: int):
+        self.clear(cell)
+        self.add(cell, value)
+
+    def output(self, cell: int, times: int = 1):
+        self.move(cell)
+        self.code.append("." * times)
+
+    @contextlib.contextmanager
+    def loop(self, cell: int) -> Iterator[None]:
+        self.move(cell)
+        self.code.append("[")
+        yield
+        self.move(cell)
+        self.code.append("]")
+
+    def transfer(self, source: int, *targets: tuple[int, int]):
+        """Adds `source * factor` to every `(target, factor)` and clears `source`."""
+        with self.loop(source):
+            self.add(source, -1)
+            for target, factor in targets:
+                self.add(target, factor)
+
+    def copy(self, source: int, target: int):
+        """Adds `source` to `target`."""
+        with self.temporary() as temporary:
+            self.transfer(source, (target, 1), (temporary, 1))
+            self.transfer(temporary, (source, 1))
+
+    @contextlib.contextmanager
+    def repeat(self, times: int) -> Iterator[None]:
+        assert 0 < times < 256
+        with self.temporary() as counter:
+            self.add(counter, times)
+            with self.loop(counter):
+                yield
+                self.add(counter, -1)
+
+    @contextlib.contextmanager
+    def if_nonzero(self, cell: int) -> Iterator[None]:
+        with self.temporary() as flag:
+            self.copy(cell, flag)
+            with self.loop(flag):
+                yield
+                self.clear(flag)
+
+    @contextlib.contextmanager
+    def if_equal(self, cell: int, value: int) -> Iterator[None]:
+        with self.temporary() as difference, self.temporary() as flag:
+            self.copy(cell, difference)
+            self.add(difference, -value)
+            self.add(flag, 1)
+            with self.loop(difference):
+                self.clear(difference)
+                self.clear(flag)
+            with self.loop(flag):
+                yield
+                self.clear(flag)
+
+    def multiply(self, a: int, b: int, target: int):
+        """Adds `a * b` to `target`."""
+        with self.temporary() as counter:
+            self.copy(a, counter)
+            with self.loop(counter):
+                self.add(counter, -1)
+                self.copy(b, target)
+
+    def divmod(self, cell: int, divisor: int, quotient: int, remainder: int):
+        """Adds `cell // divisor` to `quotient` and sets `remainder`."""
+        self.clear(remainder)
+        with self.temporary() as counter:
+            self.copy(cell, counter)
+            with self.loop(counter):
+                self.add(counter, -1)
+                self.add(remainder, 1)
+                with self.if_equal(remainder, divisor):
+                    self.clear(remainder)
+                    self.add(quotient, 1)
+
+    def print_string(self, text: bytes):
+        with self.temporary() as cell:
+            value = 0
+            for byte in text:
+                self.add(cell, byte - value)
+                self.output(cell)
+                value = byte
+
+    def print_number(self, cell: int):
+        """Prints a cell in decimal without leading zeros."""
+        with (
+            self.temporary() as hundreds,
+            self.temporary() as rest,
+            self.temporary() as tens,
+            self.temporary() as ones,
+            self.temporary() as leading,
+        ):
+            self.divmod(cell, 100, hundreds, rest)
+            self.divmod(rest, 10, tens, ones)
+            with self.if_nonzero(hundreds):
+                self.add(hundreds, ord("0"))
+                self.output(hundreds)
+            # The tens are printed if they or the hundreds are nonzero.
+            self.copy(hundreds, leading)
+            self.copy(tens, leading)
+            with self.if_nonzero(leading):
+                self.add(tens, ord("0"))
+                self.output(tens)
+            self.add(ones, ord("0"))
+            self.output(ones)
+
+
+def mandelbrot(scale: int) -> str:
+    """
+    A grid of fixed point iterations `z = z * z + c` (modulo 256) with a
+    character per point, the numeric core of the classic Mandelbrot
+    renderers.
+    """
+    bf = Builder()
+    y, x, c, z, square, shade, quotient = (bf.alloc() for _ in range(7))
+    with bf.repeat(8 * scale):
+        bf.add(y, 3)
+        bf.clear(x)
+        with bf.repeat(32):
+            bf.add(x, 1)
+            bf.clear(c)
+            bf.copy(x, c)
+            bf.copy(y, c)
+            bf.clear(z)
+            with bf.repeat(6):
+                bf.multiply(z, z, square)
+                bf.clear(z)
+                bf.transfer(square, (z, 1))
+                bf.copy(c, z)
+            bf.divmod(z, 64, quotient, shade)
+            bf.clear(quotient)
+            bf.add(shade, ord("0"))
+            bf.output(shade)
+        bf.print_string(b"\n")
+    return str(bf)
+
+
+def hanoi(scale: int) -> str:
+    """
+    Solves the towers of Hanoi with `8 + scale` disks, printing every move.
+    A binary counter selects the disk to move, as in the iterative solution.
+    """
+    disks = min(8 + scale, 16)
+    bf = Builder()
+    running = bf.alloc()
+    bits = [bf.alloc() for _ in range(disks)]
+    pegs = [bf.alloc() for _ in range(disks)]
+    bf.add(running, 1)
+
+    def increment(disk: int):
+        if disk == disks:
+            bf.clear(running)
+            return
+        with bf.temporary() as otherwise:
+            bf.add(otherwise, 1)
+            with bf.if_nonzero(bits[disk]):
+                bf.clear(otherwise)
+                bf.clear(bits[disk])
+                increment(disk + 1)
+            with bf.loop(otherwise):
+                bf.clear(otherwise)
+                bf.add(bits[disk], 1)
+                move(disk)
+
+    def move(disk: int):
+        # The smallest disk moves one way round, the others the other way.
+        step = 1 if (disks - disk) % 2 == 0 else 2
+        bf.print_string(bytes([ord("a") + disk]) + b":")
+        peg = pegs[disk]
+        with bf.temporary() as done:
+            for start in range(3):
+                with bf.if_equal(peg, start):
+                    with bf.if_equal(done, 0):
+                        bf.set(peg, (start + step) % 3)
+                        bf.set(done, 1)
+                        bf.print_string(b"%d>%d\n" % (start, (start + step) % 3))
+
+    with bf.loop(running):
+        increment(0)
+    for cell in bits + pegs:
+        bf.clear(cell)
+    return str(bf)
+
+
+def sieve(scale: int, limit: int = 250) -> str:
+    """
+    The sieve of Eratosthenes on a row of flag cells, printing the primes
+    below `limit` in every one of `4 * scale` rounds. The marking of multiples
+    is unrolled, which also makes this a large program.
+    """
+    bf = Builder()
+    flags = [bf.alloc() for _ in range(limit)]
+    number = bf.alloc()
+    with bf.repeat(4 * scale):
+        for flag in flags:
+            bf.clear(flag)
+        bf.clear(number)
+        bf.add(number, 1)
+        for candidate in range(2, limit):
+            bf.add(number, 1)
+            with bf.if_equal(flags[candidate], 0):
+                bf.print_number(number)
+                bf.print_string(b" ")
+                for multiple in range(candidate * candidate, limit, candidate):
+                    bf.set(flags[multiple], 1)
+        bf.print_string(b"\n")
+    return str(bf)
+
+
+def printer(scale: int) -> str:
+    """Prints a text over and over, mostly a stream of `.` and small adds."""
+    bf = Builder()
+    line = b"The quick brown fox jumps over the lazy dog. 0123456789\n"
+    with bf.repeat(min(32 * scale, 255)), bf.repeat(128):
+        bf.print_string(line)
+        with bf.temporary() as cell:
+            bf.add(cell, ord("="))
+            bf.output(cell, 64)
+            bf.add(cell, ord("\n") - ord("="))
+            bf.output(cell)
+    return str(bf)
+
+
+def nesting(scale: int, depth: int = 48) -> str:
+    """
+    Loops nested `depth` deep that are entered once each, followed by a
+    nest of counting loops that does the actual work.
+    """
+    bf = Builder()
+    total = bf.alloc()
+    cells = [bf.alloc() for _ in range(depth)]
+    with bf.repeat(2 * scale):
+        for cell in cells:
+            bf.add(cell, 1)
+            bf.code.append("[")
+        for cell in reversed(cells):
+            bf.add(total, 1)
+            bf.move(cell)
+            bf.code.append("-]")
+
+        def nest(level: int):
+            if level == 0:
+                bf.add(total, 1)
+                return
+            with bf.repeat(12):
+                nest(level - 1)
+
+        nest(6)
+    bf.print_number(total)
+    bf.print_string(b"\n")
+    return str(bf)
+
+
+def synthetic(
+    length: int,
+    depth: int = 8,
+    loops: int = 100,
+    io_density: float = 0.01,
+    seed: int = 0,
+) -> str:
+    """
+    A random program of about `length` instructions for measuring the
+    compiler rather than the program: `loops` loops nested at most `depth`
+    deep, where the first loops are nested until `depth` is reached once,
+    and a share of `io_density` of the other instructions is `.` or `,`.
+    Every loop is preceded by a `+`, so that no pass removes it.
+    """
+    rng = random.Random(seed)
+    opens = set(rng.sample(range(length), min(loops, length)))
+    # The chance to close a loop, such that loops span about as many
+    # instructions as there are between two loop starts.
+    close = min(1.0, 2 * len(opens) / length)
+    code: list[str] = []
+    level = 0
+    reached = depth == 0
+    for index in range(length):
+        if index in opens:
+            if level == depth:
+                code.append("]")
+                level -= 1
+            code.append("+[")
+            level += 1
+            reached = reached or level == depth
+        elif level and reached and rng.random() < close:
+            code.append("]")
+            level -= 1
+        if rng.random() < io_density:
+            code.append(rng.choice(".,"))
+        else:
+            code.append(rng.choice("+-<>"))
+    code.append("]" * level)
+    return "".join(code)
+
+
+WORKLOADS: dict[str, Callable[[int], str]] = {
+    "mandelbrot": mandelbrot,
+    "hanoi": hanoi,
+    "sieve": sieve,
+    "printer": printer,
+    "nesting": nesting,
+}
+
+
+def write_corpus(directory: pathlib.Path, scale: int = 1) -> list[pathlib.Path]:
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for name, workload in WORKLOADS.items():
+        path = directory / f"{name}.bf"
+        path.write_text(workload(scale) + "\n")
+        paths.append(path)
+    return paths
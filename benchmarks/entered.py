@@ -0,0 +1,105 @@
+"""
+Checks the code generated for loops known to be entered, which cell value
+propagation marks and the builtin lowering turns into do-while loops, also
+after loop sharing moved them into functions called in several places.
+Every case is compiled into an executable with `compile` and run on its
+input, and interpreted with the xDSL backend, which runs such loops the
+same way; the output has to be the expected one:
+
+    python -m benchmarks.entered
+    python -m benchmarks.entered --backend xdsl
+
+Only the interpreter runs if the LLVM tools `compile` runs are not
+installed. The exit status is nonzero if any case fails.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from py_mlir_bf_compiler_common.build import CLANG, LLC, MLIR_OPT, MLIR_TRANSLATE
+
+BACKENDS = ["xdsl", "native"]
+
+# Partial evaluation would run the cases to their output.
+NO_EVAL = ["--eval-budget", "0"]
+SHARE = ["--share-size", "2", *NO_EVAL]
+
+# The name, source, options, input and expected output of every case.
+CASES: list[tuple[str, str, list[str], bytes, bytes]] = [
+    ("entered", "+[.-]", NO_EVAL, b"", b"\x01"),
+    ("entered-nested", "++[>+[.-]<-]", NO_EVAL, b"", b"\x01\x01"),
+    # The first loop is known to be entered, its copy after the input is
+    # not, so the two must not be shared.
+    ("shared-skipped", "+[.-],[.-]", SHARE, b"\x00", b"\x01"),
+    ("shared-entered", "+[.-],[.-]", SHARE, b"\x02", b"\x01\x02\x01"),
+    ("shared-first-skipped", ",[.-]+[.-]", SHARE, b"\x00", b"\x01"),
+    ("shared-nested", "+[>+[.-]<-],[>,[.-]<-]", SHARE, b"\x00", b"\x01"),
+]
+
+
+def check(
+    backend: str, directory: Path, source: str, options: list[str], input: bytes
+) -> str | bytes:
+    """
+    Compiles and runs a case, or interprets it for the `interpret` backend,
+    returns its output or why it failed.
+    """
+    path = directory / "case.bf"
+    path.write_text(source + "\n")
+    if backend == "interpret":
+        command = [sys.executable, "-m", "py_mlir_bf_compiler_xdsl", str(path)]
+        command += ["--target", "interpret", *options]
+    else:
+        executable = directory / "case.out"
+        command = [sys.executable, "-m", f"py_mlir_bf_compiler_{backend}", "compile"]
+        command += [str(path), "-o", str(executable), "--no-cache", *options]
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            return f"compile failed: {result.stderr.strip()}"
+        command = [str(executable)]
+    result = subprocess.run(command, input=input, capture_output=True)
+    if result.returncode != 0:
+        return f"exit status {result.returncode}"
+    return result.stdout
+
+
+parser = argparse.ArgumentParser(
+    description="Check the code generated for loops known to be entered"
+)
+parser.add_argument(
+    "--backend", nargs="+", choices=BACKENDS, default=BACKENDS, help="(default: all)"
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    missing = [
+        stage.command[0]
+        for stage in (MLIR_OPT, MLIR_TRANSLATE, LLC, CLANG)
+        if shutil.which(os.environ.get(stage.variable, stage.command[0])) is None
+    ]
+    backends = ["interpret"]
+    if missing:
+        print(f"{', '.join(missing)} not found, only interpreting", file=sys.stderr)
+    else:
+        backends += args.backend
+    status = 0
+    with tempfile.TemporaryDirectory() as name:
+        for backend in backends:
+            for case, source, options, input, expected in CASES:
+                output = check(backend, Path(name), source, options, input)
+                error = None
+                if isinstance(output, str):
+                    error = output
+                elif output != expected:
+                    error = f"printed {output[:20]!r}, expected {expected!r}"
+                status |= error is not None
+                print(
+                    f"{'FAILED' if error else 'ok':<6} {backend:<9} {case:<21}"
+                    f" {error or ''}"
+                )
+    sys.exit(status)
@@ -0,0 +1,95 @@
+"""
+Checks that the command line compiles and interprets deeply nested programs
+with every backend, target and lowering path, which the recursive verifiers,
+printers and erasers of xDSL and MLIR overflow without a deep stack:
+
+    python -m benchmarks.nesting
+    python -m benchmarks.nesting --depth 1000 10000 --backend xdsl
+
+The program reads a byte and counts it down in its innermost loop, so that
+partial evaluation leaves all loops in place. The exit status is nonzero if
+any run fails or interprets the program wrongly.
+"""
+
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKENDS = ["xdsl", "native"]
+TARGETS = ["linked", "builtin", "interpret"]
+
+# The input byte and what the program prints for it.
+INPUT = b"\x03"
+EXPECTED = b"\x02\x01\x00"
+
+
+def nested(depth: int) -> str:
+    return "," + "[" * depth + "-." + "]" * depth + "\n"
+
+
+def check(
+    backend: str, source: Path, target: str, staged: bool, timeout: float
+) -> str | None:
+    """Runs the command line once, returns why it failed, if it did."""
+    command = [sys.executable, "-m", f"py_mlir_bf_compiler_{backend}", str(source)]
+    command += ["--target", target, "--staged" if staged else "--no-staged"]
+    if target != "interpret":
+        command += ["--output", "/dev/null"]
+    try:
+        result = subprocess.run(
+            command, input=INPUT, capture_output=True, timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        return f"timed out after {timeout}s"
+    if result.returncode != 0:
+        lines = result.stderr.decode(errors="replace").strip().splitlines()
+        return f"exit status {result.returncode}: {lines[-1] if lines else ''}"
+    if target == "interpret" and result.stdout != EXPECTED:
+        return f"printed {result.stdout[:20]!r}, expected {EXPECTED!r}"
+    return None
+
+
+parser = argparse.ArgumentParser(
+    description="Check that deeply nested programs compile"
+)
+parser.add_argument(
+    "--backend", nargs="+", choices=BACKENDS, default=BACKENDS, help="(default: all)"
+)
+parser.add_argument(
+    "--depth",
+    nargs="+",
+    type=int,
+    default=[1000, 5000],
+    help="Nesting depths of the programs (default: 1000 5000)",
+)
+parser.add_argument(
+    "--timeout",
+    type=float,
+    default=600,
+    help="Seconds a single run may take (default: 600)",
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    status = 0
+    with tempfile.TemporaryDirectory() as directory:
+        for depth in args.depth:
+            source = Path(directory) / f"nested_{depth}.bf"
+            source.write_text(nested(depth))
+            for backend in args.backend:
+                for target in TARGETS:
+                    for staged in (False, True):
+                        start = time.perf_counter()
+                        error = check(backend, source, target, staged, args.timeout)
+                        seconds = time.perf_counter() - start
+                        status |= error is not None
+                        print(
+                            f"{'FAILED' if error else 'ok':<6} {backend:<7}"
+                            f" depth={depth:<6} {target:<9}"
+                            f" {'staged' if staged else 'direct':<6}"
+                            f" {seconds:.1f}s {error or ''}"
+                        )
+    sys.exit(status)
@@ -0,0 +1,273 @@
+"""
+Compiles the benchmark corpus with both backends and a range of compiler
+options and measures the resulting executables: wall time, instructions
+retired (if `perf` is available), peak RSS (if GNU `time` is) and output
+throughput.
+
+    python -m benchmarks.runtime -o results.json
+    python -m benchmarks.runtime --baseline results.json
+
+All builds of a program have to print the same output. With `--baseline`
+the results are compared against a previous run and the exit status is
+nonzero if any measurement got slower by more than `--threshold`.
+"""
+
+import argparse
+import hashlib
+import json
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Sequence
+
+from .corpus import WORKLOADS, write_corpus
+
+BACKENDS = ["xdsl", "native"]
+
+# The programs of the corpus that read no input compile to a single write
+# with partial evaluation, so every config except `partial-eval` disables it
+# to measure the code generated for them.
+NO_EVAL = ["--eval-budget", "0"]
+
+CONFIGS: dict[str, list[str]] = {
+    "default": [*NO_EVAL],
+    "partial-eval": [],
+    "no-fold": ["--no-fold", *NO_EVAL],
+    "no-canonicalize": ["--no-canonicalize", *NO_EVAL],
+    "no-idioms": ["--no-idioms", *NO_EVAL],
+    "no-offsets": ["--no-offsets", *NO_EVAL],
+    "no-cell-values": ["--no-cell-values", *NO_EVAL],
+    "no-affine": ["--no-affine", *NO_EVAL],
+    "unoptimized": [
+        "--no-fold",
+        "--no-canonicalize",
+        "--no-idioms",
+        "--no-offsets",
+        "--no-cell-values",
+        "--no-affine",
+        *NO_EVAL,
+    ],
+    "io-unbuffered": ["--io", "unbuffered", *NO_EVAL],
+    "io-full": ["--io", "full", *NO_EVAL],
+    "tape-stack": ["--tape", "stack", *NO_EVAL],
+    "tape-heap": ["--tape", "heap", *NO_EVAL],
+    "bounds-check": ["--bounds", "check", *NO_EVAL],
+    "bounds-unchecked": ["--bounds", "unchecked", *NO_EVAL],
+}
+
+# Measurements compared against the baseline, smaller is better for all.
+METRICS = ["wall_time", "instructions", "peak_rss"]
+
+
+def compile_program(
+    backend: str, source: pathlib.Path, flags: Sequence[str], output: pathlib.Path
+):
+    subprocess.run(
+        [sys.executable, "-m", f"py_mlir_bf_compiler_{backend}", "compile"]
+        + [str(source), "-o", str(output), *flags],
+        check=True,
+    )
+
+
+def run_once(executable: pathlib.Path) -> tuple[float, bytes]:
+    """Returns the wall time and the output of a run."""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [executable], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, check=True
+    )
+    return time.perf_counter() - start, result.stdout
+
+
+def peak_rss(executable: pathlib.Path) -> int | None:
+    """
+    Returns the peak RSS of a run in bytes, as reported by GNU time, if
+    installed. Linux carries the RSS of the forking process over the exec,
+    so the program is not forked from this interpreter but from `time`,
+    whose RSS is negligible.
+    """
+    gnu_time = shutil.which("time")
+    if gnu_time is None:
+        return None
+    with tempfile.NamedTemporaryFile("r") as report:
+        result = subprocess.run(
+            [gnu_time, "-f", "%M", "-o", report.name, executable],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+        )
+        if result.returncode != 0:
+            return None
+        lines = report.read().split()
+    # %M is in KiB.
+    return int(lines[-1]) * 1024 if lines and lines[-1].isdigit() else None
+
+
+def instructions_retired(executable: pathlib.Path) -> int | None:
+    perf = shutil.which("perf")
+    if perf is None:
+        return None
+    with tempfile.NamedTemporaryFile("r") as report:
+        result = subprocess.run(
+            [perf, "stat", "-x,", "-e", "instructions:u", "-o", report.name]
+            + ["--", executable],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+        )
+        if result.returncode != 0:
+            return None
+        for line in report:
+            fields = line.split(",")
+            if len(fields) > 2 and fields[2].startswith("instructions"):
+                return int(fields[0]) if fields[0].isdigit() else None
+    return None
+
+
+def measure(executable: pathlib.Path, repeat: int) -> dict:
+    runs = [run_once(executable) for _ in range(repeat)]
+    wall_time = min(run[0] for run in runs)
+    output = runs[0][1]
+    return {
+        "wall_time": wall_time,
+        "instructions": instructions_retired(executable),
+        "peak_rss": peak_rss(executable),
+        "output_bytes": len(output),
+        "output_throughput": len(output) / wall_time if wall_time else None,
+        "output_sha256": hashlib.sha256(output).hexdigest(),
+    }
+
+
+def run_benchmarks(args: argparse.Namespace) -> list[dict]:
+    directory = args.workdir
+    sources = write_corpus(directory / "corpus", args.scale)
+    results = []
+    # The output of the first successful build of every program, which all
+    # other builds have to reproduce.
+    expected: dict[str, str] = {}
+    for source in sources:
+        if source.stem not in args.program:
+            continue
+        for backend in args.backend:
+            for config in args.config:
+                result = {"program": source.stem, "backend": backend, "config": config}
+                executable = directory / backend / config / f"{source.stem}.out"
+                executable.parent.mkdir(parents=True, exist_ok=True)
+                try:
+                    compile_program(backend, source, CONFIGS[config], executable)
+                    result |= measure(executable, args.repeat)
+                except (OSError, subprocess.CalledProcessError) as e:
+                    result["error"] = str(e)
+                else:
+                    digest = expected.setdefault(source.stem, result["output_sha256"])
+                    if result["output_sha256"] != digest:
+                        result["error"] = "output differs from the other builds"
+                results.append(result)
+                print(format_result(result), file=sys.stderr)
+    return results
+
+
+def format_result(result: dict) -> str:
+    name = f"{result['program']:<12} {result['backend']:<7} {result['config']:<16}"
+    if "error" in result:
+        return f"{name} FAILED: {result['error']}"
+    instructions = result["instructions"]
+    rss = result["peak_rss"]
+    return (
+        f"{name} {result['wall_time']:9.4f}s"
+        f" {'-' if instructions is None else instructions:>14}"
+        f" {'-' if rss is None else f'{rss / (1 << 20):.1f}':>7}MiB"
+        f" {(result['output_throughput'] or 0) / (1 << 20):9.1f}MiB/s"
+    )
+
+
+def compare(results: list[dict], baseline: list[dict], threshold: float) -> int:
+    """Prints the changes against the baseline, returns the number of regressions."""
+
+    def key(result: dict) -> tuple[str, str, str]:
+        return result["program"], result["backend"], result["config"]
+
+    previous = {key(result): result for result in baseline if "error" not in result}
+    regressions = 0
+    for result in results:
+        old = previous.get(key(result))
+        if old is None or "error" in result:
+            continue
+        for metric in METRICS:
+            if not old.get(metric) or result.get(metric) is None:
+                continue
+            ratio = result[metric] / old[metric]
+            if ratio > 1 + threshold:
+                regressions += 1
+                print(f"REGRESSION {' '.join(key(result))} {metric}: {ratio:.2f}x")
+            elif ratio < 1 - threshold:
+                print(f"improved {' '.join(key(result))} {metric}: {ratio:.2f}x")
+    return regressions
+
+
+parser = argparse.ArgumentParser(
+    description="Measure compiled Brainfuck programs across backends and options"
+)
+parser.add_argument(
+    "--backend", nargs="+", choices=BACKENDS, default=BACKENDS, help="(default: all)"
+)
+parser.add_argument(
+    "--config",
+    nargs="+",
+    choices=list(CONFIGS),
+    default=list(CONFIGS),
+    help="Compiler option sets to build with (default: all)",
+)
+parser.add_argument(
+    "--program",
+    nargs="+",
+    choices=list(WORKLOADS),
+    default=list(WORKLOADS),
+    help="(default: all)",
+)
+parser.add_argument(
+    "--scale",
+    type=int,
+    default=1,
+    help="Multiplies the work done by every program (default: 1)",
+)
+parser.add_argument(
+    "--repeat",
+    type=int,
+    default=3,
+    help="Runs per executable, the fastest counts (default: 3)",
+)
+parser.add_argument(
+    "--workdir",
+    type=pathlib.Path,
+    default=pathlib.Path("bench_output"),
+    help="Where to write the corpus and executables (default: %(default)s)",
+)
+parser.add_argument(
+    "--output", "-o", type=pathlib.Path, default=None, help="JSON file for the results"
+)
+parser.add_argument(
+    "--baseline",
+    type=pathlib.Path,
+    default=None,
+    help="Results of a previous run to compare against",
+)
+parser.add_argument(
+    "--threshold",
+    type=float,
+    default=0.1,
+    help="Relative slowdown counted as a regression (default: 0.1)",
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    results = run_benchmarks(args)
+    if args.output:
+        report = {"scale": args.scale, "repeat": args.repeat, "results": results}
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+    status = 1 if any("error" in result for result in results) else 0
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())["results"]
+        if compare(results, baseline, args.threshold):
+            status = 1
+    sys.exit(status)
@@ -0,0 +1,386 @@
+"""
+Measures how the compiler stages scale with the size and shape of the input.
+Synthetic programs are generated for a range of values of one knob, every
+stage is timed and its `tracemalloc` peak recorded, and a power law
+`cost = a * value ** exponent` is fitted per stage:
+
+    python -m benchmarks.scalability --vary length
+    python -m benchmarks.scalability --vary depth --values 8 64 512
+
+The exit status is nonzero if the time or memory of any stage grows faster
+than linearly (`exponent > 1 + tolerance`) or a stage fails. Memory of the
+native backend is only partially visible to `tracemalloc`, since the MLIR
+objects live in C++.
+"""
+
+import argparse
+import io
+import json
+import math
+import pathlib
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable, Iterator
+from typing import Any
+
+from .corpus import synthetic
+
+BACKENDS = ["xdsl", "native"]
+
+DEFAULT_VALUES = {
+    "length": [12500, 25000, 50000, 100000],
+    "depth": [4, 16, 64, 256],
+    "loops": [250, 500, 1000, 2000],
+    "io_density": [0.01, 0.02, 0.04, 0.08],
+}
+
+# A stage takes the result of the previous one.
+Stage = tuple[str, Callable[[Any], Any]]
+
+
+def frontend_stages(frontend: str) -> Iterator[Stage]:
+    from py_mlir_bf_compiler_common.oplist import OpList
+    from py_mlir_bf_compiler_common.passes import (
+        CanonicalizePass,
+        FoldCountedPass,
+        run_passes,
+    )
+    from py_mlir_bf_compiler_common.scanner import scan_file
+
+    if frontend == "fast":
+        yield "parse", lambda path: OpList.from_program(scan_file(path))
+    else:
+        from py_mlir_bf_compiler_xdsl.parser import BrainfuckParser
+
+        yield "parse", lambda path: OpList.from_ast(
+            BrainfuckParser().parse(path.read_text()).children
+        )
+    yield "oplist-passes", lambda ops: run_passes(
+        ops, [FoldCountedPass(), CanonicalizePass()]
+    )
+
+
+def xdsl_stages(frontend: str, staged: bool) -> Iterator[Stage]:
+    from xdsl.context import Context
+    from xdsl.dialects import affine, arith, builtin, func, memref, printf, scf
+    from xdsl.printer import Printer
+
+    from py_mlir_bf_compiler_xdsl.dialects.free_brainfuck import FreeBrainFuck
+    from py_mlir_bf_compiler_xdsl.dialects.linked_brainfuck import LinkedBrainFuck
+    from py_mlir_bf_compiler_xdsl.gen_mlir import GenMLIR
+    from py_mlir_bf_compiler_xdsl.rewrites.lower_free_to_linked_bf import (
+        LowerFreeToLinkedBfPass,
+    )
+    from py_mlir_bf_compiler_xdsl.rewrites.lower_linked_to_builtin import (
+        LowerLinkedToBuiltinBfPass,
+    )
+    from py_mlir_bf_compiler_xdsl.rewrites.outline import OutlinePass
+    from py_mlir_bf_compiler_xdsl.rewrites.partial_evaluate import (
+        PartialEvaluatePass,
+    )
+    from py_mlir_bf_compiler_xdsl.rewrites.propagate_cell_values import (
+        PropagateCellValuesPass,
+    )
+    from py_mlir_bf_compiler_xdsl.rewrites.recognize_idioms import (
+        RecognizeIdiomsPass,
+    )
+    from py_mlir_bf_compiler_xdsl.rewrites.share_loops import ShareLoopsPass
+    from py_mlir_bf_compiler_xdsl.rewrites.sink_moves import SinkMovesPass
+
+    ctx = Context()
+    for dialect in (
+        affine.Affine,
+        arith.Arith,
+        builtin.Builtin,
+        func.Func,
+        memref.MemRef,
+        printf.Printf,
+        scf.Scf,
+        FreeBrainFuck,
+        LinkedBrainFuck,
+    ):
+        ctx.load_dialect(dialect)
+
+    def gen_mlir(ops):
+        gen = GenMLIR()
+        gen.gen_main_func(ops, linked=not staged)
+        return gen.module
+
+    def module_pass(pass_):
+        def apply(module):
+            pass_.apply(ctx, module)
+            return module
+
+        return apply
+
+    def print_module(module):
+        Printer(stream=io.StringIO()).print_op(module)
+
+    yield from frontend_stages(frontend)
+    yield "gen-mlir", gen_mlir
+    if staged:
+        yield "lower-free-to-linked", module_pass(LowerFreeToLinkedBfPass())
+    yield "recognize-idioms", module_pass(RecognizeIdiomsPass())
+    yield "sink-moves", module_pass(SinkMovesPass())
+    yield "partial-evaluate", module_pass(PartialEvaluatePass())
+    yield "propagate-cell-values", module_pass(PropagateCellValuesPass())
+    yield "share-loops", module_pass(ShareLoopsPass())
+    yield "outline-segments", module_pass(OutlinePass())
+    yield "lower-linked-to-builtin", module_pass(
+        LowerLinkedToBuiltinBfPass(io_mode="line", tape="global")
+    )
+    yield "print", print_module
+
+
+def native_stages(frontend: str, staged: bool) -> Iterator[Stage]:
+    from mlir.dialects import irdl
+    from mlir.ir import Context, Location
+    from mlir.passmanager import PassManager
+
+    from py_mlir_bf_compiler_native.dialects.free_brainfuck import FreeBrainFuck
+    from py_mlir_bf_compiler_native.dialects.linked_brainfuck import (
+        LinkedBrainFuck,
+    )
+    from py_mlir_bf_compiler_native.gen_mlir import GenMLIR
+    from py_mlir_bf_compiler_native.rewrites.lower_free_to_linked_bf import (
+        LowerFreeToLinkedBfPass,
+    )
+    from py_mlir_bf_compiler_native.rewrites.lower_linked_to_builtin import (
+        LowerLinkedToBuiltinBfPass,
+    )
+    from py_mlir_bf_compiler_native.rewrites.outline import OutlinePass
+    from py_mlir_bf_compiler_native.rewrites.partial_evaluate import (
+        PartialEvaluatePass,
+    )
+    from py_mlir_bf_compiler_native.rewrites.propagate_cell_values import (
+        PropagateCellValuesPass,
+    )
+    from py_mlir_bf_compiler_native.rewrites.recognize_idioms import (
+        RecognizeIdiomsPass,
+    )
+    from py_mlir_bf_compiler_native.rewrites.share_loops import ShareLoopsPass
+    from py_mlir_bf_compiler_native.rewrites.sink_moves import SinkMovesPass
+
+    def gen_mlir(ops):
+        # The context lives as long as the module, which is kept by the
+        # following stages.
+        context = Context()
+        with context, Location.unknown():
+            irdl.load_dialects(FreeBrainFuck())
+            irdl.load_dialects(LinkedBrainFuck())
+            gen = GenMLIR("synthetic.bf")
+            gen.gen_main_func(ops, linked=not staged)
+        return context, gen.module
+
+    def module_pass(pass_):
+        def apply(state):
+            context, module = state
+            with context:
+                pm = PassManager()
+                pm.enable_verifier(False)
+                pm.add(pass_)
+                pm.run(module.operation)
+            return state
+
+        return apply
+
+    def print_module(state):
+        _, module = state
+        module.operation.print(file=io.StringIO())
+
+    yield from frontend_stages(frontend)
+    yield "gen-mlir", gen_mlir
+    if staged:
+        yield "lower-free-to-linked", module_pass(LowerFreeToLinkedBfPass)
+    yield "recognize-idioms", module_pass(RecognizeIdiomsPass)
+    yield "sink-moves", module_pass(SinkMovesPass)
+    yield "partial-evaluate", module_pass(PartialEvaluatePass())
+    yield "propagate-cell-values", module_pass(PropagateCellValuesPass())
+    yield "share-loops", module_pass(ShareLoopsPass())
+    yield "outline-segments", module_pass(OutlinePass())
+    yield "lower-linked-to-builtin", module_pass(
+        LowerLinkedToBuiltinBfPass("line", "global")
+    )
+    yield "print", print_module
+
+
+STAGES = {"xdsl": xdsl_stages, "native": native_stages}
+
+
+def run_pipeline(
+    backend: str, frontend: str, staged: bool, source: pathlib.Path, trace: bool
+) -> dict[str, float]:
+    """
+    Runs all stages on `source`, generating the free dialect and lowering it
+    if `staged` is set and the linked dialect directly otherwise. Returns the
+    wall time of every stage, or with `trace` the peak of the memory
+    allocated during it in bytes.
+    """
+    measurements = {}
+    value: Any = source
+    if trace:
+        tracemalloc.start()
+    try:
+        for name, stage in STAGES[backend](frontend, staged):
+            if trace:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                value = stage(value)
+                measurements[name] = tracemalloc.get_traced_memory()[1] - before
+            else:
+                start = time.perf_counter()
+                value = stage(value)
+                measurements[name] = time.perf_counter() - start
+    finally:
+        if trace:
+            tracemalloc.stop()
+    return measurements
+
+
+def fit_exponent(values: list[float], costs: list[float]) -> float:
+    """The least squares slope of the costs over the values on a log-log scale."""
+    points = [
+        (math.log(value), math.log(cost))
+        for value, cost in zip(values, costs)
+        if value > 0 and cost > 0
+    ]
+    if len(points) < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if variance == 0:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+
+def measure(args: argparse.Namespace, backend: str) -> dict:
+    """Returns the measurements and fitted exponents of all stages of a backend."""
+    values = args.values or DEFAULT_VALUES[args.vary]
+    knobs = {
+        "length": args.length,
+        "depth": args.depth,
+        "loops": args.loops,
+        "io_density": args.io_density,
+    }
+    times: dict[str, list[float]] = {}
+    memory: dict[str, list[float]] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for value in values:
+            source = pathlib.Path(directory) / f"synthetic_{value}.bf"
+            source.write_text(synthetic(**(knobs | {args.vary: value})))
+            best: dict[str, float] = {}
+            for _ in range(args.repeat):
+                for name, seconds in run_pipeline(
+                    backend, args.frontend, args.staged, source, trace=False
+                ).items():
+                    best[name] = min(best.get(name, math.inf), seconds)
+            for name, seconds in best.items():
+                times.setdefault(name, []).append(seconds)
+            peaks = run_pipeline(
+                backend, args.frontend, args.staged, source, trace=True
+            )
+            for name, peak in peaks.items():
+                memory.setdefault(name, []).append(peak)
+            print(
+                f"{backend} {args.vary}={value}: "
+                + " ".join(f"{name}={seconds:.3f}s" for name, seconds in best.items()),
+                file=sys.stderr,
+            )
+    return {
+        "values": values,
+        "stages": {
+            name: {
+                "time": times[name],
+                "memory": memory[name],
+                "time_exponent": fit_exponent(values, times[name]),
+                "memory_exponent": fit_exponent(values, memory[name]),
+            }
+            for name in times
+        },
+    }
+
+
+parser = argparse.ArgumentParser(
+    description="Measure how the compiler stages scale with the input"
+)
+parser.add_argument(
+    "--backend", nargs="+", choices=BACKENDS, default=BACKENDS, help="(default: all)"
+)
+parser.add_argument(
+    "--frontend",
+    choices=["fast", "lark"],
+    default="fast",
+    help="(default: fast)",
+)
+parser.add_argument(
+    "--staged",
+    action=argparse.BooleanOptionalAction,
+    default=False,
+    help="Generate the free dialect and time its lowering to the linked "
+    "dialect, as the command line does with --staged, instead of generating "
+    "the linked dialect directly (default: off)",
+)
+parser.add_argument(
+    "--vary",
+    choices=list(DEFAULT_VALUES),
+    default="length",
+    help="The knob to sweep, the others stay fixed (default: length)",
+)
+parser.add_argument(
+    "--values",
+    nargs="+",
+    type=float,
+    default=None,
+    help="Values of the swept knob (default: depends on the knob)",
+)
+parser.add_argument("--length", type=int, default=20000, help="(default: 20000)")
+parser.add_argument("--depth", type=int, default=8, help="(default: 8)")
+parser.add_argument("--loops", type=int, default=500, help="(default: 500)")
+parser.add_argument("--io-density", type=float, default=0.01, help="(default: 0.01)")
+parser.add_argument(
+    "--repeat",
+    type=int,
+    default=3,
+    help="Timed runs per value, the fastest counts (default: 3)",
+)
+parser.add_argument(
+    "--tolerance",
+    type=float,
+    default=0.3,
+    help="How far above 1 the fitted exponent of a stage may be before it "
+    "counts as superlinear (default: 0.3)",
+)
+parser.add_argument(
+    "--output", "-o", type=pathlib.Path, default=None, help="JSON file for the results"
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.values and args.vary != "io_density":
+        args.values = [int(value) for value in args.values]
+    results = {"vary": args.vary, "staged": args.staged, "backends": {}}
+    status = 0
+    for backend in args.backend:
+        try:
+            result = measure(args, backend)
+        except (ImportError, RecursionError) as e:
+            print(f"{backend}: FAILED: {e!r}", file=sys.stderr)
+            results["backends"][backend] = {"error": repr(e)}
+            status = 1
+            continue
+        results["backends"][backend] = result
+        for name, stage in result["stages"].items():
+            for metric in ("time", "memory"):
+                exponent = stage[f"{metric}_exponent"]
+                superlinear = exponent > 1 + args.tolerance
+                status |= superlinear
+                print(
+                    f"{'SUPERLINEAR' if superlinear else 'ok':<11} {backend:<7}"
+                    f" {name:<24} {metric:<6} ~ {args.vary}^{exponent:.2f}"
+                )
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+    sys.exit(status)
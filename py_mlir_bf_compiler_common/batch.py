@@ -0,0 +1,121 @@
+import argparse
+import contextlib
+import functools
+import io
+import multiprocessing
+import os
+import pathlib
+import time
+import typing
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+
+CompileFile = Callable[[pathlib.Path, pathlib.Path], None]
+"""Compiles a source to an output file, raising on failure."""
+
+
+@dataclass(frozen=True)
+class BatchResult:
+    source: pathlib.Path
+    output: pathlib.Path
+    seconds: float
+    error: str | None = None
+
+
+def job_count(value: str) -> int:
+    jobs = int(value)
+    if jobs < 1:
+        raise argparse.ArgumentTypeError("at least one job is needed")
+    return jobs
+
+
+def mirrored_outputs(
+    sources: Sequence[pathlib.Path],
+    output_dir: pathlib.Path,
+    suffix: str,
+    root: pathlib.Path | None = None,
+) -> list[tuple[pathlib.Path, pathlib.Path]]:
+    """
+    Pairs every source with its output in `output_dir`, at the same path
+    relative to `root` as the source, with `suffix` instead of its own.
+    `root` defaults to the deepest directory containing all sources.
+    """
+    absolute = [source.resolve() for source in sources]
+    if root is None:
+        root = pathlib.Path(os.path.commonpath([path.parent for path in absolute]))
+    root = root.resolve()
+    jobs = []
+    for source, path in zip(sources, absolute):
+        if not path.is_relative_to(root):
+            raise ValueError(f"{source} is not below {root}")
+        jobs.append((source, (output_dir / path.relative_to(root)).with_suffix(suffix)))
+    return jobs
+
+
+def _compile(
+    compile_file: CompileFile, job: tuple[pathlib.Path, pathlib.Path]
+) -> BatchResult:
+    source, output = job
+    start = time.perf_counter()
+    # Diagnostics are reported with the status of the file instead of being
+    # interleaved with those of the other workers.
+    stderr = io.StringIO()
+    try:
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with contextlib.redirect_stderr(stderr):
+            compile_file(source, output)
+    except Exception as e:
+        output.unlink(missing_ok=True)
+        error = "\n".join(filter(None, [stderr.getvalue().strip(), str(e)]))
+        return BatchResult(source, output, time.perf_counter() - start, error)
+    return BatchResult(source, output, time.perf_counter() - start)
+
+
+def compile_batch(
+    jobs: Sequence[tuple[pathlib.Path, pathlib.Path]],
+    compile_file: CompileFile,
+    processes: int,
+    report: typing.TextIO,
+    initializer: Callable[[], None] | None = None,
+) -> int:
+    """
+    Compiles every source of `jobs` to its output on a pool of `processes`
+    workers, which are set up once by `initializer` and then compile many
+    files each. `compile_file` and `initializer` must be picklable, i.e.
+    module-level functions or partial applications of them. Reports the
+    status of every file as it finishes and a summary to `report`, and
+    returns 1 if any file failed.
+    """
+    start = time.perf_counter()
+    run = functools.partial(_compile, compile_file)
+    if processes == 1:
+        if initializer is not None:
+            initializer()
+        results: typing.Iterable[BatchResult] = map(run, jobs)
+        pool: contextlib.AbstractContextManager = contextlib.nullcontext()
+    else:
+        pool = multiprocessing.Pool(processes, initializer)
+        # Small chunks keep the workers busy when file sizes vary, but save
+        # a round trip per file for thousands of small ones.
+        chunksize = max(1, min(16, len(jobs) // (processes * 4)))
+        results = pool.imap_unordered(run, jobs, chunksize)
+    failed = 0
+    with pool:
+        for result in results:
+            if result.error is None:
+                print(
+                    f"ok      {result.source} -> {result.output} "
+                    f"({result.seconds:.2f}s)",
+                    file=report,
+                )
+                continue
+            failed += 1
+            print(f"FAILED  {result.source} ({result.seconds:.2f}s)", file=report)
+            for line in result.error.splitlines():
+                print(f"        {line}", file=report)
+    print(
+        f"{len(jobs) - failed} compiled, {failed} failed "
+        f"in {time.perf_counter() - start:.2f}s",
+        file=report,
+    )
+    return 1 if failed else 0
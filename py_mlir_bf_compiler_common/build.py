@@ -0,0 +1,300 @@
+import functools
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+DEFAULT_CACHE_SIZE = 1 << 30
+
+
+def default_cache_dir() -> pathlib.Path:
+    base = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+    return pathlib.Path(base) / "py_mlir_bf_compiler"
+
+
+def _hash(*parts: str | bytes) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        data = part.encode() if isinstance(part, str) else part
+        # Length-prefix every part, so that ("ab", "c") != ("a", "bc").
+        digest.update(len(data).to_bytes(8, "little"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+@functools.cache
+def package_fingerprint(*packages: str) -> str:
+    """Hashes the sources of the given packages, so that changes invalidate."""
+    parts: list[str | bytes] = []
+    for package in packages:
+        root = pathlib.Path(sys.modules[package].__file__ or "").parent
+        for path in sorted(root.rglob("*")):
+            if path.suffix in (".py", ".lark"):
+                parts += [str(path.relative_to(root)), path.read_bytes()]
+    return _hash(*parts)
+
+
+@functools.cache
+def tool_version(executable: str) -> str:
+    result = subprocess.run(
+        [executable, "--version"], capture_output=True, check=True, text=True
+    )
+    return result.stdout + result.stderr
+
+
+class ArtifactCache:
+    """
+    A content-addressed on-disk store of build artifacts. The access time of
+    an artifact is tracked via its mtime, and the least recently used ones
+    are evicted once the total size exceeds `max_size` bytes.
+    """
+
+    def __init__(self, directory: pathlib.Path, max_size: int = DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+    def path(self, key: str) -> pathlib.Path:
+        return self.directory / key[:2] / key
+
+    def get(self, key: str) -> pathlib.Path | None:
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key: str, artifact: pathlib.Path) -> pathlib.Path:
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Copy next to the destination first, so readers never see a
+        # partially written artifact.
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as h:
+            temporary = pathlib.Path(h.name)
+        shutil.copy2(artifact, temporary)
+        os.replace(temporary, path)
+        os.utime(path)
+        self.evict()
+        return path
+
+    def evict(self):
+        entries = []
+        total = 0
+        for path in self.directory.glob("??/*"):
+            if len(path.name) != 64:
+                # Skip temporary files of concurrent writers.
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+@dataclass(frozen=True)
+class ToolStage:
+    """
+    A build step running an external tool. `command` may refer to the input
+    and output file as `{input}` and `{output}`; its first element is the
+    default executable, which can be overridden by the environment variable
+    `variable`.
+    """
+
+    suffix: str
+    variable: str
+    command: tuple[str, ...]
+
+    def argv(
+        self, input: pathlib.Path | Sequence[pathlib.Path], output: pathlib.Path
+    ) -> list[str]:
+        """Returns the command, with `{input}` standing for all of several inputs."""
+        inputs = [input] if isinstance(input, pathlib.Path) else input
+        argv = [os.environ.get(self.variable, self.command[0])]
+        for argument in self.command[1:]:
+            if argument == "{input}":
+                argv += [str(path) for path in inputs]
+            else:
+                argv.append(argument.format(output=output))
+        return argv
+
+    def key(self, input_key: str) -> str:
+        executable = os.environ.get(self.variable, self.command[0])
+        return _hash(input_key, *self.command[1:], tool_version(executable))
+
+
+MLIR_OPT = ToolStage(
+    ".opt.mlirbc",
+    "MLIR_OPT",
+    (
+        "mlir-opt",
+        # Scalar replacement and generic LICM, as the loops are scf.while
+        # loops with unknown trip counts, which the affine loop passes like
+        # affine-loop-invariant-code-motion and affine-super-vectorize skip.
+        "--affine-scalrep",
+        "--lower-affine",
+        "--loop-invariant-code-motion",
+        "--canonicalize",
+        "--cse",
+        "--convert-scf-to-cf",
+        "--convert-cf-to-llvm",
+        "--convert-func-to-llvm",
+        "--convert-arith-to-llvm",
+        "--expand-strided-metadata",
+        "--normalize-memrefs",
+        "--memref-expand",
+        "--fold-memref-alias-ops",
+        "--finalize-memref-to-llvm",
+        "--reconcile-unrealized-casts",
+        "--emit-bytecode",
+        "{input}",
+        "-o",
+        "{output}",
+    ),
+)
+MLIR_TRANSLATE = ToolStage(
+    ".ll",
+    "MLIR_TRANSLATE",
+    ("mlir-translate", "--mlir-to-llvmir", "{input}", "-o", "{output}"),
+)
+LLC = ToolStage(".s", "LLC", ("llc", "{input}", "-o", "{output}"))
+CLANG = ToolStage(".out", "CC", ("clang", "-g", "{input}", "-o", "{output}"))
+
+
+def _run_stages(
+    name: str,
+    keys: Sequence[str],
+    artifact: pathlib.Path | None,
+    stages: Sequence[ToolStage],
+    directory: pathlib.Path,
+    cache: ArtifactCache | None,
+    log: Callable[[str], None],
+) -> pathlib.Path:
+    """
+    Turns `artifact` into the artifact of the last stage, named `name` with
+    the suffix of the stage, resuming from the last artifact of `keys` (one
+    for the artifact and every stage) that is already cached. `artifact`
+    may only be `None` if one is.
+    """
+    start = 0
+    if cache is not None:
+        for index in reversed(range(len(keys))):
+            cached = cache.get(keys[index])
+            if cached is not None:
+                start, artifact = index, cached
+                if index:
+                    log(f"cached {name}{stages[index - 1].suffix}")
+                break
+    assert artifact is not None
+    for index in range(start + 1, len(keys)):
+        stage = stages[index - 1]
+        result = directory / (name + stage.suffix)
+        subprocess.run(stage.argv(artifact, result), check=True)
+        log(f"built {result.name}")
+        if cache is not None:
+            cache.put(keys[index], result)
+        artifact = result
+    return artifact
+
+
+def _chain(key: str, stages: Sequence[ToolStage]) -> list[str]:
+    """The keys of an artifact and of every stage run on it in turn."""
+    keys = [key]
+    for stage in stages:
+        keys.append(stage.key(keys[-1]))
+    return keys
+
+
+def build(
+    source: pathlib.Path,
+    options: dict,
+    fingerprint: str,
+    generate: Callable[[pathlib.Path], list[pathlib.Path]],
+    stages: Sequence[ToolStage],
+    link: ToolStage,
+    output: pathlib.Path,
+    cache: ArtifactCache | None,
+    jobs: int = 1,
+    log: Callable[[str], None] = lambda message: None,
+):
+    """
+    Builds `output` from `source`: `generate` writes the MLIR in-process
+    into the given directory, split into parts, and returns their paths.
+    Every stage turns the previous artifact of each part into the next one,
+    running the parts on `jobs` threads, and `link` combines the last
+    artifacts of all parts into `output`. The parts only depend on the
+    module, so the output is the same for every number of jobs.
+
+    Artifacts are looked up in and added to `cache`. The output and the
+    list of parts are keyed by a hash of the source, the `options`, the
+    compiler `fingerprint` and the commands and versions of all tools, the
+    artifacts of a part by a hash of its contents and the tools so far.
+    """
+    key = _hash(source.read_bytes(), json.dumps(options, sort_keys=True), fingerprint)
+    output_key = _chain(key, [*stages, link])[-1]
+    if cache is not None:
+        artifact = cache.get(output_key)
+        if artifact is not None:
+            log(f"cached {source.stem}{link.suffix}")
+            shutil.copy(artifact, output)
+            return
+
+    with tempfile.TemporaryDirectory() as name:
+        directory = pathlib.Path(name)
+        # Resume from the cached artifacts of the parts, unless one of them
+        # has none left.
+        parts: list[pathlib.Path | None] = []
+        part_keys: list[list[str]] = []
+        if cache is not None and (listing := cache.get(key)) is not None:
+            part_keys = [_chain(part, stages) for part in listing.read_text().split()]
+            parts = [None] * len(part_keys)
+            if not all(any(map(cache.get, keys)) for keys in part_keys):
+                part_keys = []
+        if not part_keys:
+            parts = list(generate(directory))
+            log(f"generated {len(parts)} parts")
+            part_keys = [_chain(_hash(part.read_bytes()), stages) for part in parts]
+            if cache is not None:
+                for part, keys in zip(parts, part_keys):
+                    cache.put(keys[0], part)
+                listing = directory / "parts"
+                listing.write_text("\n".join(keys[0] for keys in part_keys))
+                cache.put(key, listing)
+
+        with ThreadPoolExecutor(jobs) as pool:
+            artifacts = list(
+                pool.map(
+                    lambda index, keys, part: _run_stages(
+                        f"{source.stem}.{index}",
+                        keys,
+                        part,
+                        stages,
+                        directory,
+                        cache,
+                        log,
+                    ),
+                    range(len(parts)),
+                    part_keys,
+                    parts,
+                )
+            )
+        result = directory / (source.stem + link.suffix)
+        subprocess.run(link.argv(artifacts, result), check=True)
+        log(f"built {result.name}")
+        if cache is not None:
+            cache.put(output_key, result)
+        shutil.copy(result, output)
@@ -0,0 +1,35 @@
+class CellValues:
+    """
+    The values of the cells known at a point of the program. Cells are
+    numbered by their position relative to the index values of the current
+    frame, which changes where the pointer moves by an unknown amount.
+    Cells not in `cells` have the `default` value, `None` means unknown.
+    """
+
+    __slots__ = ("frame", "cells", "default")
+
+    def __init__(
+        self,
+        frame: int,
+        cells: dict[int, int | None] | None = None,
+        default: int | None = None,
+    ) -> None:
+        self.frame = frame
+        self.cells = {} if cells is None else cells
+        self.default = default
+
+    def get(self, cell: int | None) -> int | None:
+        if cell is None:
+            return None
+        return self.cells.get(cell, self.default)
+
+    def put(self, cell: int | None, value: int | None):
+        """Sets the value of a cell, forgetting all values for `None`."""
+        if cell is None:
+            self.cells = {}
+            self.default = None
+        else:
+            self.cells[cell] = value
+
+    def copy(self) -> "CellValues":
+        return CellValues(self.frame, dict(self.cells), self.default)
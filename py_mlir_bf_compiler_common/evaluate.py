@@ -0,0 +1,124 @@
+from enum import IntEnum
+from typing import TypeAlias
+
+
+class Step(IntEnum):
+    """The kinds of instructions run by the `Machine`."""
+
+    MOVE = 0
+    """`(MOVE, delta)`"""
+    ADD = 1
+    """`(ADD, offset, amount)`"""
+    STORE = 2
+    """`(STORE, offset, value)`"""
+    MUL_ADD = 3
+    """`(MUL_ADD, offset, factor, source)`"""
+    SCAN = 4
+    """`(SCAN, stride)`"""
+    OUTPUT = 5
+    """`(OUTPUT, offset)`"""
+    LOOP = 6
+    """`(LOOP, body)` with the instructions of the body in a list."""
+
+
+Instruction: TypeAlias = tuple
+
+
+class _Stop(Exception):
+    pass
+
+
+class Machine:
+    """
+    Runs the input-free operations of a program at compile time, one
+    top-level operation after the other, on a zeroed tape of `tape_size`
+    cells. The pointer wraps around at the ends of the tape if `wrap` is
+    set, leaving the tape otherwise stops the evaluation, as does taking
+    more than `budget` steps, one per instruction and loop iteration.
+    """
+
+    def __init__(self, tape_size: int, wrap: bool, budget: int) -> None:
+        self.tape = bytearray(tape_size)
+        self.pointer = 0
+        self.output = bytearray()
+        self.wrap = wrap
+        self.budget = budget
+        # The previous values of the cells written by the current top-level
+        # operation, to roll it back.
+        self._journal: list[tuple[int, int]] = []
+
+    def run(self, instruction: Instruction) -> bool:
+        """
+        Runs a top-level operation. If the evaluation stops within it, the
+        state from before it is restored and `False` returned.
+        """
+        pointer, output_length = self.pointer, len(self.output)
+        self._journal.clear()
+        try:
+            self._execute(instruction)
+        except _Stop:
+            for cell, value in reversed(self._journal):
+                self.tape[cell] = value
+            self.pointer = pointer
+            del self.output[output_length:]
+            return False
+        return True
+
+    def image(self) -> bytes:
+        """The tape without its trailing zero cells."""
+        return bytes(self.tape.rstrip(b"\0"))
+
+    def _cell(self, offset: int) -> int:
+        cell = self.pointer + offset
+        if 0 <= cell < len(self.tape):
+            return cell
+        if not self.wrap:
+            raise _Stop()
+        return cell % len(self.tape)
+
+    def _store(self, cell: int, value: int):
+        self._journal.append((cell, self.tape[cell]))
+        self.tape[cell] = value & 0xFF
+
+    def _execute(self, instruction: Instruction):
+        tape = self.tape
+        # Per running block: its instructions and the position of the next
+        # one. Blocks below the top-level one are loop bodies.
+        frames: list[list] = [[(instruction,), 0]]
+        while frames:
+            self.budget -= 1
+            if self.budget < 0:
+                raise _Stop()
+            frame = frames[-1]
+            body, position = frame
+            if position == len(body):
+                if len(frames) > 1 and tape[self.pointer]:
+                    frame[1] = 0
+                else:
+                    frames.pop()
+                continue
+            frame[1] = position + 1
+            current = body[position]
+            match current[0]:
+                case Step.MOVE:
+                    self.pointer = self._cell(current[1])
+                case Step.ADD:
+                    cell = self._cell(current[1])
+                    self._store(cell, tape[cell] + current[2])
+                case Step.STORE:
+                    self._store(self._cell(current[1]), current[2])
+                case Step.MUL_ADD:
+                    cell = self._cell(current[1])
+                    source = self._cell(current[3])
+                    self._store(cell, tape[cell] + tape[source] * current[2])
+                case Step.SCAN:
+                    while tape[self.pointer]:
+                        self.budget -= 1
+                        if self.budget < 0:
+                            raise _Stop()
+                        self.pointer = self._cell(current[1])
+                case Step.OUTPUT:
+                    self.output.append(tape[self._cell(current[1])])
+                case Step.LOOP:
+                    if tape[self.pointer]:
+                        frames.append([current[1], 0])
@@ -0,0 +1,139 @@
+import contextlib
+import json
+import pathlib
+import time
+from collections import Counter
+from collections.abc import Iterator
+from typing import TextIO
+
+from .oplist import Opcode, OpList
+
+
+class _Timing:
+    __slots__ = ("name", "seconds", "children")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.seconds = 0.0
+        self.children: dict[str, _Timing] = {}
+
+
+class Timer:
+    """
+    Hierarchical wall clock timing of the compiler stages. Stages are nested
+    by nesting `stage` blocks, repeated stages of the same name add up. The
+    report follows the format of MLIR's `--mlir-timing`.
+    """
+
+    def __init__(self) -> None:
+        self.root = _Timing("Total")
+        self._stack = [self.root]
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        timing = self._stack[-1].children.setdefault(name, _Timing(name))
+        self._stack.append(timing)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timing.seconds += time.perf_counter() - start
+            self._stack.pop()
+
+    def report(self, stream: TextIO):
+        total = time.perf_counter() - self._start
+        rule = "===" + "-" * 73 + "==="
+        print(rule, file=stream)
+        print("Compiler execution time report".center(len(rule)), file=stream)
+        print(rule, file=stream)
+        print(f"  Total Execution Time: {total:.4f} seconds\n", file=stream)
+        print("  ----Wall Time----  ----Name----", file=stream)
+        stack = [(timing, 0) for timing in reversed(self.root.children.values())]
+        while stack:
+            timing, depth = stack.pop()
+            share = 100 * timing.seconds / total if total else 0.0
+            print(
+                f"  {timing.seconds:8.4f} ({share:5.1f}%)  {'  ' * depth}{timing.name}",
+                file=stream,
+            )
+            stack += [
+                (child, depth + 1) for child in reversed(timing.children.values())
+            ]
+        print(f"  {total:8.4f} (100.0%)  Total", file=stream)
+
+
+def oplist_counts(ops: OpList) -> Counter[str]:
+    """Counts the operations of an `OpList` like ops of an `oplist` dialect."""
+    return Counter(
+        {
+            f"oplist.{Opcode(opcode).name.lower()}": count
+            for opcode, count in Counter(ops.opcodes).items()
+        }
+    )
+
+
+class Statistics:
+    """
+    Snapshots of the number of operations per name, taken after every stage
+    of the pipeline. Operations are grouped by their dialect, the prefix of
+    their name.
+    """
+
+    def __init__(self) -> None:
+        self.snapshots: list[tuple[str, Counter[str]]] = []
+
+    def record(self, stage: str, counts: Counter[str]):
+        self.snapshots.append((stage, counts))
+
+    def as_dict(self) -> dict:
+        return {
+            "stages": [
+                {
+                    "stage": stage,
+                    "total": sum(counts.values()),
+                    "dialects": dict(sorted(_by_dialect(counts).items())),
+                    "ops": dict(sorted(counts.items())),
+                }
+                for stage, counts in self.snapshots
+            ]
+        }
+
+    def write_json(self, path: pathlib.Path):
+        path.write_text(json.dumps(self.as_dict(), indent=2) + "\n")
+
+    def report(self, stream: TextIO):
+        previous: Counter[str] = Counter()
+        for stage, counts in self.snapshots:
+            total = sum(counts.values())
+            change = total - sum(previous.values())
+            print(f"=== {stage}: {total} ops ({change:+d}) ===", file=stream)
+            dialects = _by_dialect(counts)
+            previous_dialects = _by_dialect(previous)
+            for dialect in sorted(dialects.keys() | previous_dialects.keys()):
+                print(
+                    _row(dialect, dialects[dialect], previous_dialects[dialect], 2),
+                    file=stream,
+                )
+                for name in sorted(counts.keys() | previous.keys()):
+                    if _dialect(name) == dialect:
+                        print(_row(name, counts[name], previous[name], 4), file=stream)
+            previous = counts
+
+
+def _dialect(name: str) -> str:
+    # The dialects of the xDSL backend are named `bf.free` and `bf.linked`.
+    parts = name.split(".")
+    return ".".join(parts[:2] if parts[0] == "bf" else parts[:1])
+
+
+def _by_dialect(counts: Counter[str]) -> Counter[str]:
+    dialects: Counter[str] = Counter()
+    for name, count in counts.items():
+        dialects[_dialect(name)] += count
+    return dialects
+
+
+def _row(name: str, count: int, previous: int, indent: int) -> str:
+    change = f"({count - previous:+d})" if count != previous else ""
+    return f"{' ' * indent}{name:<{40 - indent}} {count:>8} {change}"
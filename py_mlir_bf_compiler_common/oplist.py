@@ -0,0 +1,160 @@
+from array import array
+from collections.abc import Callable, Iterator
+from enum import IntEnum
+
+import lark
+
+from .scanner import INSTRUCTIONS, Program
+
+Locations = Callable[[], tuple[array, array]]
+
+
+class Opcode(IntEnum):
+    LEFT = 0
+    RIGHT = 1
+    INC = 2
+    DEC = 3
+    OUTPUT = 4
+    INPUT = 5
+    LOOP_START = 6
+    LOOP_END = 7
+    ADD = 8
+    """Adds `arg` to the current cell."""
+    MOVE = 9
+    """Moves the pointer by `arg` cells."""
+
+
+_OPCODES = bytes.maketrans(INSTRUCTIONS, bytes(range(len(INSTRUCTIONS))))
+
+_TOKEN_OPCODES = {
+    "MOVE_LEFT": Opcode.LEFT,
+    "MOVE_RIGHT": Opcode.RIGHT,
+    "INCREMENT": Opcode.INC,
+    "DECREMENT": Opcode.DEC,
+    "OUTPUT": Opcode.OUTPUT,
+    "INPUT": Opcode.INPUT,
+}
+
+
+def _no_locations() -> tuple[array, array]:
+    return array("L"), array("L")
+
+
+class OpList:
+    """
+    A backend-agnostic program representation between the front-ends and
+    the MLIR generation, stored in parallel arrays:
+
+    - `opcodes`: one `Opcode` per operation
+    - `args`: the amount of `ADD`, the delta of `MOVE` and for `LOOP_START`
+      and `LOOP_END` the relative offset to the matching bracket
+    - `positions`: the index of the source instruction the operation stems
+      from, used to look up its line and column in `locations()`, or -1
+    """
+
+    __slots__ = ("opcodes", "args", "positions", "locations")
+
+    opcodes: array
+    args: array
+    positions: array
+    locations: Locations
+
+    def __init__(
+        self,
+        opcodes: array | None = None,
+        args: array | None = None,
+        positions: array | None = None,
+        locations: Locations = _no_locations,
+    ) -> None:
+        self.opcodes = array("B") if opcodes is None else opcodes
+        self.args = array("q") if args is None else args
+        self.positions = array("q") if positions is None else positions
+        self.locations = locations
+
+    def __len__(self) -> int:
+        return len(self.opcodes)
+
+    def append(self, opcode: int, arg: int = 0, position: int = -1):
+        self.opcodes.append(opcode)
+        self.args.append(arg)
+        self.positions.append(position)
+
+    def empty_like(self) -> "OpList":
+        """Returns an empty list sharing the locations of this one."""
+        return OpList(locations=self.locations)
+
+    def link(self) -> "OpList":
+        """
+        Recomputes the jump offsets of all brackets, has to be called after
+        operations were added or removed.
+        """
+        opcodes = self.opcodes
+        args = self.args
+        stack: list[int] = []
+        for index, opcode in enumerate(opcodes):
+            if opcode == Opcode.LOOP_START:
+                stack.append(index)
+            elif opcode == Opcode.LOOP_END:
+                start = stack.pop()
+                args[start] = index - start
+                args[index] = start - index
+        assert not stack, "Unmatched LOOP_START"
+        return self
+
+    @classmethod
+    def from_program(cls, program: Program) -> "OpList":
+        """Converts a scanned program, without copying it per operation."""
+        opcodes = array("B", program.code.translate(_OPCODES))
+        return cls(
+            opcodes,
+            array("q", program.jumps),
+            array("q", range(len(opcodes))),
+            program.locations,
+        )
+
+    @classmethod
+    def from_ast(cls, ast: list[lark.Tree | lark.Token]) -> "OpList":
+        """
+        Converts a Lark syntax tree. Lines and columns are taken from the
+        tokens, the brackets only have a location if the grammar keeps them.
+        """
+        ops = cls()
+        lines = array("L")
+        columns = array("L")
+
+        def position(token: lark.Token | None) -> int:
+            if token is None or token.line is None or token.column is None:
+                lines.append(0)
+                columns.append(0)
+            else:
+                lines.append(token.line)
+                columns.append(token.column)
+            return len(lines) - 1
+
+        pending: list[Iterator[lark.Tree | lark.Token]] = [iter(ast)]
+        loop_ends: list[lark.Token | None] = []
+        while pending:
+            for node in pending[-1]:
+                match node:
+                    case lark.Token(type=kind) if kind in _TOKEN_OPCODES:
+                        ops.append(_TOKEN_OPCODES[kind], 0, position(node))
+                    case lark.Tree(lark.Token("RULE", "loop"), children):
+                        start = end = None
+                        if children and isinstance(children[0], lark.Token):
+                            if children[0].type == "LOOP_START":
+                                start, *children = children
+                        if children and isinstance(children[-1], lark.Token):
+                            if children[-1].type == "LOOP_END":
+                                *children, end = children
+                        ops.append(Opcode.LOOP_START, 0, position(start))
+                        loop_ends.append(end)
+                        pending.append(iter(children))
+                        break
+                    case other:
+                        raise Exception(f"Invalid Token in AST: {other!r}")
+            else:
+                pending.pop()
+                if loop_ends:
+                    ops.append(Opcode.LOOP_END, 0, position(loop_ends.pop()))
+        ops.locations = lambda: (lines, columns)
+        return ops.link()
@@ -0,0 +1,113 @@
+from abc import ABC, abstractmethod
+from collections.abc import Sequence
+from typing import ClassVar
+
+from .instrument import Statistics, Timer, oplist_counts
+from .oplist import Opcode, OpList
+
+# The kind of counted operation an opcode contributes to and its step, `None`
+# means the step is the `arg` of the operation.
+_COUNTED: dict[int, tuple[Opcode, int | None]] = {
+    Opcode.INC: (Opcode.ADD, 1),
+    Opcode.DEC: (Opcode.ADD, -1),
+    Opcode.ADD: (Opcode.ADD, None),
+    Opcode.RIGHT: (Opcode.MOVE, 1),
+    Opcode.LEFT: (Opcode.MOVE, -1),
+    Opcode.MOVE: (Opcode.MOVE, None),
+}
+
+
+def wrap_amount(amount: int) -> int:
+    """Normalize a cell increment to the signed 8 bit range."""
+    return ((amount + 128) & 0xFF) - 128
+
+
+class OpListPass(ABC):
+    """
+    A pass transforming an `OpList` before any MLIR is generated, the
+    equivalent of a `ModulePass` for the mid-level representation.
+    """
+
+    name: ClassVar[str]
+
+    @abstractmethod
+    def apply(self, ops: OpList) -> OpList: ...
+
+
+def run_passes(
+    ops: OpList,
+    passes: Sequence[OpListPass],
+    timer: Timer | None = None,
+    stats: Statistics | None = None,
+) -> OpList:
+    for pass_ in passes:
+        if timer is None:
+            ops = pass_.apply(ops)
+        else:
+            with timer.stage(pass_.name):
+                ops = pass_.apply(ops)
+        if stats is not None:
+            stats.record(pass_.name, oplist_counts(ops))
+    return ops
+
+
+class FoldCountedPass(OpListPass):
+    """
+    Folds runs of `+`/`-` and `>`/`<` into counted `ADD` and `MOVE`
+    operations carrying the net amount, the amount of an `ADD` wrapped to a
+    byte. Runs that cancel out are dropped, and each folded operation keeps
+    the source position of the first in its run.
+    """
+
+    name = "fold-counted"
+
+    def apply(self, ops: OpList) -> OpList:
+        result = ops.empty_like()
+        run_kind: Opcode | None = None
+        run_position = -1
+        total = 0
+
+        def flush():
+            amount = wrap_amount(total) if run_kind == Opcode.ADD else total
+            if run_kind is not None and amount != 0:
+                result.append(run_kind, amount, run_position)
+
+        for opcode, arg, position in zip(ops.opcodes, ops.args, ops.positions):
+            kind, step = _COUNTED.get(opcode, (None, 0))
+            if kind != run_kind:
+                flush()
+                run_kind, run_position, total = kind, position, 0
+            if kind is None:
+                result.append(opcode, arg, position)
+            else:
+                total += arg if step is None else step
+        flush()
+        return result.link()
+
+
+class CanonicalizePass(OpListPass):
+    """
+    Removes operations without effect: `ADD`/`MOVE` by zero and loops that
+    can never be entered, because they start the program (all cells are
+    zero) or directly follow another loop (its exit left the cell zero).
+    """
+
+    name = "canonicalize"
+
+    def apply(self, ops: OpList) -> OpList:
+        result = ops.empty_like()
+        opcodes, args, positions = ops.opcodes, ops.args, ops.positions
+        index = 0
+        while index < len(opcodes):
+            opcode = opcodes[index]
+            if opcode == Opcode.LOOP_START and (
+                not result or result.opcodes[-1] == Opcode.LOOP_END
+            ):
+                index += args[index] + 1
+                continue
+            if opcode in (Opcode.ADD, Opcode.MOVE) and args[index] == 0:
+                index += 1
+                continue
+            result.append(opcode, args[index], positions[index])
+            index += 1
+        return result.link()
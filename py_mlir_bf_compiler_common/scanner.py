@@ -0,0 +1,126 @@
+import mmap
+import pathlib
+import re
+from array import array
+
+INSTRUCTIONS = b"<>+-.,[]"
+LOOP_START = ord("[")
+LOOP_END = ord("]")
+
+_COMMENT_BYTES = bytes(b for b in range(256) if b not in INSTRUCTIONS)
+_BRACKETS = re.compile(rb"[][]")
+_INSTRUCTIONS_AND_NEWLINES = re.compile(rb"[][<>+.,-]|\r\n?|\n")
+_CHUNK_SIZE = 1 << 20
+
+
+class Program:
+    """
+    A scanned Brainfuck program, an alternative to the Lark syntax tree.
+
+    `code` holds one byte per instruction with all comments removed and
+    `jumps` holds the offset to the matching bracket for every `[` and `]`
+    (0 for all other instructions).
+    The source is kept to compute line and column information on demand.
+    """
+
+    __slots__ = ("source", "code", "jumps", "_lines", "_columns")
+
+    source: bytes | mmap.mmap
+    code: bytes
+    jumps: array
+    _lines: array | None
+    _columns: array | None
+
+    def __init__(self, source: bytes | mmap.mmap, code: bytes) -> None:
+        self.source = source
+        self.code = code
+        self._lines = None
+        self._columns = None
+        self.jumps = _match_brackets(self)
+
+    def __len__(self) -> int:
+        return len(self.code)
+
+    def __str__(self) -> str:
+        return self.code.decode("ascii")
+
+    def locations(self) -> tuple[array, array]:
+        """
+        Returns the 1-based lines and columns of every instruction, counted
+        like Lark does on the decoded text (universal newlines, columns in
+        characters). Computed on first use.
+        """
+        if self._lines is None or self._columns is None:
+            self._lines, self._columns = _compute_locations(self.source)
+        return self._lines, self._columns
+
+
+def _compute_locations(source: bytes | mmap.mmap) -> tuple[array, array]:
+    lines = array("L")
+    columns = array("L")
+    line = 1
+    column = 1
+    last = 0
+    for match in _INSTRUCTIONS_AND_NEWLINES.finditer(source):
+        start = match.start()
+        if match.end() - start == 1 and source[start] in INSTRUCTIONS:
+            segment = source[last:start]
+            column += (
+                len(segment)
+                if segment.isascii()
+                else len(segment.decode("utf-8", "replace"))
+            )
+            lines.append(line)
+            columns.append(column)
+            column += 1
+        else:
+            line += 1
+            column = 1
+        last = match.end()
+    return lines, columns
+
+
+def _location(program: Program, index: int) -> str:
+    lines, columns = program.locations()
+    return f"line {lines[index]}, column {columns[index]}"
+
+
+def _match_brackets(program: Program) -> array:
+    code = program.code
+    jumps = array("q", [0]) * len(code)
+    stack: list[int] = []
+    for match in _BRACKETS.finditer(code):
+        index = match.start()
+        if code[index] == LOOP_START:
+            stack.append(index)
+        elif stack:
+            start = stack.pop()
+            jumps[start] = index - start
+            jumps[index] = start - index
+        else:
+            raise ValueError(f"Unmatched ']' at {_location(program, index)}")
+    if stack:
+        raise ValueError(f"Unmatched '[' at {_location(program, stack[-1])}")
+    return jumps
+
+
+def scan(source: bytes | mmap.mmap) -> Program:
+    """Scans a whole program held in memory."""
+    code = bytearray()
+    for offset in range(0, len(source), _CHUNK_SIZE):
+        code += source[offset : offset + _CHUNK_SIZE].translate(None, _COMMENT_BYTES)
+    return Program(source, bytes(code))
+
+
+def scan_file(path: pathlib.Path) -> Program:
+    """
+    Scans a program from a file. Regular files are memory-mapped, so only
+    the instructions are copied into memory, other files are read at once.
+    """
+    with path.open("rb") as h:
+        try:
+            source = mmap.mmap(h.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Empty files and pipes can't be mapped.
+            source = h.read()
+    return scan(source)
@@ -0,0 +1,333 @@
+# A compile server keeping the compiler warm between invocations, and the
+# client replacing the command line of a single compilation with a request to
+# it. Only the standard library is imported, so that the client starts fast.
+import argparse
+import contextlib
+import functools
+import hashlib
+import io
+import json
+import os
+import pathlib
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import typing
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_MEMORY_CACHE_SIZE = 256 << 20
+
+Response = tuple[int, bytes, str]
+"""The exit status, the output and the diagnostics of a compilation."""
+
+CompileRequest = Callable[[list[str], str, bytes], Response]
+"""Compiles the source bytes named like the file with the command line."""
+
+_LENGTHS = struct.Struct("!QQ")
+
+# Options naming files, which the client makes absolute, as the server runs in
+# another directory.
+PATH_OPTIONS = ("--stats-json",)
+# Options whose effects a cached result can not replay: writing files and
+# reporting the time the compilation took.
+UNCACHED_OPTIONS = ("--timing", "--stats-json")
+# Commands of the compiler that are not served, as they write executables or
+# many files, or start a server. The client runs them directly.
+DIRECT_COMMANDS = ("compile", "batch", "serve")
+
+
+def default_socket(package: str) -> pathlib.Path:
+    base = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return pathlib.Path(base) / f"{package}-{os.getuid()}.sock"
+
+
+def _receive(connection: socket.socket, size: int) -> bytes:
+    data = bytearray(size)
+    view = memoryview(data)
+    while view:
+        received = connection.recv_into(view)
+        if not received:
+            raise ConnectionError("connection closed in the middle of a message")
+        view = view[received:]
+    return bytes(data)
+
+
+def send_message(connection: socket.socket, header: dict, payload: bytes = b""):
+    """Sends a JSON header and a payload, each prefixed by its length."""
+    data = json.dumps(header).encode()
+    connection.sendall(_LENGTHS.pack(len(data), len(payload)) + data)
+    connection.sendall(payload)
+
+
+def receive_message(connection: socket.socket) -> tuple[dict, bytes]:
+    header_size, payload_size = _LENGTHS.unpack(_receive(connection, _LENGTHS.size))
+    header = json.loads(_receive(connection, header_size))
+    return header, _receive(connection, payload_size)
+
+
+def _option(argument: str, options: tuple[str, ...]) -> str | None:
+    """
+    Returns the one of `options` that `argument` is, possibly with a value
+    after `=`, or abbreviated, as argparse accepts unique prefixes.
+    """
+    name = argument.split("=", 1)[0]
+    if len(name) <= 2 or not name.startswith("--"):
+        return None
+    return next((option for option in options if option.startswith(name)), None)
+
+
+def absolute_paths(argv: list[str]) -> list[str]:
+    """Returns `argv` with the values of the `PATH_OPTIONS` made absolute."""
+    result: list[str] = []
+    path_follows = False
+    for argument in argv:
+        if path_follows:
+            argument = os.path.abspath(argument)
+            path_follows = False
+        elif _option(argument, PATH_OPTIONS) is not None:
+            if "=" in argument:
+                name, value = argument.split("=", 1)
+                argument = f"{name}={os.path.abspath(value)}"
+            else:
+                path_follows = True
+        result.append(argument)
+    return result
+
+
+def cacheable(argv: list[str]) -> bool:
+    """Whether the result of a compilation with `argv` may be replayed."""
+    return all(_option(argument, UNCACHED_OPTIONS) is None for argument in argv)
+
+
+def capture(run: Callable[[typing.TextIO], int | None]) -> Response:
+    """
+    Runs a compilation writing to the given output, capturing the output and
+    everything printed to stderr, including errors of the argument parser.
+    """
+    # Bytecode is written to the binary buffer below the text output.
+    output = io.TextIOWrapper(io.BytesIO(), write_through=True)
+    stderr = io.StringIO()
+    with contextlib.redirect_stderr(stderr):
+        try:
+            status = run(output) or 0
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            print(e, file=sys.stderr)
+            status = 1
+    return status, typing.cast(io.BytesIO, output.buffer).getvalue(), stderr.getvalue()
+
+
+class ResultCache:
+    """
+    The results of recent compilations in memory, evicting the least
+    recently used ones once their outputs exceed `max_size` bytes.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MEMORY_CACHE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.entries: OrderedDict[str, Response] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Response | None:
+        with self.lock:
+            response = self.entries.get(key)
+            if response is not None:
+                self.entries.move_to_end(key)
+            return response
+
+    def put(self, key: str, response: Response):
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = response
+            self.size += len(response[1])
+            while self.size > self.max_size:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted[1])
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        compile_request: CompileRequest,
+        pool: ProcessPoolExecutor,
+        cache: ResultCache,
+        log: Callable[[str], None],
+    ):
+        super().__init__(str(path), _Handler)
+        self.compile_request = compile_request
+        self.pool = pool
+        self.cache = cache
+        self.log = log
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    server: _Server
+
+    def handle(self):
+        try:
+            header, source = receive_message(self.request)
+        except (ConnectionError, ValueError):
+            return
+        argv = [str(argument) for argument in header["argv"]]
+        name = str(header["source"])
+        key = hashlib.sha256(
+            json.dumps([argv, name]).encode() + b"\0" + source
+        ).hexdigest()
+        cached = cacheable(argv)
+        response = self.server.cache.get(key) if cached else None
+        if response is None:
+            response = self.server.pool.submit(
+                self.server.compile_request, argv, name, source
+            ).result()
+            # Failures may be due to the environment, so only successes are
+            # kept.
+            if cached and response[0] == 0:
+                self.server.cache.put(key, response)
+            self.server.log(f"compiled {name} (status {response[0]})")
+        else:
+            self.server.log(f"cached {name}")
+        status, output, stderr = response
+        with contextlib.suppress(ConnectionError):
+            send_message(self.request, {"status": status, "stderr": stderr}, output)
+
+
+def _in_use(path: pathlib.Path) -> bool:
+    with socket.socket(socket.AF_UNIX) as connection:
+        try:
+            connection.connect(str(path))
+        except OSError:
+            return False
+    return True
+
+
+def _start_worker(initializer: Callable[[], None] | None):
+    # Interrupting the server stops the workers by shutting down the pool.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if initializer is not None:
+        initializer()
+
+
+def serve(
+    path: pathlib.Path,
+    compile_request: CompileRequest,
+    jobs: int,
+    cache_size: int,
+    initializer: Callable[[], None] | None = None,
+    log: Callable[[str], None] = lambda message: None,
+) -> int:
+    """
+    Serves compile requests on the Unix socket `path` until interrupted.
+    Every connection is handled by a thread, which hands the compilation to
+    a pool of `jobs` processes set up once by `initializer`, so several
+    requests are compiled at the same time. Successful results are cached
+    in memory, unless the request writes files or reports timings. Paths in
+    requests must be absolute, as the server runs in its own directory.
+    `compile_request` and `initializer` must be picklable.
+    """
+    if path.exists():
+        if _in_use(path):
+            print(f"A server is already listening on {path}", file=sys.stderr)
+            return 1
+        path.unlink()
+    # Stopping the server by SIGTERM cleans up like an interrupt.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    with ProcessPoolExecutor(
+        jobs, initializer=functools.partial(_start_worker, initializer)
+    ) as pool:
+        # Starts and warms up the workers before the first request arrives.
+        for _ in range(jobs):
+            pool.submit(int)
+        with _Server(
+            path, compile_request, pool, ResultCache(cache_size), log
+        ) as server:
+            log(f"listening on {path}")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                path.unlink(missing_ok=True)
+    return 0
+
+
+client_parser = argparse.ArgumentParser(
+    description="Compile a Brainfuck file on a running compile server, taking "
+    "the same arguments as the compiler. The source must come first. Without "
+    "a server, the compiler is run directly, as are the compile, batch and "
+    "serve commands, which the server does not handle.",
+)
+client_parser.add_argument("source", type=pathlib.Path, help="Brainfuck Source File")
+client_parser.add_argument(
+    "--output",
+    "-o",
+    type=pathlib.Path,
+    default=None,
+    help="Output destination (default: stdout)",
+)
+client_parser.add_argument(
+    "--socket",
+    type=pathlib.Path,
+    default=None,
+    help="Socket of the server (default: the default of the server)",
+)
+client_parser.add_argument(
+    "--fallback",
+    action=argparse.BooleanOptionalAction,
+    default=True,
+    help="Run the compiler directly if no server is listening (default: on)",
+)
+
+
+def client_main(package: str, argv: list[str]) -> int:
+    """
+    Sends the compilation given by the command line `argv` to the server of
+    the compiler `package` and writes its output.
+    """
+    if argv[:1] and argv[0] in DIRECT_COMMANDS:
+        os.execv(sys.executable, [sys.executable, "-m", package, *argv])
+    client_parser.prog = f"{package}.client"
+    args, options = client_parser.parse_known_args(argv)
+    try:
+        source = args.source.read_bytes()
+    except OSError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    with socket.socket(socket.AF_UNIX) as connection:
+        try:
+            connection.connect(str(args.socket or default_socket(package)))
+        except (FileNotFoundError, ConnectionRefusedError):
+            if not args.fallback:
+                print("No compile server is running", file=sys.stderr)
+                return 1
+            output = ["--output", str(args.output)] if args.output else []
+            os.execv(
+                sys.executable,
+                [sys.executable, "-m", package, str(args.source), *output, *options],
+            )
+        send_message(
+            connection,
+            {"argv": absolute_paths(options), "source": str(args.source)},
+            source,
+        )
+        header, output = receive_message(connection)
+
+    sys.stderr.write(header["stderr"])
+    if args.output:
+        args.output.write_bytes(output)
+    else:
+        sys.stdout.buffer.write(output)
+    return header["status"]
@@ -0,0 +1,48 @@
+import functools
+import sys
+import threading
+from collections.abc import Callable
+from typing import ParamSpec, TypeVar
+
+# xDSL verifies, prints and erases nested regions recursively, as does MLIR
+# in C++, with a few frames per nesting level of the program. These allow
+# programs nested about a hundred thousand levels deep.
+RECURSION_LIMIT = 1_000_000
+STACK_SIZE = 1 << 30
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+
+def deep_stack(function: Callable[P, R]) -> Callable[P, R]:
+    """
+    Makes `function` run in a thread of its own with a stack of
+    `STACK_SIZE` bytes and the recursion limit raised to `RECURSION_LIMIT`,
+    so that deeply nested programs do not overflow the stack. Exceptions
+    are raised in the caller.
+    """
+
+    @functools.wraps(function)
+    def run(*args: P.args, **kwargs: P.kwargs) -> R:
+        result: list[R] = []
+        error: list[BaseException] = []
+
+        def target():
+            try:
+                result.append(function(*args, **kwargs))
+            except BaseException as e:
+                error.append(e)
+
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), RECURSION_LIMIT))
+        previous = threading.stack_size(STACK_SIZE)
+        try:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+        finally:
+            threading.stack_size(previous)
+        thread.join()
+        if error:
+            raise error[0]
+        return result[0]
+
+    return run
@@ -0,0 +1,6 @@
+import sys
+
+from py_mlir_bf_compiler_common.serve import client_main
+
+if __name__ == "__main__":
+    sys.exit(client_main(__package__, sys.argv[1:]))
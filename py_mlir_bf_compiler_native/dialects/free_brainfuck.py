@@ -13,6 +13,12 @@ def _create_free_dialect() -> Module:
             irdl.operation_("right")
             irdl.operation_("inc")
             irdl.operation_("dec")
+            with InsertionPoint(irdl.operation_("add").body):
+                amount = irdl.base(base_name="#builtin.integer")
+                irdl.attributes_([amount], ["amount"])
+            with InsertionPoint(irdl.operation_("move").body):
+                delta = irdl.base(base_name="#builtin.integer")
+                irdl.attributes_([delta], ["delta"])
             irdl.operation_("output")
             irdl.operation_("input")
             with InsertionPoint(irdl.operation_("loop").body):
@@ -1,7 +1,34 @@
 from functools import cache
 
 from mlir.dialects import builtin, irdl
-from mlir.ir import InsertionPoint, Location, Module
+from mlir.ir import (
+    Attribute,
+    DenseI8ArrayAttr,
+    InsertionPoint,
+    IntegerAttr,
+    Location,
+    Module,
+)
+
+# Marks loops whose cell is known to be nonzero when they are reached, which
+# skip the first check. A discardable attribute, as IRDL operations can not
+# declare optional ones.
+ENTERED = "bf_linked.entered"
+
+
+def offset_attr(offset: int = 0) -> IntegerAttr:
+    """Builds an index attribute for the `offset`/`source` of an operation."""
+    return IntegerAttr.get(builtin.IndexType.get(), offset)
+
+
+def data_attr(data: bytes) -> DenseI8ArrayAttr:
+    """Builds the `i8` array attribute of a write or tape image."""
+    return DenseI8ArrayAttr.get([((byte + 128) & 0xFF) - 128 for byte in data])
+
+
+def data_bytes(attr: Attribute) -> bytes:
+    """Returns the bytes of the `i8` array attribute of a write or tape image."""
+    return bytes(value & 0xFF for value in DenseI8ArrayAttr(attr))
 
 
 @cache
@@ -15,10 +42,55 @@ def _create_linked_dialect() -> Module:
                     t = irdl.is_(builtin.TypeAttr.get(builtin.IndexType.get()))
                     irdl.operands_([t], ["pos"], [irdl.Variadicity.single])
                     irdl.results_([t], ["new_pos"], [irdl.Variadicity.single])
-            for op in ["inc", "dec", "output", "input"]:
+            for op in ["inc", "dec", "output", "input", "clear"]:
                 with InsertionPoint(irdl.operation_(op).body):
                     t = irdl.is_(builtin.TypeAttr.get(builtin.IndexType.get()))
                     irdl.operands_([t], ["pos"], [irdl.Variadicity.single])
+                    offset = irdl.base(base_name="#builtin.integer")
+                    irdl.attributes_([offset], ["offset"])
+            with InsertionPoint(irdl.operation_("move").body):
+                t = irdl.is_(builtin.TypeAttr.get(builtin.IndexType.get()))
+                irdl.operands_([t], ["pos"], [irdl.Variadicity.single])
+                irdl.results_([t], ["new_pos"], [irdl.Variadicity.single])
+                delta = irdl.base(base_name="#builtin.integer")
+                irdl.attributes_([delta], ["delta"])
+            with InsertionPoint(irdl.operation_("add").body):
+                t = irdl.is_(builtin.TypeAttr.get(builtin.IndexType.get()))
+                irdl.operands_([t], ["pos"], [irdl.Variadicity.single])
+                amount = irdl.base(base_name="#builtin.integer")
+                offset = irdl.base(base_name="#builtin.integer")
+                irdl.attributes_([amount, offset], ["amount", "offset"])
+            # Sets the cell to `value`, e.g. an increment of a known zero.
+            with InsertionPoint(irdl.operation_("set").body):
+                t = irdl.is_(builtin.TypeAttr.get(builtin.IndexType.get()))
+                irdl.operands_([t], ["pos"], [irdl.Variadicity.single])
+                value = irdl.base(base_name="#builtin.integer")
+                offset = irdl.base(base_name="#builtin.integer")
+                irdl.attributes_([value, offset], ["value", "offset"])
+            with InsertionPoint(irdl.operation_("mul_add").body):
+                t = irdl.is_(builtin.TypeAttr.get(builtin.IndexType.get()))
+                irdl.operands_([t], ["pos"], [irdl.Variadicity.single])
+                offset = irdl.base(base_name="#builtin.integer")
+                factor = irdl.base(base_name="#builtin.integer")
+                source = irdl.base(base_name="#builtin.integer")
+                irdl.attributes_(
+                    [offset, factor, source], ["offset", "factor", "source"]
+                )
+            with InsertionPoint(irdl.operation_("scan").body):
+                t = irdl.is_(builtin.TypeAttr.get(builtin.IndexType.get()))
+                irdl.operands_([t], ["pos"], [irdl.Variadicity.single])
+                irdl.results_([t], ["new_pos"], [irdl.Variadicity.single])
+                stride = irdl.base(base_name="#builtin.integer")
+                irdl.attributes_([stride], ["stride"])
+            # Outputs constant bytes, e.g. the output of a precomputed prefix.
+            with InsertionPoint(irdl.operation_("write").body):
+                data = irdl.base(base_name="#builtin.dense_array")
+                irdl.attributes_([data], ["data"])
+            # The initial contents of the tape, starting at its first cell,
+            # the cells after `cells` are zero. Only at the start of `main`.
+            with InsertionPoint(irdl.operation_("tape_image").body):
+                cells = irdl.base(base_name="#builtin.dense_array")
+                irdl.attributes_([cells], ["cells"])
             with InsertionPoint(irdl.operation_("loop").body):
                 t = irdl.is_(builtin.TypeAttr.get(builtin.IndexType.get()))
                 irdl.operands_([t], ["pos"], [irdl.Variadicity.single])
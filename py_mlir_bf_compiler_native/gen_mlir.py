@@ -1,10 +1,30 @@
-from typing import TypeAlias
+from collections.abc import Callable
 
-import lark
-from mlir.dialects import builtin, func
-from mlir.ir import InsertionPoint, Location, Module, Operation
+from mlir.dialects import arith, builtin, func
+from mlir.ir import InsertionPoint, IntegerAttr, Location, Module, Operation, Value
 
-AST: TypeAlias = list[lark.Tree | lark.Token]
+from py_mlir_bf_compiler_common.oplist import Opcode, OpList
+
+from .dialects.linked_brainfuck import offset_attr
+
+SIMPLE_OPS = {
+    Opcode.LEFT: "bf_free.left",
+    Opcode.RIGHT: "bf_free.right",
+    Opcode.INC: "bf_free.inc",
+    Opcode.DEC: "bf_free.dec",
+    Opcode.OUTPUT: "bf_free.output",
+    Opcode.INPUT: "bf_free.input",
+}
+LINKED_MOVES = {
+    Opcode.LEFT: "bf_linked.left",
+    Opcode.RIGHT: "bf_linked.right",
+}
+LINKED_CELL_OPS = {
+    Opcode.INC: "bf_linked.inc",
+    Opcode.DEC: "bf_linked.dec",
+    Opcode.OUTPUT: "bf_linked.output",
+    Opcode.INPUT: "bf_linked.input",
+}
 
 
 class GenMLIR:
@@ -15,66 +35,151 @@ class GenMLIR:
         self.module = Module.create()
         self.filename = filename
 
-    def gen_main_func(self, ast: AST):
+    def gen_main_func(self, ops: OpList, linked: bool = False):
+        """
+        Generates `main` in the free dialect, or directly in the linked
+        dialect if `linked` is set, which skips `LowerFreeToLinkedBfPass`.
+        """
         with InsertionPoint(self.module.body):
             func_type = builtin.FunctionType.get([], [])
 
             def build_body(_):
-                self.gen_instructions(ast)
+                if linked:
+                    self.gen_linked_ops(ops)
+                else:
+                    self.gen_ops(ops)
                 func.ReturnOp([])
 
             func.FuncOp("main", func_type, body_builder=build_body)
 
-    def gen_instructions(self, ast: AST):
-        for op in ast:
-            match op:
-                case lark.Token(line=int() as line, column=int() as column):
-                    loc = Location.file(self.filename, line, column)
-                case lark.Tree(
-                    lark.Token("RULE", "loop"),
-                    [
-                        lark.Token(
-                            "LOOP_START",
-                            line=int() as start_line,
-                            column=int() as start_column,
-                        ),
-                        *_,
-                        lark.Token(
-                            "LOOP_END",
-                            line=int() as end_line,
-                            column=int() as end_column,
-                        ),
-                    ],
-                ):
-                    loc = Location.file(
-                        self.filename, start_line, start_column, end_line, end_column
-                    )
-                case _:
-                    loc = Location.unknown()
-            with loc:
-                match op:
-                    case lark.Token("MOVE_LEFT"):
-                        Operation.create("bf_free.left")
-                    case lark.Token("MOVE_RIGHT"):
-                        Operation.create("bf_free.right")
-                    case lark.Token("INCREMENT"):
-                        Operation.create("bf_free.inc")
-                    case lark.Token("DECREMENT"):
-                        Operation.create("bf_free.dec")
-                    case lark.Token("OUTPUT"):
-                        Operation.create("bf_free.output")
-                    case lark.Token("INPUT"):
-                        Operation.create("bf_free.input")
-                    case lark.Tree(
-                        lark.Token("RULE", "loop"),
-                        [
-                            lark.Token("LOOP_START") as loop_tok,
-                            *children,
-                            lark.Token("LOOP_END"),
-                        ],
-                    ):
-                        op = Operation.create("bf_free.loop", regions=1)
-                        with InsertionPoint(op.regions[0].blocks.append()):
-                            self.gen_instructions(children)
-                    case other:
-                        raise Exception(f"Invalid Token in AST: {other!r}")
+    def locator(self, ops: OpList) -> Callable[[int, int | None], Location]:
+        """
+        Returns a function building the location of the source range from
+        one position of `ops` to another, or of the single position.
+        """
+        lines, columns = ops.locations()
+
+        def known(position: int) -> bool:
+            return 0 <= position < len(lines) and lines[position] != 0
+
+        def location(position: int, end: int | None = None) -> Location:
+            if not known(position) or (end is not None and not known(end)):
+                return Location.unknown()
+            if end is None:
+                return Location.file(self.filename, lines[position], columns[position])
+            return Location.file(
+                self.filename,
+                lines[position],
+                columns[position],
+                lines[end],
+                columns[end],
+            )
+
+        return location
+
+    def gen_ops(self, ops: OpList):
+        """
+        Generates the free dialect operations, keeping the insertion points
+        of open loops on a stack.
+        """
+        location = self.locator(ops)
+        ip = InsertionPoint.current
+        stack: list[InsertionPoint] = []
+        for index, (opcode, arg, position) in enumerate(
+            zip(ops.opcodes, ops.args, ops.positions)
+        ):
+            if opcode == Opcode.LOOP_START:
+                loc = location(position, ops.positions[index + arg])
+                op = Operation.create("bf_free.loop", regions=1, loc=loc, ip=ip)
+                stack.append(ip)
+                ip = InsertionPoint(op.regions[0].blocks.append())
+            elif opcode == Opcode.LOOP_END:
+                ip = stack.pop()
+            elif opcode == Opcode.ADD:
+                amount = IntegerAttr.get(builtin.IntegerType.get_signless(8), arg)
+                Operation.create(
+                    "bf_free.add",
+                    attributes={"amount": amount},
+                    loc=location(position),
+                    ip=ip,
+                )
+            elif opcode == Opcode.MOVE:
+                delta = IntegerAttr.get(builtin.IndexType.get(), arg)
+                Operation.create(
+                    "bf_free.move",
+                    attributes={"delta": delta},
+                    loc=location(position),
+                    ip=ip,
+                )
+            else:
+                Operation.create(SIMPLE_OPS[opcode], loc=location(position), ip=ip)
+
+    def gen_linked_ops(self, ops: OpList):
+        """
+        Generates the linked dialect operations, threading the index through
+        them just like `LowerFreeToLinkedBfPass`.
+        """
+        location = self.locator(ops)
+        index_type = builtin.IndexType.get()
+        ip = InsertionPoint.current
+        index: Value = arith.ConstantOp(index_type, 0).result
+        stack: list[tuple[InsertionPoint, Operation]] = []
+        for position_index, (opcode, arg, position) in enumerate(
+            zip(ops.opcodes, ops.args, ops.positions)
+        ):
+            if opcode == Opcode.LOOP_START:
+                loc = location(position, ops.positions[position_index + arg])
+                loop = Operation.create(
+                    "bf_linked.loop",
+                    operands=[index],
+                    results=[index_type],
+                    regions=1,
+                    loc=loc,
+                    ip=ip,
+                )
+                body = loop.regions[0].blocks.append(index_type)
+                stack.append((ip, loop))
+                ip = InsertionPoint(body)
+                index = body.arguments[0]
+            elif opcode == Opcode.LOOP_END:
+                ip_after, loop = stack.pop()
+                Operation.create(
+                    "bf_linked.loop_end", operands=[index], loc=loop.location, ip=ip
+                )
+                ip = ip_after
+                index = loop.results[0]
+            elif opcode == Opcode.ADD:
+                amount = IntegerAttr.get(builtin.IntegerType.get_signless(8), arg)
+                Operation.create(
+                    "bf_linked.add",
+                    operands=[index],
+                    attributes={"amount": amount, "offset": offset_attr()},
+                    loc=location(position),
+                    ip=ip,
+                )
+            elif opcode == Opcode.MOVE:
+                delta = IntegerAttr.get(index_type, arg)
+                index = Operation.create(
+                    "bf_linked.move",
+                    operands=[index],
+                    results=[index_type],
+                    attributes={"delta": delta},
+                    loc=location(position),
+                    ip=ip,
+                ).results[0]
+            elif opcode in LINKED_MOVES:
+                index = Operation.create(
+                    LINKED_MOVES[opcode],
+                    operands=[index],
+                    results=[index_type],
+                    loc=location(position),
+                    ip=ip,
+                ).results[0]
+            else:
+                Operation.create(
+                    LINKED_CELL_OPS[opcode],
+                    operands=[index],
+                    attributes={"offset": offset_attr()},
+                    loc=location(position),
+                    ip=ip,
+                )
@@ -1,37 +1,50 @@
-from typing import Protocol
+from collections.abc import Iterator
 
 from mlir.dialects import arith, builtin
-from mlir.ir import InsertionPoint, Location, Operation, OpView
+from mlir.ir import InsertionPoint, Location, Operation, OpView, Value
 
+from ..dialects.linked_brainfuck import offset_attr
 
-class Visitor(Protocol):
-    def enter(self, op: OpView) -> bool: ...
-    def leave(self, op: OpView) -> None: ...
 
+class FreeToLinkedLowering:
+    """
+    Lowers the free dialect in a function to the linked dialect in a single
+    pass over its operations. The blocks of the enclosing loops are kept on
+    an explicit stack instead of recursing into them, so the nesting depth
+    is only limited by memory. All state lives in the instance, lowerings
+    of separate modules can run concurrently.
+    """
 
-def walk(op: OpView, visitor: Visitor):
-    if visitor.enter(op):
-        for region in op.regions:
-            for block in region.blocks:
-                for block_op in block.operations:
-                    walk(block_op, visitor)
-        visitor.leave(op)
-
+    def __init__(self) -> None:
+        # The current index of every block being lowered, innermost last.
+        self.index: list[Value] = []
+        # The operations left to lower in those blocks and the loop whose
+        # body the block is (`None` for the function body).
+        self.pending: list[tuple[Iterator[OpView], Operation | None]] = []
 
-class FreeToLinkedVisitor(Visitor):
-    index: list = []
+    def lower(self, function: Operation):
+        body = function.regions[0].blocks[0]
+        with InsertionPoint.at_block_begin(body), function.location:
+            start = arith.ConstantOp(builtin.IndexType.get(), 0)
+        self.index = [start.results[0]]
+        self.pending = [(iter(body.operations), None)]
+        while self.pending:
+            ops, loop = self.pending[-1]
+            # The iterator already points past `op`, so replacing it is safe.
+            op = next(ops, None)
+            if op is not None:
+                self.lower_op(op)
+                continue
+            self.pending.pop()
+            index = self.index.pop()
+            if loop is not None:
+                with loop.location:
+                    loop.regions[0].blocks[0].append(
+                        Operation.create("bf_linked.loop_end", operands=[index])
+                    )
 
-    def enter(self, op: OpView) -> bool:
+    def lower_op(self, op: OpView):
         match op.operation:
-            case Operation(name="func.func"):
-                with (
-                    InsertionPoint.at_block_begin(op.operation.regions[0].blocks[0]),
-                    op.operation.location,
-                ):
-                    new_op = arith.ConstantOp(builtin.IndexType.get(), 0)
-                assert len(self.index) == 0
-                self.index = [new_op.results[0]]
-                return True
             case Operation(name="bf_free.loop"):
                 with InsertionPoint.after(op.operation), op.operation.location:
                     new_op = Operation.create(
@@ -41,17 +54,13 @@ class FreeToLinkedVisitor(Visitor):
                         regions=1,
                     )
                 op.operation.regions[0].blocks[0].append_to(new_op.regions[0])
-                new_op.regions[0].blocks[0].add_argument(
-                    builtin.IndexType.get(), Location.unknown()
-                )
+                block = new_op.regions[0].blocks[0]
+                block.add_argument(builtin.IndexType.get(), Location.unknown())
                 op.operation.detach_from_parent()
 
                 self.index[-1] = new_op.results[0]
-                self.index.append(new_op.regions[0].blocks[0].arguments[0])
-                walk(OpView(new_op), self)
-                self.index.pop()
-
-                return False
+                self.index.append(block.arguments[0])
+                self.pending.append((iter(block.operations), new_op))
             case Operation(name="bf_free.left"):
                 with InsertionPoint.after(op.operation), op.operation.location:
                     new_op = Operation.create(
@@ -70,53 +79,65 @@ class FreeToLinkedVisitor(Visitor):
                     )
                 op.operation.detach_from_parent()
                 self.index[-1] = new_op.results[0]
+            case Operation(name="bf_free.move"):
+                with InsertionPoint.after(op.operation), op.operation.location:
+                    new_op = Operation.create(
+                        "bf_linked.move",
+                        operands=[self.index[-1]],
+                        results=[builtin.IndexType.get()],
+                        attributes={"delta": op.operation.attributes["delta"]},
+                    )
+                op.operation.detach_from_parent()
+                self.index[-1] = new_op.results[0]
+            case Operation(name="bf_free.add"):
+                with InsertionPoint.after(op.operation), op.operation.location:
+                    new_op = Operation.create(
+                        "bf_linked.add",
+                        operands=[self.index[-1]],
+                        attributes={
+                            "amount": op.operation.attributes["amount"],
+                            "offset": offset_attr(),
+                        },
+                    )
+                op.operation.detach_from_parent()
             case Operation(name="bf_free.inc"):
                 with InsertionPoint.after(op.operation), op.operation.location:
                     new_op = Operation.create(
-                        "bf_linked.inc", operands=[self.index[-1]]
+                        "bf_linked.inc",
+                        operands=[self.index[-1]],
+                        attributes={"offset": offset_attr()},
                     )
                 op.operation.detach_from_parent()
             case Operation(name="bf_free.dec"):
                 with InsertionPoint.after(op.operation), op.operation.location:
                     new_op = Operation.create(
-                        "bf_linked.dec", operands=[self.index[-1]]
+                        "bf_linked.dec",
+                        operands=[self.index[-1]],
+                        attributes={"offset": offset_attr()},
                     )
                 op.operation.detach_from_parent()
             case Operation(name="bf_free.output"):
                 with InsertionPoint.after(op.operation), op.operation.location:
                     new_op = Operation.create(
-                        "bf_linked.output", operands=[self.index[-1]]
+                        "bf_linked.output",
+                        operands=[self.index[-1]],
+                        attributes={"offset": offset_attr()},
                     )
                 op.operation.detach_from_parent()
             case Operation(name="bf_free.input"):
                 with InsertionPoint.after(op.operation), op.operation.location:
                     new_op = Operation.create(
-                        "bf_linked.input", operands=[self.index[-1]]
+                        "bf_linked.input",
+                        operands=[self.index[-1]],
+                        attributes={"offset": offset_attr()},
                     )
                 op.operation.detach_from_parent()
-            case Operation(name="bf_linked.loop"):
-                return True
-            case Operation(name="builtin.module"):
-                return True
-
-        return False
-
-    def leave(self, op: OpView):
-
-        match op.operation:
-            case Operation(name="func.func"):
-                self.index.pop()
-            case Operation(name="bf_linked.loop"):
-                with op.operation.location:
-                    op.operation.regions[0].blocks[0].append(
-                        Operation.create(
-                            "bf_linked.loop_end", operands=[self.index[-1]]
-                        )
-                    )
 
 
 def LowerFreeToLinkedBfPass(op, pass_):
     """
     A pass for lowering operations in the free dialect to linked dialect.
     """
-    walk(op, FreeToLinkedVisitor())
+    for function in list(op.regions[0].blocks[0].operations):
+        if function.operation.name == "func.func":
+            FreeToLinkedLowering().lower(function.operation)
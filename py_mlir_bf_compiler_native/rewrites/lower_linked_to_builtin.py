@@ -1,21 +1,441 @@
-from mlir.dialects import arith, builtin, func, llvm, memref, scf
-from mlir.ir import InsertionPoint, Operation, OpView
+from typing import Literal, TypeAlias
+
+from mlir.dialects import affine, arith, builtin, func, llvm, memref, scf
+from mlir.ir import (
+    AffineAddExpr,
+    AffineConstantExpr,
+    AffineMap,
+    AffineMapAttr,
+    AffineModExpr,
+    AffineSymbolExpr,
+    Block,
+    FlatSymbolRefAttr,
+    InsertionPoint,
+    IntegerAttr,
+    Location,
+    Operation,
+    OpView,
+    StringAttr,
+    Value,
+)
 from mlir.rewrite import (
     PatternRewriter,
     RewritePatternSet,
     apply_patterns_and_fold_greedily,
 )
 
+from ..dialects.linked_brainfuck import ENTERED, data_bytes
+from .pointer_range import loop_positions, pointer_range
+from .sink_moves import MEMORY_OPS, move_delta, shift_offsets
+
 MEMORY_SIZE = 1 << 15
 MEMORY_TYPE = lambda: builtin.IntegerType.get_signless(8)
 
+TapeAllocation: TypeAlias = Literal["global", "stack", "heap"]
+TAPE = "bf_tape"
+TAPE_IMAGE = "bf_tape_image"
+
+BoundsMode: TypeAlias = Literal["wrap", "check", "unchecked"]
+BOUNDS_ERROR = "bf_bounds_error"
+BOUNDS_MESSAGE = "bf_bounds_message"
+BOUNDS_MESSAGE_TEXT = b"bf: pointer out of bounds\n"
+
+IOMode: TypeAlias = Literal["unbuffered", "line", "full"]
+IO_BUFFER_SIZE = 1 << 16
+SYS_READ = 0
+SYS_WRITE = 1
+STDIN = 0
+STDOUT = 1
+STDERR = 2
+SYS_EXIT_GROUP = 231
+FLUSH_OUTPUT = "bf_flush_output"
+REFILL_INPUT = "bf_refill_input"
+OUTPUT_DATA = "bf_output_data"
+MEMCHR = "memchr"
+MEMRCHR = "memrchr"
+
+
+def element_ptr(buffer: Value, index: Value) -> Value:
+    """
+    Computes an llvm pointer to the byte at `index` of the 1-d `buffer`.
+    Has to be called with an insertion point.
+    """
+    cast_index_op = builtin.UnrealizedConversionCastOp(
+        inputs=[index],
+        outputs=[builtin.IntegerType.get_signless(64)],
+    )
+    ptr_type = builtin.Type.parse("!ptr.ptr<#ptr.generic_space>")
+    ptr = Operation.create("ptr.to_ptr", results=[ptr_type], operands=[buffer])
+    cast_ptr_op = builtin.UnrealizedConversionCastOp(
+        inputs=[ptr], outputs=[llvm.PointerType.get()]
+    )
+    elementptr_op = llvm.GEPOp(
+        base=cast_ptr_op.result,
+        res=llvm.PointerType.get(),
+        dynamicIndices=[cast_index_op.results[0]],
+        rawConstantIndices=builtin.DenseI32ArrayAttr.get([-2147483648]),
+        elem_type=MEMORY_TYPE(),
+        noWrapFlags=llvm.GEPNoWrapFlags.none,
+    )
+    return elementptr_op.result
+
+
+def syscall(number: int, fd: int, ptr: Value, length: Value) -> Value:
+    """
+    Emits a read/write style syscall returning its i64 result.
+    Has to be called with an insertion point.
+    """
+    i64 = builtin.IntegerType.get_signless(64)
+    number_op = arith.ConstantOp(i64, number)
+    fd_op = number_op if fd == number else arith.ConstantOp(i64, fd)
+    asm_op = llvm.InlineAsmOp(
+        res=i64,
+        asm_string="syscall",
+        constraints="={rax},{rax},{rdi},{rsi},{rdx},~{rcx},~{r11}",
+        operands_=[number_op, fd_op, ptr, length],
+        has_side_effects=True,
+    )
+    return asm_op.result
+
+
+def bytes_type(length: int) -> builtin.MemRefType:
+    """The type of a 1-d buffer of `length` bytes."""
+    return builtin.MemRefType.get(
+        [length],
+        MEMORY_TYPE(),
+        memory_space=builtin.Attribute.parse("#ptr.generic_space"),
+    )
+
+
+def dense_bytes(data: bytes) -> builtin.Attribute:
+    """The initial value of a global holding `data`."""
+    return builtin.Attribute.parse(
+        f'dense<"0x{data.hex().upper()}"> : tensor<{len(data)}xi8>'
+    )
+
+
+def constant_global(name: str, data: bytes):
+    """
+    Declares a constant global holding `data`.
+    Has to be called with an insertion point in the module.
+    """
+    memref.GlobalOp(
+        sym_name=name,
+        type_=builtin.TypeAttr.get(bytes_type(len(data))),
+        sym_visibility="private",
+        initial_value=dense_bytes(data),
+        constant=True,
+    )
+
+
+def write_all(buffer: Value, length: Value, location: Location):
+    """
+    Writes the first `length` bytes of the 1-d `buffer` to stdout, retrying
+    after partial writes. Has to be called with an insertion point.
+    """
+    index_type = builtin.IndexType.get()
+    i64 = builtin.IntegerType.get_signless(64)
+    zero = arith.ConstantOp(index_type, 0)
+    zero_i64 = arith.ConstantOp(i64, 0)
+    while_op = scf.WhileOp([index_type], [zero])
+    with InsertionPoint(before := while_op.regions[0].blocks.append()):
+        written = before.add_argument(index_type, location)
+        pending = arith.cmpi(arith.CmpIPredicate.ult, written, length)
+        scf.ConditionOp(pending, [written])
+    with InsertionPoint(after := while_op.regions[1].blocks.append()):
+        written = after.add_argument(index_type, location)
+        remaining = arith.SubIOp(length, written)
+        count = syscall(
+            SYS_WRITE,
+            STDOUT,
+            element_ptr(buffer, written),
+            arith.IndexCastOp(i64, remaining).result,
+        )
+        # Give up on errors instead of retrying forever.
+        success = arith.cmpi(arith.CmpIPredicate.sgt, count, zero_i64)
+        advanced = arith.AddIOp(written, arith.IndexCastOp(index_type, count))
+        scf.YieldOp([arith.SelectOp(success, advanced, length).result])
+
+
+def memset_zero(buffer: Value, size: int):
+    """
+    Zeroes the first `size` bytes of `buffer` with `llvm.intr.memset`.
+    Has to be called with an insertion point.
+    """
+    zero = arith.ConstantOp(MEMORY_TYPE(), 0)
+    length = arith.ConstantOp(builtin.IntegerType.get_signless(64), size)
+    start = arith.ConstantOp(builtin.IndexType.get(), 0)
+    llvm.MemsetOp(
+        element_ptr(buffer, start.result),
+        zero,
+        length,
+        IntegerAttr.get(builtin.IntegerType.get_signless(1), 0),
+    )
+
+
+def copy_image(buffer: Value, image: Value, size: int):
+    """
+    Copies the first `size` bytes of `image` to `buffer` with
+    `llvm.intr.memcpy`. Has to be called with an insertion point.
+    """
+    length = arith.ConstantOp(builtin.IntegerType.get_signless(64), size)
+    start = arith.ConstantOp(builtin.IndexType.get(), 0)
+    llvm.MemcpyOp(
+        element_ptr(buffer, start.result),
+        element_ptr(image, start.result),
+        length,
+        IntegerAttr.get(builtin.IntegerType.get_signless(1), 0),
+    )
+
+
+def call_if(condition: Value, callee: str):
+    """
+    Calls the function `callee` if `condition` holds.
+    Has to be called with an insertion point.
+    """
+    if_op = scf.IfOp(condition)
+    with InsertionPoint(if_op.then_block):
+        func.CallOp([], callee, [])
+        scf.YieldOp([])
+
+
+class TapeIndexing:
+    """
+    Computes the indices of cells on a tape of `size` cells, keeping them in
+    bounds as selected by `bounds`: wrapped around at the ends of the tape
+    (`wrap`), aborting the program when they leave it (`check`) or not at
+    all (`unchecked`). Has to be created with an insertion point.
+
+    Cells at an offset from an index defined in the block `scope` (the body
+    of a function, if given) are loaded and stored with the affine dialect,
+    which MLIR can analyze, unless indices are checked.
+    """
+
+    def __init__(self, size: int, bounds: BoundsMode, scope: Block | None = None):
+        self.size = size
+        self.bounds = bounds
+        self.scope = scope
+        # Tapes of a power of two size wrap with a mask, others with a
+        # remainder.
+        self.masked = bounds == "wrap" and size & (size - 1) == 0
+        self.const_bound = None
+        if bounds != "unchecked":
+            self.const_bound = arith.ConstantOp(
+                builtin.IndexType.get(), size - 1 if self.masked else size
+            )
+
+    def cell_index(self, index: Value, offset: int) -> Value:
+        """
+        Computes the index of the cell at `offset` from `index`.
+        Has to be called with an insertion point.
+        """
+        if self.bounds == "wrap" and not self.masked:
+            # Keeps the sum below twice the size for the remainder.
+            offset %= self.size
+        if offset == 0:
+            return index
+        offset_op = arith.ConstantOp(builtin.IndexType.get(), offset)
+        add_op = arith.AddIOp(index, offset_op.result)
+        if self.const_bound is None:
+            return add_op.result
+        match self.bounds:
+            case "wrap" if self.masked:
+                return arith.AndIOp(add_op.result, self.const_bound.result).result
+            case "wrap":
+                return arith.RemUIOp(add_op.result, self.const_bound.result).result
+            case "check":
+                # Indices below zero wrap around to huge unsigned values.
+                outside = arith.cmpi(
+                    arith.CmpIPredicate.uge, add_op.result, self.const_bound.result
+                )
+                call_if(outside, BOUNDS_ERROR)
+        return add_op.result
+
+    def affine_map(self, index: Value, offset: int) -> AffineMapAttr | None:
+        """
+        Returns the map from `index` as its only symbol to the cell at
+        `offset` from it, or `None` if the cell can not be addressed with
+        the affine dialect.
+        """
+        if self.scope is None or self.bounds == "check":
+            return None
+        owner = index.owner
+        # Arguments of a function are valid affine symbols as well.
+        block = owner if isinstance(owner, Block) else owner.operation.block
+        if block != self.scope:
+            return None
+        cell = AffineSymbolExpr.get(0)
+        if self.bounds == "wrap":
+            offset %= self.size
+            if offset != 0:
+                cell = AffineModExpr.get(
+                    AffineAddExpr.get(cell, AffineConstantExpr.get(offset)),
+                    AffineConstantExpr.get(self.size),
+                )
+        elif offset != 0:
+            cell = AffineAddExpr.get(cell, AffineConstantExpr.get(offset))
+        return AffineMapAttr.get(AffineMap.get(0, 1, [cell]))
+
+    def load(self, memory, index: Value, offset: int) -> Value:
+        """
+        Loads the cell at `offset` from `index`.
+        Has to be called with an insertion point.
+        """
+        map_ = self.affine_map(index, offset)
+        if map_ is not None:
+            return affine.AffineLoadOp(MEMORY_TYPE(), memory, [index], map_).result
+        return memref.LoadOp(memory, [self.cell_index(index, offset)]).result
+
+    def store(self, value: Value, memory, index: Value, offset: int):
+        """
+        Stores `value` to the cell at `offset` from `index`.
+        Has to be called with an insertion point.
+        """
+        map_ = self.affine_map(index, offset)
+        if map_ is not None:
+            affine.AffineStoreOp(value, memory, [index], map_)
+        else:
+            memref.StoreOp(value, memory, [self.cell_index(index, offset)])
+
+    @staticmethod
+    def declare_bounds_error(module: OpView, flush_output: bool):
+        """
+        Declares the function called when an index leaves the tape, which
+        reports the error on stderr and exits with status 1.
+        """
+        i64 = builtin.IntegerType.get_signless(64)
+        length = len(BOUNDS_MESSAGE_TEXT)
+        message_type = bytes_type(length)
+        with InsertionPoint(module.regions[0].blocks[0]):
+            constant_global(BOUNDS_MESSAGE, BOUNDS_MESSAGE_TEXT)
+            func_op = func.FuncOp(
+                BOUNDS_ERROR, builtin.FunctionType.get([], []), visibility="private"
+            )
+        with InsertionPoint(func_op.add_entry_block()):
+            if flush_output:
+                func.CallOp([], FLUSH_OUTPUT, [])
+            zero = arith.ConstantOp(builtin.IndexType.get(), 0)
+            length_op = arith.ConstantOp(i64, length)
+            message = memref.GetGlobalOp(message_type, BOUNDS_MESSAGE).result
+            ptr = element_ptr(message, zero.result)
+            syscall(SYS_WRITE, STDERR, ptr, length_op)
+            # The exit status is passed where the file descriptor goes.
+            syscall(SYS_EXIT_GROUP, 1, ptr, length_op)
+            func.ReturnOp([])
+
+
+class IOBuffers:
+    """The buffers and their bookkeeping used by the buffered I/O modes."""
+
+    GLOBALS = [
+        "bf_output_buffer",
+        "bf_output_length",
+        "bf_input_buffer",
+        "bf_input_position",
+        "bf_input_length",
+    ]
+
+    def __init__(self) -> None:
+        """Loads the buffers, has to be called with an insertion point."""
+        self.output_buffer = self.get_global("bf_output_buffer")
+        self.output_length = self.get_global("bf_output_length")
+        self.input_buffer = self.get_global("bf_input_buffer")
+        self.input_position = self.get_global("bf_input_position")
+        self.input_length = self.get_global("bf_input_length")
+
+    @staticmethod
+    def type_of(name: str):
+        if name.endswith("_buffer"):
+            return builtin.MemRefType.get(
+                [IO_BUFFER_SIZE],
+                MEMORY_TYPE(),
+                memory_space=builtin.Attribute.parse("#ptr.generic_space"),
+            )
+        return builtin.MemRefType.get([1], builtin.IndexType.get())
+
+    @classmethod
+    def get_global(cls, name: str) -> Value:
+        return memref.GetGlobalOp(cls.type_of(name), name).result
+
+    @classmethod
+    def declare(cls, module: OpView):
+        with InsertionPoint(module.regions[0].blocks[0]):
+            for name in cls.GLOBALS:
+                memref_type = cls.type_of(name)
+                if name.endswith("_buffer"):
+                    initial_value = builtin.UnitAttr.get()
+                else:
+                    initial_value = builtin.DenseElementsAttr.get_splat(
+                        builtin.RankedTensorType.get([1], builtin.IndexType.get()),
+                        IntegerAttr.get(builtin.IndexType.get(), 0),
+                    )
+                memref.GlobalOp(
+                    sym_name=name,
+                    type_=builtin.TypeAttr.get(memref_type),
+                    sym_visibility="private",
+                    initial_value=initial_value,
+                )
+            cls._flush_output_func()
+            cls._refill_input_func()
+
+    @classmethod
+    def _flush_output_func(cls):
+        """Writes the whole output buffer to stdout and empties it."""
+        index_type = builtin.IndexType.get()
+        func_op = func.FuncOp(
+            FLUSH_OUTPUT, builtin.FunctionType.get([], []), visibility="private"
+        )
+        with InsertionPoint(func_op.add_entry_block()):
+            zero = arith.ConstantOp(index_type, 0)
+            output_buffer = cls.get_global("bf_output_buffer")
+            output_length = cls.get_global("bf_output_length")
+            length = memref.LoadOp(output_length, [zero])
+            write_all(output_buffer, length.result, func_op.location)
+            memref.StoreOp(zero, output_length, [zero])
+            func.ReturnOp([])
+
+    @classmethod
+    def _refill_input_func(cls):
+        """Reads the next block of stdin into the input buffer."""
+        index_type = builtin.IndexType.get()
+        i64 = builtin.IntegerType.get_signless(64)
+        func_op = func.FuncOp(
+            REFILL_INPUT, builtin.FunctionType.get([], []), visibility="private"
+        )
+        with InsertionPoint(func_op.add_entry_block()):
+            zero = arith.ConstantOp(index_type, 0)
+            zero_i64 = arith.ConstantOp(i64, 0)
+            size = arith.ConstantOp(i64, IO_BUFFER_SIZE)
+            input_buffer = cls.get_global("bf_input_buffer")
+            input_position = cls.get_global("bf_input_position")
+            input_length = cls.get_global("bf_input_length")
+            count = syscall(SYS_READ, STDIN, element_ptr(input_buffer, zero), size)
+            # End of file and errors both leave an empty buffer.
+            success = arith.cmpi(arith.CmpIPredicate.sgt, count, zero_i64)
+            length = arith.SelectOp(success, arith.IndexCastOp(index_type, count), zero)
+            memref.StoreOp(length, input_length, [zero])
+            memref.StoreOp(zero, input_position, [zero])
+            func.ReturnOp([])
+
 
 class _Patterns:
 
-    def __init__(self, const_one, const_index_mask, memref) -> None:
-        self.const_one = const_one
-        self.const_size = const_index_mask
+    def __init__(
+        self,
+        tape: TapeIndexing,
+        memref: Value,
+        io_mode: IOMode = "unbuffered",
+        buffers: IOBuffers | None = None,
+        writes: list[tuple[str, bytes]] | None = None,
+    ) -> None:
+        self.tape = tape
         self.memref = memref
+        self.io_mode = io_mode
+        self.buffers = buffers
+        self.used_functions: set[str] = set()
+        # The name and bytes of the constant global of every write, shared
+        # by the patterns of all functions of a module.
+        self.writes: list[tuple[str, bytes]] = [] if writes is None else writes
 
     def getPatternSet(self):
         def make_op_pattern(opname: str):
@@ -29,28 +449,62 @@ class _Patterns:
         set.add(make_op_pattern("bf_linked.right"), self.lower_move_ops)
         set.add(make_op_pattern("bf_linked.inc"), self.lower_inc_dec_ops)
         set.add(make_op_pattern("bf_linked.dec"), self.lower_inc_dec_ops)
+        set.add(make_op_pattern("bf_linked.move"), self.lower_counted_move_op)
+        set.add(make_op_pattern("bf_linked.add"), self.lower_add_op)
+        set.add(make_op_pattern("bf_linked.clear"), self.lower_clear_op)
+        set.add(make_op_pattern("bf_linked.set"), self.lower_set_op)
+        set.add(make_op_pattern("bf_linked.mul_add"), self.lower_mul_add_op)
+        set.add(make_op_pattern("bf_linked.scan"), self.lower_scan_op)
         set.add(make_op_pattern("bf_linked.loop"), self.lower_loop_op)
         set.add(make_op_pattern("bf_linked.loop_end"), self.lower_loop_end_op)
-        set.add(make_op_pattern("bf_linked.output"), self.lower_output_input_ops)
-        set.add(make_op_pattern("bf_linked.input"), self.lower_output_input_ops)
+        set.add(make_op_pattern("bf_linked.write"), self.lower_write_op)
+        if self.io_mode == "unbuffered":
+            set.add(make_op_pattern("bf_linked.output"), self.lower_output_input_ops)
+            set.add(make_op_pattern("bf_linked.input"), self.lower_output_input_ops)
+        else:
+            set.add(make_op_pattern("bf_linked.output"), self.lower_buffered_output)
+            set.add(make_op_pattern("bf_linked.input"), self.lower_buffered_input)
         return set.freeze()
 
+    def cell_index(self, op: OpView, name: str = "offset"):
+        """
+        Computes the (wrapped) index of the cell addressed by the `name`
+        offset attribute of `op`. Has to be called with an insertion point.
+        """
+        offset = IntegerAttr(op.attributes[name]).value
+        return self.tape.cell_index(op.operands[0], offset)
+
+    def load(self, op: OpView, name: str = "offset") -> Value:
+        """
+        Loads the cell addressed by the `name` offset attribute of `op`.
+        Has to be called with an insertion point.
+        """
+        offset = IntegerAttr(op.attributes[name]).value
+        return self.tape.load(self.memref, op.operands[0], offset)
+
+    def store(self, value: Value, op: OpView, name: str = "offset"):
+        """
+        Stores `value` to the cell addressed by the `name` offset attribute
+        of `op`. Has to be called with an insertion point.
+        """
+        offset = IntegerAttr(op.attributes[name]).value
+        self.tape.store(value, self.memref, op.operands[0], offset)
+
     def lower_move_ops(
         self,
         op: OpView,
         rewriter: PatternRewriter,
     ):
         if op.name == "bf_linked.left":
-            direction_op = arith.SubIOp
+            delta = -1
         elif op.name == "bf_linked.right":
-            direction_op = arith.AddIOp
+            delta = 1
         else:
             raise AssertionError("op was not of the expected type.")
         with rewriter.ip, op.location:
-            add_op = direction_op(op.operands[0], self.const_one.result)
-            and_op = arith.AndIOp(add_op.result, self.const_size.result)
+            index = self.tape.cell_index(op.operands[0], delta)
 
-        rewriter.replace_op(op, and_op)
+        rewriter.replace_op(op, [index])
 
     def lower_inc_dec_ops(
         self,
@@ -66,33 +520,212 @@ class _Patterns:
                 raise AssertionError("op has wrong type")
         with rewriter.ip, op.location:
             one = arith.ConstantOp(builtin.IntegerType.get_signless(8), 1)
-            load_op = memref.LoadOp(self.memref, [op.operands[0]])
-            change_op = new_op(load_op.results[0], one)
-            memref.StoreOp(change_op.result, self.memref, [op.operands[0]])
+            change_op = new_op(self.load(op), one)
+            self.store(change_op.result, op)
+        rewriter.erase_op(op)
+
+    def lower_counted_move_op(
+        self,
+        op: OpView,
+        rewriter: PatternRewriter,
+    ):
+        with rewriter.ip, op.location:
+            delta = IntegerAttr(op.attributes["delta"]).value
+            index = self.tape.cell_index(op.operands[0], delta)
+
+        rewriter.replace_op(op, [index])
+
+    def lower_add_op(
+        self,
+        op: OpView,
+        rewriter: PatternRewriter,
+    ):
+        with rewriter.ip, op.location:
+            amount = arith.ConstantOp(
+                MEMORY_TYPE(), IntegerAttr(op.attributes["amount"]).value
+            )
+            change_op = arith.AddIOp(self.load(op), amount)
+            self.store(change_op.result, op)
+        rewriter.erase_op(op)
+
+    def lower_clear_op(
+        self,
+        op: OpView,
+        rewriter: PatternRewriter,
+    ):
+        with rewriter.ip, op.location:
+            zero = arith.ConstantOp(MEMORY_TYPE(), 0)
+            self.store(zero.result, op)
+        rewriter.erase_op(op)
+
+    def lower_mul_add_op(
+        self,
+        op: OpView,
+        rewriter: PatternRewriter,
+    ):
+        with rewriter.ip, op.location:
+            factor = arith.ConstantOp(
+                MEMORY_TYPE(), IntegerAttr(op.attributes["factor"]).value
+            )
+            control = self.load(op, "source")
+            value = self.load(op, "offset")
+            product = arith.MulIOp(control, factor.result)
+            sum_op = arith.AddIOp(value, product.result)
+            self.store(sum_op.result, op, "offset")
+        rewriter.erase_op(op)
+
+    def lower_set_op(
+        self,
+        op: OpView,
+        rewriter: PatternRewriter,
+    ):
+        with rewriter.ip, op.location:
+            value = arith.ConstantOp(
+                MEMORY_TYPE(), IntegerAttr(op.attributes["value"]).value
+            )
+            self.store(value.result, op)
         rewriter.erase_op(op)
 
+    def loop_condition(self, index: Value):
+        """Has to be called with an insertion point and location."""
+        val = self.tape.load(self.memref, index, 0)
+        zero = arith.ConstantOp(MEMORY_TYPE(), 0)
+        cmp = arith.cmpi(arith.CmpIPredicate.ugt, val, zero)
+        scf.ConditionOp(cmp, [index])
+
     def lower_loop_op(
         self,
         op: OpView,
         rewriter: PatternRewriter,
     ):
+        """
+        Checks the cell before every iteration, or after it for loops known
+        to be entered, with the body in the before region.
+        """
+        body = op.operation.regions[0].blocks[0]
         with rewriter.ip, op.location:
             while_op = scf.WhileOp(
                 [builtin.IndexType.get()],
                 [op.operands[0]],
             )
-            op.operation.regions[0].blocks[0].append_to(while_op.regions[1])
-            with InsertionPoint(before_block := while_op.regions[0].blocks.append()):
-                index_arg = before_block.add_argument(
-                    builtin.IndexType.get(), op.location
-                )
-                val = memref.LoadOp(
-                    self.memref,
-                    [index_arg],
-                )
+            if ENTERED not in op.attributes:
+                body.append_to(while_op.regions[1])
+                with InsertionPoint(
+                    before_block := while_op.regions[0].blocks.append()
+                ):
+                    index_arg = before_block.add_argument(
+                        builtin.IndexType.get(), op.location
+                    )
+                    self.loop_condition(index_arg)
+            else:
+                body.append_to(while_op.regions[0])
+                loop_end = body.operations[len(body.operations) - 1]
+                with InsertionPoint(loop_end):
+                    self.loop_condition(loop_end.operands[0])
+                rewriter.erase_op(loop_end)
+                with InsertionPoint(after_block := while_op.regions[1].blocks.append()):
+                    index_arg = after_block.add_argument(
+                        builtin.IndexType.get(), op.location
+                    )
+                    scf.YieldOp([index_arg])
+
+        rewriter.replace_op(op, while_op)
+
+    def search(self, callee: str, start: Value, length: Value) -> Value:
+        """
+        Returns the position of the zero byte `callee` finds in the `length`
+        bytes at `start`, or a negative value if there is none.
+        Has to be called with an insertion point.
+        """
+        self.used_functions.add(callee)
+        i64 = builtin.IntegerType.get_signless(64)
+        zero_i32 = arith.ConstantOp(builtin.IntegerType.get_signless(32), 0)
+        found = func.CallOp(
+            [llvm.PointerType.get()],
+            callee,
+            [element_ptr(self.memref, start), zero_i32, length],
+        )
+        base = arith.ConstantOp(builtin.IndexType.get(), 0)
+        base_ptr = llvm.PtrToIntOp(i64, element_ptr(self.memref, base))
+        found_ptr = llvm.PtrToIntOp(i64, found.result)
+        null = arith.ConstantOp(i64, 0)
+        minus_one = arith.ConstantOp(i64, -1)
+        position = arith.SubIOp(found_ptr, base_ptr)
+        found_zero = arith.cmpi(arith.CmpIPredicate.ne, found_ptr, null)
+        return arith.SelectOp(found_zero, position, minus_one).result
+
+    def jump(self, index: Value, stride: int) -> Value:
+        """
+        Returns the first zero cell in the direction of `stride` from `index`,
+        or `index` if there is none.
+        Has to be called with an insertion point.
+        """
+        index_type = builtin.IndexType.get()
+        i64 = builtin.IntegerType.get_signless(64)
+        index_i64 = arith.IndexCastOp(i64, index).result
+        zero = arith.ConstantOp(i64, 0).result
+        one = arith.ConstantOp(i64, 1)
+        size = arith.ConstantOp(i64, self.tape.size)
+        # The part of the tape in the direction of the scan, then the rest.
+        if stride > 0:
+            callee = MEMCHR
+            first = (index_i64, arith.SubIOp(size, index_i64).result)
+            second = (zero, index_i64)
+        else:
+            callee = MEMRCHR
+            after = arith.AddIOp(index_i64, one).result
+            first = (zero, after)
+            second = (after, arith.SubIOp(size, after).result)
+
+        def search(start: Value, length: Value) -> Value:
+            return self.search(
+                callee, arith.IndexCastOp(index_type, start).result, length
+            )
+
+        position = search(*first)
+        missing = arith.cmpi(arith.CmpIPredicate.slt, position, zero)
+        if self.tape.bounds != "wrap":
+            # Without a zero cell ahead the loop leaves the tape.
+            found = arith.SelectOp(missing, index_i64, position)
+            return arith.IndexCastOp(index_type, found).result
+        if_op = scf.IfOp(missing, [i64], hasElse=True)
+        with InsertionPoint(if_op.then_block):
+            wrapped = search(*second)
+            still_missing = arith.cmpi(arith.CmpIPredicate.slt, wrapped, zero)
+            scf.YieldOp([arith.SelectOp(still_missing, index_i64, wrapped).result])
+        with InsertionPoint(if_op.else_block):
+            scf.YieldOp([position])
+        return arith.IndexCastOp(index_type, if_op.results[0]).result
+
+    def lower_scan_op(
+        self,
+        op: OpView,
+        rewriter: PatternRewriter,
+    ):
+        """
+        Lowers `bf_linked.scan` to a loop stepping the index by the stride
+        until it reaches a zero cell. Unit strides first jump close to the
+        zero cell with `memchr`/`memrchr`, which search many bytes at a time.
+        As the tape wraps around, a search that runs off one end continues
+        at the other. If there is no zero cell, the loop runs forever just
+        like the original.
+        """
+        index_type = builtin.IndexType.get()
+        stride = IntegerAttr(op.attributes["stride"]).value
+        with rewriter.ip, op.location:
+            start = op.operands[0]
+            if stride in (-1, 1):
+                start = self.jump(start, stride)
+            while_op = scf.WhileOp([index_type], [start])
+            with InsertionPoint(before := while_op.regions[0].blocks.append()):
+                index = before.add_argument(index_type, op.location)
+                value = memref.LoadOp(self.memref, [index])
                 zero = arith.ConstantOp(MEMORY_TYPE(), 0)
-                cmp = arith.cmpi(arith.CmpIPredicate.ugt, val, zero)
-                scf.ConditionOp(cmp, [index_arg])
+                nonzero = arith.cmpi(arith.CmpIPredicate.ne, value, zero)
+                scf.ConditionOp(nonzero, [index])
+            with InsertionPoint(after := while_op.regions[1].blocks.append()):
+                index = after.add_argument(index_type, op.location)
+                scf.YieldOp([self.tape.cell_index(index, stride)])
 
         rewriter.replace_op(op, while_op)
 
@@ -110,79 +743,354 @@ class _Patterns:
             raise AssertionError("Invalid op")
 
         with rewriter.ip, op.location:
-            zero = arith.ConstantOp(builtin.IntegerType.get_signless(64), 0)
             one = arith.ConstantOp(builtin.IntegerType.get_signless(64), 1)
+            ptr = element_ptr(self.memref, self.cell_index(op))
+            if op.name == "bf_linked.output":
+                syscall(SYS_WRITE, STDOUT, ptr, one)
+            else:
+                syscall(SYS_READ, STDIN, ptr, one)
+        rewriter.erase_op(op)
 
-            cast_index_op = builtin.UnrealizedConversionCastOp(
-                inputs=[op.operands[0]], outputs=[builtin.IntegerType.get_signless(64)]
-            )
-            ptr_type = builtin.Type.parse("!ptr.ptr<#ptr.generic_space>")
-            ptr = Operation.create(
-                "ptr.to_ptr", results=[ptr_type], operands=[self.memref.result]
-            )
-            cast_ptr_op = builtin.UnrealizedConversionCastOp(
-                inputs=[ptr], outputs=[llvm.PointerType.get()]
-            )
-            elementptr_op = llvm.GEPOp(
-                base=cast_ptr_op.result,
-                res=llvm.PointerType.get(),
-                dynamicIndices=[cast_index_op.results[0]],
-                rawConstantIndices=builtin.DenseI32ArrayAttr.get([-2147483648]),
-                elem_type=MEMORY_TYPE(),
-                noWrapFlags=llvm.GEPNoWrapFlags.none,
-            )
+    def lower_write_op(self, op: OpView, rewriter: PatternRewriter):
+        """Writes the bytes from a constant global, after flushing the buffer."""
+        name = f"{OUTPUT_DATA}_{len(self.writes)}" if self.writes else OUTPUT_DATA
+        data = data_bytes(op.attributes["data"])
+        self.writes.append((name, data))
+        with rewriter.ip, op.location:
+            if self.buffers is not None:
+                func.CallOp([], FLUSH_OUTPUT, [])
+            length = arith.ConstantOp(builtin.IndexType.get(), len(data))
+            buffer = memref.GetGlobalOp(bytes_type(len(data)), name).result
+            write_all(buffer, length.result, op.location)
+        rewriter.erase_op(op)
 
-            llvm.InlineAsmOp(
-                res=builtin.IntegerType.get_signless(64),
-                asm_string="syscall",
-                constraints="={rax},{rax},{rdi},{rsi},{rdx},~{rcx},~{r11}",
-                operands_=(
-                    [one, one, elementptr_op.results[0], one]
-                    if op.name == "bf_linked.output"
-                    else [zero, zero, elementptr_op.results[0], one]
-                ),
-                has_side_effects=True,
-            )
+    def lower_buffered_output(self, op: OpView, rewriter: PatternRewriter):
+        buffers = self.buffers
+        assert buffers is not None
+        with rewriter.ip, op.location:
+            zero = arith.ConstantOp(builtin.IndexType.get(), 0)
+            one = arith.ConstantOp(builtin.IndexType.get(), 1)
+            size = arith.ConstantOp(builtin.IndexType.get(), IO_BUFFER_SIZE)
+            value = self.load(op)
+            length = memref.LoadOp(buffers.output_length, [zero])
+            memref.StoreOp(value, buffers.output_buffer, [length])
+            new_length = arith.AddIOp(length, one)
+            memref.StoreOp(new_length, buffers.output_length, [zero])
+            flush = arith.cmpi(arith.CmpIPredicate.eq, new_length, size)
+            if self.io_mode == "line":
+                newline = arith.ConstantOp(MEMORY_TYPE(), ord("\n"))
+                is_newline = arith.cmpi(arith.CmpIPredicate.eq, value, newline)
+                flush = arith.OrIOp(flush, is_newline).result
+            call_if(flush, FLUSH_OUTPUT)
+        rewriter.erase_op(op)
+
+    def lower_buffered_input(self, op: OpView, rewriter: PatternRewriter):
+        buffers = self.buffers
+        assert buffers is not None
+        with rewriter.ip, op.location:
+            # Pending output (e.g. a prompt) has to be visible before blocking.
+            func.CallOp([], FLUSH_OUTPUT, [])
+            zero = arith.ConstantOp(builtin.IndexType.get(), 0)
+            one = arith.ConstantOp(builtin.IndexType.get(), 1)
+            position = memref.LoadOp(buffers.input_position, [zero])
+            length = memref.LoadOp(buffers.input_length, [zero])
+            empty = arith.cmpi(arith.CmpIPredicate.uge, position, length)
+            call_if(empty, REFILL_INPUT)
+            position = memref.LoadOp(buffers.input_position, [zero])
+            length = memref.LoadOp(buffers.input_length, [zero])
+            # On end of file the cell is left unchanged.
+            available = arith.cmpi(arith.CmpIPredicate.ult, position, length)
+            if_op = scf.IfOp(available)
+            with InsertionPoint(if_op.then_block):
+                value = memref.LoadOp(buffers.input_buffer, [position])
+                self.store(value.result, op)
+                next_position = arith.AddIOp(position, one)
+                memref.StoreOp(next_position, buffers.input_position, [zero])
+                scf.YieldOp([])
         rewriter.erase_op(op)
 
 
-def LowerLinkedToBuiltinBfPass(op: OpView, pass_):
+def lower_balanced_loops(function: OpView, tape: TapeIndexing, memory: Value):
+    """
+    Lowers the loops at the top level of `function` that are balanced with
+    all loops nested in them (see `loop_positions`) to `scf.while` loops
+    without iteration arguments. Their operations address the cells at
+    constant offsets from the index the outermost loop is entered with,
+    which is defined in `function`, so `tape` loads and stores them with the
+    affine dialect and MLIR can keep the cells in registers across
+    iterations.
     """
-    A pass for lowering operations in the linked dialect to built-in dialects.
+    for function_op in list(function.regions[0].blocks[0].operations):
+        root = function_op.operation
+        if root.name != "bf_linked.loop":
+            continue
+        positions = loop_positions(root)
+        if positions is None:
+            continue
+        base = root.operands[0]
+        loops: list[Operation] = []
+        moves: list[Operation] = []
+        pending = [root]
+        while pending:
+            loop = pending.pop()
+            loops.append(loop)
+            for block_op in loop.regions[0].blocks[0].operations:
+                op = block_op.operation
+                if move_delta(op) is not None:
+                    moves.append(op)
+                elif op.name in MEMORY_OPS:
+                    shift_offsets(op, positions[op.operands[0]])
+                    op.operands[0] = base
+                elif op.name == "bf_linked.loop":
+                    pending.append(op)
+
+        # Outer loops first, as the nested ones are moved along with them.
+        for loop in loops:
+            position = positions[loop.operands[0]]
+            loop.results[0].replace_all_uses_with(loop.operands[0])
+            body = loop.regions[0].blocks[0]
+            body.arguments[0].replace_all_uses_with(loop.operands[0])
+            body.operations[len(body.operations) - 1].erase()
+            with InsertionPoint(loop), loop.location:
+                while_op = scf.WhileOp([], [])
+                before = while_op.regions[0].blocks.append()
+                after = while_op.regions[1].blocks.append()
+                # Loops known to be entered check after every iteration.
+                into = after if ENTERED not in loop.attributes else before
+                for block_op in list(body.operations):
+                    into.append(block_op.operation)
+                with InsertionPoint(before):
+                    value = tape.load(memory, base, position)
+                    zero = arith.ConstantOp(MEMORY_TYPE(), 0)
+                    scf.ConditionOp(
+                        arith.cmpi(arith.CmpIPredicate.ugt, value, zero), []
+                    )
+                with InsertionPoint(after):
+                    scf.YieldOp([])
+            loop.erase()
+        # The moves are only used by each other now.
+        for move in reversed(moves):
+            move.erase()
+
+
+def LowerLinkedToBuiltinBfPass(
+    io_mode: IOMode = "unbuffered",
+    tape: TapeAllocation = "heap",
+    tape_size: int = MEMORY_SIZE,
+    bounds: BoundsMode = "wrap",
+    affine: bool = True,
+):
+    """
+    Returns a pass for lowering operations in the linked dialect to built-in
+    dialects.
+
+    `io_mode` selects how `.` and `,` are performed: one syscall per byte
+    (`unbuffered`), or through buffers flushed when full, before input and on
+    return (`full`), additionally on every newline (`line`).
+
+    `tape` selects where the tape lives: a zero-initialized module-level
+    global (`global`, placed in `.bss` and paged in lazily), a `memref.alloca`
+    on the stack of `main` (`stack`) or a `memref.alloc` freed on return
+    (`heap`). The latter two are zeroed with `llvm.intr.memset`. A
+    `bf_linked.tape_image` becomes the initializer of the global, or is copied
+    onto the tape with `llvm.intr.memcpy`. Functions outlined from `main` take
+    the latter two as an argument after the index.
+
+    `tape_size` is the number of cells of the tape and `bounds` selects what
+    happens when the pointer leaves it: it wraps around to the other end
+    (`wrap`), the program is aborted with an error (`check`) or the behavior
+    is undefined (`unchecked`). If the range of cells the program can reach
+    is proven to fit, indices are neither wrapped nor checked and the tape is
+    shrunk to just that range.
+
+    `affine` selects whether cells at an offset from an index defined in a
+    function, including all cells in balanced loops, are accessed with the
+    affine dialect. It is unused if indices are checked.
     """
+
+    def lower_linked_to_builtin(op: OpView, pass_):
+        _lower_linked_to_builtin(op, io_mode, tape, tape_size, bounds, affine)
+
+    return lower_linked_to_builtin
+
+
+def _lower_linked_to_builtin(
+    op: OpView,
+    io_mode: IOMode,
+    tape: TapeAllocation,
+    tape_size: int,
+    bounds: BoundsMode,
+    affine: bool,
+):
     assert isinstance(op.regions[0].blocks[0].operations[0], func.FuncOp)
+    main_func = op.regions[0].blocks[0].operations[0]
+    # The functions outlined from `main` follow it.
+    outlined = [
+        function
+        for function in list(op.regions[0].blocks[0].operations)[1:]
+        if isinstance(function, func.FuncOp)
+    ]
 
-    with InsertionPoint.at_block_begin(
-        op.regions[0].blocks[0].operations[0].regions[0].blocks[0]
-    ):
-        const_zero = arith.ConstantOp(builtin.IndexType.get(), 0)
-        const_one = arith.ConstantOp(builtin.IndexType.get(), 1)
-        const_zero_ui8 = arith.ConstantOp(MEMORY_TYPE(), 0)
-        arith.ConstantOp(MEMORY_TYPE(), 1)
-        const_index_mask = arith.ConstantOp(builtin.IndexType.get(), MEMORY_SIZE - 1)
-        const_size = arith.ConstantOp(builtin.IndexType.get(), MEMORY_SIZE)
-        memref_op = memref.AllocOp(
-            builtin.MemRefType.get(
-                [MEMORY_SIZE],
-                MEMORY_TYPE(),
-                memory_space=builtin.Attribute.parse("#ptr.generic_space"),
-            ),
-            [],
-            [],
-        )
+    image = b""
+    image_op = main_func.regions[0].blocks[0].operations[0]
+    if image_op.name == "bf_linked.tape_image":
+        image = data_bytes(image_op.attributes["cells"])
+        image_op.erase()
 
-        init_zero_for = scf.ForOp(
-            const_zero.result,
-            const_size.result,
-            const_one.result,
-        )
-        with InsertionPoint(init_zero_block := init_zero_for.regions[0].blocks[0]):
-            memref.StoreOp(
-                const_zero_ui8.result,
-                memref_op.results[0],
-                [init_zero_block.arguments[0]],
+    reached = pointer_range(main_func)
+    if reached is not None:
+        low, high = reached
+        if (
+            high - low < tape_size
+            if bounds == "wrap"
+            else 0 <= low and high < tape_size
+        ):
+            # The lowest cell reached becomes the first one.
+            image = image.ljust(tape_size, b"\0")
+            image = bytes(
+                image[cell % tape_size] for cell in range(low, high + 1)
+            ).rstrip(b"\0")
+            tape_size, bounds = high - low + 1, "unchecked"
+            start = main_func.regions[0].blocks[0].operations[0]
+            assert start.name == "arith.constant"
+            start.attributes["value"] = IntegerAttr.get(
+                builtin.IndexType.get(),
+                IntegerAttr(start.attributes["value"]).value - low,
             )
-            scf.YieldOp([])
 
-    patterns = _Patterns(const_one, const_index_mask, memref_op).getPatternSet()
-    apply_patterns_and_fold_greedily(op, patterns)
+    if image and tape != "global":
+        with InsertionPoint(op.regions[0].blocks[0]), op.location:
+            constant_global(TAPE_IMAGE, image)
+
+    tape_type = builtin.MemRefType.get(
+        [tape_size],
+        MEMORY_TYPE(),
+        memory_space=builtin.Attribute.parse("#ptr.generic_space"),
+    )
+    with InsertionPoint.at_block_begin(main_func.regions[0].blocks[0]):
+        match tape:
+            case "global":
+                memref_op = memref.GetGlobalOp(tape_type, TAPE)
+            case "stack":
+                memref_op = memref.AllocaOp(tape_type, [], [])
+            case "heap":
+                memref_op = memref.AllocOp(tape_type, [], [])
+        if tape != "global":
+            memset_zero(memref_op.result, tape_size)
+            if image:
+                copy_image(
+                    memref_op.result,
+                    memref.GetGlobalOp(bytes_type(len(image)), TAPE_IMAGE).result,
+                    len(image),
+                )
+    functions = [(main_func, memref_op.result)]
+
+    # Functions outlined from `main` get the tape passed along with the
+    # index, unless it is a global.
+    for function in outlined:
+        body = function.regions[0].blocks[0]
+        if tape == "global":
+            with InsertionPoint.at_block_begin(body), function.location:
+                memory = memref.GetGlobalOp(tape_type, TAPE).result
+        else:
+            memory = body.add_argument(tape_type, function.location)
+            function.attributes["function_type"] = builtin.TypeAttr.get(
+                builtin.FunctionType.get(
+                    [argument.type for argument in body.arguments],
+                    [builtin.IndexType.get()],
+                )
+            )
+        functions.append((function, memory))
+    if tape != "global":
+        names = {
+            StringAttr(function.attributes["sym_name"]).value for function in outlined
+        }
+        for function, memory in functions:
+            pending = [
+                block_op.operation
+                for block_op in function.regions[0].blocks[0].operations
+            ]
+            while pending:
+                nested = pending.pop()
+                for region in nested.regions:
+                    for block in region.blocks:
+                        pending.extend(
+                            block_op.operation for block_op in block.operations
+                        )
+                if (
+                    nested.name != "func.call"
+                    or FlatSymbolRefAttr(nested.attributes["callee"]).value not in names
+                ):
+                    continue
+                # Operands can not be added, so the call is replaced.
+                with InsertionPoint(nested), nested.location:
+                    call = func.CallOp(
+                        [builtin.IndexType.get()],
+                        FlatSymbolRefAttr(nested.attributes["callee"]).value,
+                        [*nested.operands, memory],
+                    )
+                nested.results[0].replace_all_uses_with(call.result)
+                nested.erase()
+
+    if tape == "global":
+        with InsertionPoint(op.regions[0].blocks[0]):
+            memref.GlobalOp(
+                sym_name=TAPE,
+                type_=builtin.TypeAttr.get(tape_type),
+                sym_visibility="private",
+                initial_value=(
+                    dense_bytes(image.ljust(tape_size, b"\0"))
+                    if image
+                    else builtin.DenseElementsAttr.get_splat(
+                        builtin.RankedTensorType.get([tape_size], MEMORY_TYPE()),
+                        IntegerAttr.get(MEMORY_TYPE(), 0),
+                    )
+                ),
+            )
+    main_block = main_func.regions[0].blocks[0]
+    return_op = main_block.operations[len(main_block.operations) - 1]
+    assert isinstance(return_op, func.ReturnOp)
+    if tape == "heap":
+        with InsertionPoint(return_op), return_op.location:
+            memref.DeallocOp(memref_op.result)
+
+    if io_mode != "unbuffered":
+        IOBuffers.declare(op)
+        with InsertionPoint(return_op), return_op.location:
+            func.CallOp([], FLUSH_OUTPUT, [])
+    if bounds == "check":
+        with op.location:
+            TapeIndexing.declare_bounds_error(op, io_mode != "unbuffered")
+
+    writes: list[tuple[str, bytes]] = []
+    used_functions: set[str] = set()
+    for function, memory in functions:
+        body = function.regions[0].blocks[0]
+        with InsertionPoint.at_block_begin(body), function.location:
+            tape_indexing = TapeIndexing(tape_size, bounds, body if affine else None)
+            buffers = None if io_mode == "unbuffered" else IOBuffers()
+        if affine and bounds != "check":
+            lower_balanced_loops(function, tape_indexing, memory)
+        patterns = _Patterns(tape_indexing, memory, io_mode, buffers, writes)
+        apply_patterns_and_fold_greedily(function, patterns.getPatternSet())
+        used_functions |= patterns.used_functions
+    if writes:
+        with InsertionPoint(op.regions[0].blocks[0]), op.location:
+            for name, data in writes:
+                constant_global(name, data)
+    if used_functions:
+        ptr_type = llvm.PointerType.get()
+        with InsertionPoint(op.regions[0].blocks[0]), op.location:
+            for callee in sorted(used_functions):
+                func.FuncOp(
+                    callee,
+                    builtin.FunctionType.get(
+                        [
+                            ptr_type,
+                            builtin.IntegerType.get_signless(32),
+                            builtin.IntegerType.get_signless(64),
+                        ],
+                        [ptr_type],
+                    ),
+                    visibility="private",
+                )
@@ -0,0 +1,235 @@
+from mlir.dialects import builtin, func
+from mlir.ir import Block, InsertionPoint, Operation, OpView, Value
+
+DEFAULT_OUTLINE_SIZE = 2000
+OUTLINED = "bf_outlined"
+
+# The start index, the initial tape and the terminators stay in place.
+_FIXED = {"arith.constant", "bf_linked.tape_image", "bf_linked.loop_end", "func.return"}
+
+
+def nested_ops(ops: list[Operation]) -> list[Operation]:
+    """Returns `ops` and all operations nested in them, parents first."""
+    order: list[Operation] = []
+    pending = list(reversed(ops))
+    while pending:
+        op = pending.pop()
+        order.append(op)
+        for region in reversed(list(op.regions)):
+            for block in reversed(list(region.blocks)):
+                pending.extend(
+                    block_op.operation for block_op in reversed(block.operations)
+                )
+    return order
+
+
+def op_sizes(block: Block) -> dict[Operation, int]:
+    """Counts every operation in `block` with all operations nested in it."""
+    sizes: dict[Operation, int] = {}
+    top = [block_op.operation for block_op in block.operations]
+    for op in reversed(nested_ops(top)):
+        sizes[op] = 1 + sum(
+            sizes[inner.operation]
+            for region in op.regions
+            for inner_block in region.blocks
+            for inner in inner_block.operations
+        )
+    return sizes
+
+
+def last_index(ops: list[Operation]) -> Value | None:
+    """Returns the last index value `ops` define, if any."""
+    for op in reversed(ops):
+        for result in reversed(list(op.results)):
+            if builtin.IndexType.isinstance(result.type):
+                return result
+    return None
+
+
+def outline(
+    module: OpView, ops: list[Operation], entry: Value, name: str
+) -> Operation | None:
+    """
+    Moves `ops` into a function `name` taking the index they start at and
+    returning the one they end at, unless they use other index values from
+    outside or define ones used later. Returns the call replacing them.
+    """
+    inside = set(nested_ops(ops))
+    for op in inside:
+        for operand in op.operands:
+            if operand == entry:
+                continue
+            owner = operand.owner
+            if isinstance(owner, Block):
+                owner = owner.owner
+            if owner.operation in inside:
+                continue
+            return None
+    exit = last_index(ops)
+    if exit is None:
+        exit = entry
+    for op in ops:
+        for result in op.results:
+            if result != exit and any(
+                use.owner.operation not in inside for use in result.uses
+            ):
+                return None
+
+    index_type = builtin.IndexType.get()
+    location = ops[0].location
+    with InsertionPoint(ops[0]), location:
+        call = func.CallOp([index_type], name, [entry])
+    if exit != entry:
+        for use in list(exit.uses):
+            if use.owner.operation not in inside:
+                use.owner.operands[use.operand_number] = call.result
+    with InsertionPoint(module.regions[0].blocks[0]), location:
+        function = func.FuncOp(
+            name,
+            builtin.FunctionType.get([index_type], [index_type]),
+            visibility="private",
+        )
+    body = function.add_entry_block()
+    for op in ops:
+        body.append(op)
+    for op in inside:
+        for i, operand in enumerate(op.operands):
+            if operand == entry:
+                op.operands[i] = body.arguments[0]
+    with InsertionPoint(body), location:
+        func.ReturnOp([body.arguments[0] if exit == entry else exit])
+    return call.operation
+
+
+def walk_sizes(block: Block) -> list[int]:
+    """
+    Returns the sizes of the operations in `block` and all nested in them,
+    in the order of `nested_ops`, where the operations in the body of a loop
+    directly follow it.
+    """
+    top = [block_op.operation for block_op in block.operations]
+    sizes = op_sizes(block)
+    return [sizes[op] for op in nested_ops(top)]
+
+
+class _Outliner:
+    """
+    Splits blocks of more than `max_size` operations into segments of at
+    most that many, and moves segments into functions called in their place
+    once the function they are in holds `max_size` operations. A loop that
+    is larger on its own stays in place and its body is split in turn,
+    unless the function is full, in which case the loop is moved into a
+    new function first. Functions thus hold whole levels of deep nests, and
+    every operation is visited once.
+    """
+
+    def __init__(self, module: OpView, max_size: int) -> None:
+        self.module = module
+        self.max_size = max_size
+        self.count = 0
+
+    def segments(
+        self, block: Block, sizes: dict[Operation, int]
+    ) -> list[tuple[list[Operation], Value]]:
+        """
+        Partitions the operations of `block` into segments, each with the
+        index it starts at.
+        """
+        segments: list[tuple[list[Operation], Value]] = []
+        index = block.arguments[0] if len(block.arguments) else None
+        segment: list[Operation] = []
+        size = 0
+        start = index
+        for block_op in block.operations:
+            op = block_op.operation
+            outlinable = op.name not in _FIXED
+            if not outlinable or size + sizes[op] > self.max_size:
+                if segment and start is not None:
+                    segments.append((segment, start))
+                segment, size = [], 0
+            if outlinable:
+                if not segment:
+                    start = index
+                segment.append(op)
+                size += sizes[op]
+            for result in op.results:
+                if builtin.IndexType.isinstance(result.type):
+                    index = result
+        if segment and start is not None:
+            segments.append((segment, start))
+        return segments
+
+    def run(self, main: OpView):
+        # Every block comes with the sizes walked in the function it is in,
+        # the position of its first operation among them, and the number of
+        # operations that function still has room for, shared by all blocks
+        # of that function. Moving an operation changes the hashes of those
+        # nested in it, so the sizes are looked up by position; the block is
+        # unchanged since it was walked.
+        block = main.regions[0].blocks[0]
+        pending = [(block, walk_sizes(block), 0, [self.max_size])]
+        while pending:
+            block, walk, position, room = pending.pop()
+            sizes: dict[Operation, int] = {}
+            positions: dict[Operation, int] = {}
+            for block_op in block.operations:
+                op = block_op.operation
+                sizes[op] = walk[position]
+                positions[op] = position
+                position += walk[position]
+            if sum(sizes.values()) <= room[0]:
+                room[0] -= sum(sizes.values())
+                continue
+            # The start index and terminators stay in the function.
+            room[0] -= sum(1 for op in sizes if op.name in _FIXED)
+            # Everything in the block is looked up before anything is moved.
+            segments = []
+            for ops, start in self.segments(block, sizes):
+                size = sum(sizes[op] for op in ops)
+                loop = ops[0]
+                body = loop.regions[0].blocks[0] if len(loop.regions) else None
+                large = loop.name == "bf_linked.loop" and size > self.max_size
+                if large and room[0] > 0:
+                    # The loop stays where it is and only its body is split.
+                    room[0] -= 1
+                    pending.append((body, walk, positions[loop] + 1, room))
+                elif not large and size <= room[0]:
+                    room[0] -= size
+                else:
+                    segments.append(
+                        (ops, start, last_index(ops), body if large else None)
+                    )
+            # The index a segment ends at is replaced by the result of its
+            # call, the next segment starts at that.
+            renamed: dict[Value, Value] = {}
+            for ops, start, end, body in segments:
+                name = f"{OUTLINED}_{self.count}"
+                call = outline(self.module, ops, renamed.get(start, start), name)
+                if call is None:
+                    continue
+                self.count += 1
+                if end is not None:
+                    renamed[end] = call.results[0]
+                if body is not None:
+                    # A loop is only outlined once the function around it is
+                    # full, its body is split in the new function.
+                    pending.append((body, walk_sizes(body), 0, [self.max_size - 1]))
+
+
+def OutlinePass(max_size: int = DEFAULT_OUTLINE_SIZE):
+    """
+    Returns a pass splitting `main` into functions of at most `max_size`
+    operations of the linked dialect, so that none is too large for LLVM to
+    compile quickly. Runs of top-level operations are outlined into
+    functions taking the index they start at and returning the one they end
+    at; the tape stays implicit. Loops larger than that stay in place and
+    their bodies are split the same way, so that deep nests of loops are
+    split into functions holding many levels each.
+    """
+
+    def outline_segments(op: OpView, pass_):
+        main = op.regions[0].blocks[0].operations[0]
+        assert isinstance(main, func.FuncOp)
+        _Outliner(op, max_size).run(main)
+
+    return outline_segments
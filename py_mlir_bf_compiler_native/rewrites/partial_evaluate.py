@@ -0,0 +1,126 @@
+from mlir.dialects import builtin
+from mlir.ir import InsertionPoint, IntegerAttr, Operation, OpView
+
+from py_mlir_bf_compiler_common.evaluate import Instruction, Machine, Step
+
+from ..dialects.linked_brainfuck import data_attr
+from .lower_linked_to_builtin import MEMORY_SIZE, BoundsMode
+from .sink_moves import move_delta
+
+DEFAULT_BUDGET = 1_000_000
+
+
+def to_instruction(op: Operation) -> Instruction | None:
+    """
+    Converts a top-level operation of `main` with the operations nested in
+    it, or returns `None` if it can not be evaluated at compile time, e.g.
+    because it reads input.
+    """
+    top: list[Instruction] = []
+    pending: list[tuple[Operation, list[Instruction]]] = [(op, top)]
+    while pending:
+        op, into = pending.pop()
+        delta = move_delta(op)
+        if delta is not None:
+            into.append((Step.MOVE, delta))
+            continue
+        offset = 0
+        if "offset" in op.attributes:
+            offset = IntegerAttr(op.attributes["offset"]).value
+        match op:
+            case Operation(name="bf_linked.inc"):
+                into.append((Step.ADD, offset, 1))
+            case Operation(name="bf_linked.dec"):
+                into.append((Step.ADD, offset, -1))
+            case Operation(name="bf_linked.add"):
+                amount = IntegerAttr(op.attributes["amount"]).value
+                into.append((Step.ADD, offset, amount))
+            case Operation(name="bf_linked.clear"):
+                into.append((Step.STORE, offset, 0))
+            case Operation(name="bf_linked.set"):
+                value = IntegerAttr(op.attributes["value"]).value
+                into.append((Step.STORE, offset, value))
+            case Operation(name="bf_linked.mul_add"):
+                factor = IntegerAttr(op.attributes["factor"]).value
+                source = IntegerAttr(op.attributes["source"]).value
+                into.append((Step.MUL_ADD, offset, factor, source))
+            case Operation(name="bf_linked.scan"):
+                stride = IntegerAttr(op.attributes["stride"]).value
+                into.append((Step.SCAN, stride))
+            case Operation(name="bf_linked.output"):
+                into.append((Step.OUTPUT, offset))
+            case Operation(name="bf_linked.loop"):
+                body: list[Instruction] = []
+                into.append((Step.LOOP, body))
+                # Popped in order, before the operations after the loop.
+                pending.extend(
+                    (body_op.operation, body)
+                    for body_op in reversed(op.regions[0].blocks[0].operations)
+                )
+            case Operation(name="bf_linked.loop_end"):
+                pass
+            case _:
+                return None
+    return top[0]
+
+
+def PartialEvaluatePass(
+    budget: int = DEFAULT_BUDGET,
+    tape_size: int = MEMORY_SIZE,
+    bounds: BoundsMode = "wrap",
+):
+    """
+    Returns a pass running the start of the program in the linked dialect at
+    compile time, up to the first operation reading input. The evaluated
+    operations are replaced with a `bf_linked.tape_image` of the resulting
+    tape, the resulting pointer as the start index and a single
+    `bf_linked.write` of everything they output. A program without input
+    compiles to just the write, if it terminates within the budget.
+
+    `budget` is the maximum number of steps to evaluate, a top-level
+    operation that does not finish within it is left to run at runtime.
+    `tape_size` and `bounds` are those of `LowerLinkedToBuiltinBfPass`.
+    Unless the pointer wraps, an operation leaving the tape is left to
+    runtime, which reports the error.
+    """
+
+    def partial_evaluate(op: OpView, pass_):
+        _partial_evaluate(op, budget, tape_size, bounds)
+
+    return partial_evaluate
+
+
+def _partial_evaluate(op: OpView, budget: int, tape_size: int, bounds: BoundsMode):
+    main_block = op.regions[0].blocks[0].operations[0].regions[0].blocks[0]
+    start = main_block.operations[0].operation
+    assert start.name == "arith.constant"
+    machine = Machine(tape_size, bounds == "wrap", budget)
+    evaluated: list[Operation] = []
+    for main_op in list(main_block.operations)[1:]:
+        instruction = to_instruction(main_op.operation)
+        if instruction is None or not machine.run(instruction):
+            break
+        evaluated.append(main_op.operation)
+    if not evaluated:
+        return
+
+    # The remaining operations continue from the final pointer.
+    for evaluated_op in reversed(evaluated):
+        for result in evaluated_op.results:
+            result.replace_all_uses_with(start.results[0])
+        evaluated_op.erase()
+    start.attributes["value"] = IntegerAttr.get(
+        builtin.IndexType.get(), machine.pointer
+    )
+    image = machine.image()
+    rest = main_block.operations[1].operation
+    if image and rest.name != "func.return":
+        with InsertionPoint(start), start.location:
+            Operation.create(
+                "bf_linked.tape_image", attributes={"cells": data_attr(image)}
+            )
+    if machine.output:
+        with InsertionPoint(rest), start.location:
+            Operation.create(
+                "bf_linked.write", attributes={"data": data_attr(bytes(machine.output))}
+            )
@@ -0,0 +1,140 @@
+from mlir.dialects import builtin
+from mlir.ir import (
+    FlatSymbolRefAttr,
+    IntegerAttr,
+    Operation,
+    OpView,
+    StringAttr,
+    Value,
+)
+
+from .sink_moves import MEMORY_OPS, move_delta
+
+
+def pointer_range(main: OpView) -> tuple[int, int] | None:
+    """
+    Proves the range of cells the pointer of `main` can reach. This
+    succeeds if every index value is at a constant offset from the start
+    index, which holds if all loops are balanced, i.e. return the pointer to
+    where they started, and there are no scans. Calls of outlined functions
+    are followed into their bodies. Returns the lowest and highest cell
+    reached (including the start and the cells addressed by offsets) or
+    `None` if there is no proof.
+    """
+    functions = {
+        StringAttr(function.attributes["sym_name"]).value: function.operation
+        for function in main.operation.parent.regions[0].blocks[0].operations
+        if function.operation.name == "func.func"
+    }
+    # The calls whose functions are being followed, innermost last.
+    calls: list[Operation] = []
+    positions: dict[Value, int] = {}
+    low: int | None = None
+    high: int | None = None
+
+    def reach(index: Value, offset: int = 0) -> bool:
+        nonlocal low, high
+        if index not in positions:
+            return False
+        cell = positions[index] + offset
+        low = cell if low is None else min(low, cell)
+        high = cell if high is None else max(high, cell)
+        return True
+
+    pending: list[Operation] = [
+        op.operation for op in reversed(main.regions[0].blocks[0].operations)
+    ]
+    while pending:
+        op = pending.pop()
+        delta = move_delta(op)
+        if delta is not None:
+            if op.operands[0] not in positions:
+                return None
+            positions[op.results[0]] = positions[op.operands[0]] + delta
+            reach(op.results[0])
+            continue
+        match op:
+            case Operation(name="arith.constant") if builtin.IndexType.isinstance(
+                op.results[0].type
+            ):
+                positions[op.results[0]] = IntegerAttr(op.attributes["value"]).value
+                reach(op.results[0])
+            case Operation(name="bf_linked.mul_add"):
+                offset = IntegerAttr(op.attributes["offset"]).value
+                source = IntegerAttr(op.attributes["source"]).value
+                if not reach(op.operands[0], offset) or not reach(
+                    op.operands[0], source
+                ):
+                    return None
+            case Operation(name=name) if name in MEMORY_OPS:
+                offset = IntegerAttr(op.attributes["offset"]).value
+                if not reach(op.operands[0], offset):
+                    return None
+            case Operation(name="bf_linked.loop"):
+                if not reach(op.operands[0]):
+                    return None
+                # Every iteration starts where the loop was entered, which
+                # is checked at its end.
+                body = op.regions[0].blocks[0]
+                positions[body.arguments[0]] = positions[op.operands[0]]
+                positions[op.results[0]] = positions[op.operands[0]]
+                pending.extend(
+                    block_op.operation for block_op in reversed(body.operations)
+                )
+            case Operation(name="bf_linked.loop_end"):
+                loop = op.parent
+                if positions.get(op.operands[0]) != positions[loop.operands[0]]:
+                    return None
+            case Operation(name="func.call"):
+                if not reach(op.operands[0]):
+                    return None
+                callee = functions[FlatSymbolRefAttr(op.attributes["callee"]).value]
+                body = callee.regions[0].blocks[0]
+                positions[body.arguments[0]] = positions[op.operands[0]]
+                calls.append(op)
+                pending.extend(
+                    block_op.operation for block_op in reversed(body.operations)
+                )
+            case Operation(name="func.return") if len(op.operands):
+                # The end of an outlined function, which returns the index.
+                call = calls.pop()
+                positions[call.results[0]] = positions[op.operands[0]]
+            case Operation(name="bf_linked.write" | "func.return"):
+                pass
+            case _:
+                return None
+    if low is None or high is None:
+        return None
+    return low, high
+
+
+def loop_positions(loop: Operation) -> dict[Value, int] | None:
+    """
+    Returns the position of every index value in the loop, including the
+    loops nested in it, relative to the index the loop is entered with, or
+    `None` if the loop or a nested one is not balanced or contains a scan
+    or a call.
+    """
+    positions: dict[Value, int] = {loop.operands[0]: 0}
+    pending = [loop]
+    while pending:
+        current = pending.pop()
+        start = positions[current.operands[0]]
+        body = current.regions[0].blocks[0]
+        positions[body.arguments[0]] = start
+        for block_op in body.operations:
+            op = block_op.operation
+            delta = move_delta(op)
+            if delta is not None:
+                positions[op.results[0]] = positions[op.operands[0]] + delta
+                continue
+            match op:
+                case Operation(name="bf_linked.loop"):
+                    positions[op.results[0]] = positions[op.operands[0]]
+                    pending.append(op)
+                case Operation(name="bf_linked.loop_end"):
+                    if positions[op.operands[0]] != start:
+                        return None
+                case Operation(name="bf_linked.scan" | "func.call"):
+                    return None
+    return positions
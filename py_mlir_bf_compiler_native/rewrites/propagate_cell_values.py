@@ -0,0 +1,271 @@
+from itertools import count
+
+from mlir.dialects import builtin
+from mlir.ir import (
+    Block,
+    InsertionPoint,
+    IntegerAttr,
+    Operation,
+    OpView,
+    UnitAttr,
+    Value,
+)
+
+from py_mlir_bf_compiler_common.cell_values import CellValues
+from py_mlir_bf_compiler_common.passes import wrap_amount
+
+from ..dialects.linked_brainfuck import ENTERED, data_bytes, offset_attr
+from .lower_linked_to_builtin import MEMORY_SIZE
+from .sink_moves import MEMORY_OPS, move_delta
+
+
+def _attr_value(op: Operation, name: str = "offset") -> int:
+    return IntegerAttr(op.attributes[name]).value
+
+
+def loop_writes(
+    loop: Operation, writes: dict[Operation, set[int] | None]
+) -> set[int] | None:
+    """
+    Returns the offsets from the loop's index of the cells its body may
+    write, or `None` if the loop is not balanced, i.e. an iteration may not
+    end where it started, so the cells can not be named. `writes` holds the
+    results for the loops nested in the body.
+    """
+    body = loop.regions[0].blocks[0]
+    positions: dict[Value, int] = {body.arguments[0]: 0}
+    written: set[int] = set()
+    for block_op in body.operations:
+        op = block_op.operation
+        delta = move_delta(op)
+        if delta is not None:
+            if op.operands[0] in positions:
+                positions[op.results[0]] = positions[op.operands[0]] + delta
+            continue
+        match op:
+            case Operation(name="bf_linked.output"):
+                pass
+            case Operation(name=name) if name in MEMORY_OPS:
+                if op.operands[0] not in positions:
+                    return None
+                written.add(positions[op.operands[0]] + _attr_value(op))
+            case Operation(name="bf_linked.loop"):
+                nested = writes[op]
+                if nested is None or op.operands[0] not in positions:
+                    return None
+                position = positions[op.operands[0]]
+                written.update(position + offset for offset in nested)
+                positions[op.results[0]] = position
+            case Operation(name="bf_linked.loop_end"):
+                if positions.get(op.operands[0]) != 0:
+                    return None
+            case _:
+                # Scans leave the index at an unknown position.
+                pass
+    return written
+
+
+class _Propagation:
+    def __init__(self, tape_size: int, writes: dict[Operation, set[int] | None]):
+        self.tape_size = tape_size
+        self.writes = writes
+        self.frames = count(1)
+        # The frame and position of every index value of a known frame.
+        self.positions: dict[Value, tuple[int, int]] = {}
+        # The loop bodies left to visit with the values known at their start.
+        self.pending: list[tuple[Block, CellValues]] = []
+
+    def cell(self, values: CellValues, index: Value, offset: int) -> int | None:
+        if index not in self.positions:
+            return None
+        frame, position = self.positions[index]
+        if frame != values.frame:
+            return None
+        # The pointer wraps around, so positions a tape apart are one cell.
+        return (position + offset) % self.tape_size
+
+    def new_frame(self, index: Value) -> CellValues:
+        """Starts a frame at `index`, whose cell is known to be zero."""
+        values = CellValues(next(self.frames), {0: 0})
+        self.positions[index] = (values.frame, 0)
+        return values
+
+    def visit(self, block: Block, values: CellValues):
+        for block_op in list(block.operations):
+            op = block_op.operation
+            delta = move_delta(op)
+            if delta is not None:
+                if op.operands[0] in self.positions:
+                    frame, position = self.positions[op.operands[0]]
+                    self.positions[op.results[0]] = (frame, position + delta)
+                continue
+            match op:
+                case Operation(
+                    name="bf_linked.inc" | "bf_linked.dec" | "bf_linked.add"
+                ):
+                    cell = self.cell(values, op.operands[0], _attr_value(op))
+                    value = values.get(cell)
+                    if value is None:
+                        values.put(cell, None)
+                        continue
+                    match op.name:
+                        case "bf_linked.inc":
+                            value += 1
+                        case "bf_linked.dec":
+                            value -= 1
+                        case "bf_linked.add":
+                            value += _attr_value(op, "amount")
+                    self.store(values, op, cell, value & 0xFF)
+                case Operation(name="bf_linked.clear"):
+                    cell = self.cell(values, op.operands[0], _attr_value(op))
+                    self.store(values, op, cell, 0)
+                case Operation(name="bf_linked.set"):
+                    cell = self.cell(values, op.operands[0], _attr_value(op))
+                    self.store(values, op, cell, _attr_value(op, "value") & 0xFF)
+                case Operation(name="bf_linked.mul_add"):
+                    cell = self.cell(values, op.operands[0], _attr_value(op))
+                    source = values.get(
+                        self.cell(values, op.operands[0], _attr_value(op, "source"))
+                    )
+                    if source is None:
+                        values.put(cell, None)
+                        continue
+                    amount = source * _attr_value(op, "factor") & 0xFF
+                    value = values.get(cell)
+                    if amount == 0:
+                        op.erase()
+                    elif value is not None:
+                        self.store(values, op, cell, (value + amount) & 0xFF)
+                    else:
+                        with InsertionPoint(op), op.location:
+                            Operation.create(
+                                "bf_linked.add",
+                                operands=[op.operands[0]],
+                                attributes={
+                                    "amount": IntegerAttr.get(
+                                        builtin.IntegerType.get_signless(8),
+                                        wrap_amount(amount),
+                                    ),
+                                    "offset": offset_attr(_attr_value(op)),
+                                },
+                            )
+                        op.erase()
+                case Operation(name="bf_linked.input"):
+                    values.put(self.cell(values, op.operands[0], _attr_value(op)), None)
+                case Operation(name="bf_linked.output" | "bf_linked.write"):
+                    pass
+                case Operation(name="bf_linked.scan"):
+                    values = self.new_frame(op.results[0])
+                case Operation(name="bf_linked.loop"):
+                    values = self.visit_loop(op, values)
+                case Operation(
+                    name="arith.constant"
+                    | "bf_linked.tape_image"
+                    | "bf_linked.loop_end"
+                    | "func.return"
+                ):
+                    pass
+                case _:
+                    values.put(None, None)
+
+    def store(self, values: CellValues, op: Operation, cell: int | None, value: int):
+        """
+        Replaces `op`, which sets its cell to the known `value`, with a
+        `bf_linked.set`, or removes it if the cell already holds the value.
+        """
+        if cell is not None and values.get(cell) == value:
+            op.erase()
+            return
+        values.put(cell, value)
+        if op.name in ("bf_linked.clear", "bf_linked.set"):
+            return
+        with InsertionPoint(op), op.location:
+            Operation.create(
+                "bf_linked.set",
+                operands=[op.operands[0]],
+                attributes={
+                    "value": IntegerAttr.get(
+                        builtin.IntegerType.get_signless(8), wrap_amount(value)
+                    ),
+                    "offset": offset_attr(_attr_value(op)),
+                },
+            )
+        op.erase()
+
+    def visit_loop(self, loop: Operation, values: CellValues) -> CellValues:
+        """Returns the values known after the loop."""
+        index = loop.operands[0]
+        body = loop.regions[0].blocks[0]
+        cell = self.cell(values, index, 0)
+        value = values.get(cell)
+        if value == 0:
+            loop.results[0].replace_all_uses_with(index)
+            loop.erase()
+            return values
+        if value is not None:
+            loop.attributes[ENTERED] = UnitAttr.get()
+
+        writes = self.writes[loop]
+        if writes is None or cell is None:
+            # Every iteration starts at another position, where nothing is
+            # known but that the cell is nonzero.
+            body_values = CellValues(next(self.frames))
+            self.positions[body.arguments[0]] = (body_values.frame, 0)
+            self.pending.append((body, body_values))
+            return self.new_frame(loop.results[0])
+        for offset in writes:
+            values.put((cell + offset) % self.tape_size, None)
+        self.positions[body.arguments[0]] = self.positions[index]
+        self.positions[loop.results[0]] = self.positions[index]
+        self.pending.append((body, values.copy()))
+        values.put(cell, 0)
+        return values
+
+
+def PropagateCellValuesPass(tape_size: int = MEMORY_SIZE):
+    """
+    Returns a pass tracking the values of the cells through the linked
+    dialect. All cells start at zero (or their value in the
+    `bf_linked.tape_image`) and the cell of a loop or scan is zero after it.
+    Loops never entered and stores of values the cell already holds are
+    removed, adds to known values become `bf_linked.set` and loops known to
+    be entered skip their first check. Inside loops, only the values of
+    cells the loop does not write are known.
+
+    `tape_size` is that of `LowerLinkedToBuiltinBfPass`.
+    """
+
+    def propagate_cell_values(op: OpView, pass_):
+        _propagate_cell_values(op, tape_size)
+
+    return propagate_cell_values
+
+
+def _propagate_cell_values(op: OpView, tape_size: int):
+    main_block = op.regions[0].blocks[0].operations[0].regions[0].blocks[0]
+    # Inner loops first, as their writes are part of the outer ones.
+    loops: list[Operation] = []
+    pending = [main_block]
+    while pending:
+        for block_op in pending.pop().operations:
+            if block_op.operation.name == "bf_linked.loop":
+                loops.append(block_op.operation)
+                pending.append(block_op.regions[0].blocks[0])
+    writes: dict[Operation, set[int] | None] = {}
+    for loop in reversed(loops):
+        writes[loop] = loop_writes(loop, writes)
+
+    propagation = _Propagation(tape_size, writes)
+    values = CellValues(0, default=0)
+    for block_op in main_block.operations:
+        main_op = block_op.operation
+        if main_op.name == "bf_linked.tape_image":
+            image = data_bytes(main_op.attributes["cells"])
+            values.cells = {cell: value for cell, value in enumerate(image) if value}
+        elif main_op.name == "arith.constant":
+            position = IntegerAttr(main_op.attributes["value"]).value
+            propagation.positions[main_op.results[0]] = (0, position)
+            break
+    propagation.visit(main_block, values)
+    while propagation.pending:
+        propagation.visit(*propagation.pending.pop())
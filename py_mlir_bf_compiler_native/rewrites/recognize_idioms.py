@@ -0,0 +1,108 @@
+from mlir.dialects import builtin
+from mlir.ir import InsertionPoint, IntegerAttr, Operation, OpView
+
+from py_mlir_bf_compiler_common.passes import wrap_amount
+
+from ..dialects.linked_brainfuck import offset_attr
+
+
+def loop_effect(loop: Operation) -> tuple[int, dict[int, int]] | None:
+    """
+    Returns the net pointer movement and the net change per cell offset of a
+    loop body, if the body only consists of pointer moves and constant
+    additions. Returns `None` otherwise.
+    """
+    offset = 0
+    deltas: dict[int, int] = {}
+    for op in loop.regions[0].blocks[0].operations:
+        match op.operation:
+            case Operation(name="bf_linked.left"):
+                offset -= 1
+            case Operation(name="bf_linked.right"):
+                offset += 1
+            case Operation(name="bf_linked.move"):
+                offset += IntegerAttr(op.attributes["delta"]).value
+            case Operation(name="bf_linked.inc"):
+                cell = offset + IntegerAttr(op.attributes["offset"]).value
+                deltas[cell] = deltas.get(cell, 0) + 1
+            case Operation(name="bf_linked.dec"):
+                cell = offset + IntegerAttr(op.attributes["offset"]).value
+                deltas[cell] = deltas.get(cell, 0) - 1
+            case Operation(name="bf_linked.add"):
+                cell = offset + IntegerAttr(op.attributes["offset"]).value
+                amount = IntegerAttr(op.attributes["amount"]).value
+                deltas[cell] = deltas.get(cell, 0) + amount
+            case Operation(name="bf_linked.loop_end"):
+                pass
+            case _:
+                return None
+    return offset, {offset: wrap_amount(delta) for offset, delta in deltas.items()}
+
+
+def rewrite_idiom(loop: Operation) -> bool:
+    effect = loop_effect(loop)
+    if effect is None:
+        return False
+    stride, deltas = effect
+    if stride != 0:
+        if any(deltas.values()):
+            return False
+        with InsertionPoint(loop), loop.location:
+            scan = Operation.create(
+                "bf_linked.scan",
+                results=[builtin.IndexType.get()],
+                operands=[loop.operands[0]],
+                attributes={"stride": offset_attr(stride)},
+            )
+        loop.results[0].replace_all_uses_with(scan.results[0])
+        loop.erase()
+        return True
+    control = deltas.pop(0, 0)
+    if control not in (-1, 1):
+        return False
+    # With a step of +1 the loop runs (256 - value) times instead of value
+    # times, so the contribution to the other cells changes sign.
+    sign = -control
+    index = loop.operands[0]
+    with InsertionPoint(loop), loop.location:
+        for offset, delta in sorted(deltas.items()):
+            if delta == 0:
+                continue
+            Operation.create(
+                "bf_linked.mul_add",
+                operands=[index],
+                attributes={
+                    "offset": offset_attr(offset),
+                    "factor": IntegerAttr.get(
+                        builtin.IntegerType.get_signless(8),
+                        wrap_amount(sign * delta),
+                    ),
+                    "source": offset_attr(),
+                },
+            )
+        Operation.create(
+            "bf_linked.clear", operands=[index], attributes={"offset": offset_attr()}
+        )
+    loop.results[0].replace_all_uses_with(index)
+    loop.erase()
+    return True
+
+
+def RecognizeIdiomsPass(op: OpView, pass_):
+    """
+    A pass replacing clear, copy and multiply loops in the linked dialect,
+    e.g. `[-]` or `[->++>+++<<]`, with `bf_linked.clear` and
+    `bf_linked.mul_add` operations, and loops only moving the pointer, e.g.
+    `[>]` or `[<<<]`, with `bf_linked.scan`.
+    """
+    loops: list[Operation] = []
+    ops = [op.operation]
+    while ops:
+        current = ops.pop()
+        if current.name == "bf_linked.loop":
+            loops.append(current)
+        for region in current.regions:
+            for block in region.blocks:
+                ops.extend(block_op.operation for block_op in block.operations)
+    for loop in loops:
+        rewrite_idiom(loop)
@@ -0,0 +1,120 @@
+from mlir.dialects import builtin, func
+from mlir.ir import Block, InsertionPoint, Operation, OpView, Value
+
+from .outline import nested_ops, op_sizes, outline
+
+DEFAULT_SHARE_SIZE = 32
+DEFAULT_SHARE_COUNT = 2
+SHARED = "bf_shared"
+
+
+def loop_shapes(block: Block) -> dict[Operation, int]:
+    """
+    Numbers the loops in `block` and nested in it by their structure, so
+    that loops with the same number only differ in the names of their
+    values. Loops using values from outside other than the index they are
+    entered with are left out, as are the loops containing them.
+    """
+    shapes: dict[tuple, int] = {}
+    numbers: dict[Operation, int] = {}
+    top = [block_op.operation for block_op in block.operations]
+    # Nested loops are numbered first, so that the shape of a loop refers
+    # to them by their number.
+    for loop in reversed(nested_ops(top)):
+        if loop.name != "bf_linked.loop":
+            continue
+        values: dict[Value, int] = {loop.regions[0].blocks[0].arguments[0]: 0}
+        shape: list[tuple] = []
+        for block_op in loop.regions[0].blocks[0].operations:
+            op = block_op.operation
+            if any(operand not in values for operand in op.operands):
+                break
+            if op.name == "bf_linked.loop":
+                if op not in numbers:
+                    break
+                kind = numbers[op]
+            else:
+                attributes = [op.attributes[i] for i in range(len(op.attributes))]
+                kind = (
+                    op.name,
+                    tuple((named.name, named.attr) for named in attributes),
+                )
+            shape.append((kind, tuple(values[operand] for operand in op.operands)))
+            for result in op.results:
+                values[result] = len(values)
+        else:
+            # Loops known to be entered are lowered differently.
+            attributes = [loop.attributes[i] for i in range(len(loop.attributes))]
+            key = (
+                tuple((named.name, named.attr) for named in attributes),
+                tuple(shape),
+            )
+            numbers[loop] = shapes.setdefault(key, len(shapes))
+    return numbers
+
+
+class _LoopSharer:
+    """
+    Moves every loop of at least `min_size` operations that occurs at least
+    `min_count` times into a function, which replaces all of them. Larger
+    loops are shared first, so the copies of a loop nested in them count
+    once.
+    """
+
+    def __init__(self, module: OpView, min_size: int, min_count: int) -> None:
+        self.module = module
+        self.min_size = min_size
+        self.min_count = min_count
+        self.count = 0
+
+    def run(self, main: OpView):
+        main_block = main.regions[0].blocks[0]
+        sizes = op_sizes(main_block)
+        # The copies of every loop in the order of the program, so that the
+        # function is made from the first one.
+        copies: dict[int, list[Operation]] = {}
+        for loop, number in reversed(loop_shapes(main_block).items()):
+            copies.setdefault(number, []).append(loop)
+        # Moving an operation changes its hash, so the loops to share are
+        # chosen before anything is moved.
+        shared: list[list[Operation]] = []
+        removed: set[Operation] = set()
+        for loops in sorted(copies.values(), key=lambda loops: -sizes[loops[0]]):
+            loops = [loop for loop in loops if loop not in removed]
+            if len(loops) < max(self.min_count, 2) or sizes[loops[0]] < self.min_size:
+                continue
+            for loop in loops[1:]:
+                removed.update(nested_ops([loop]))
+            shared.append(loops)
+
+        index_type = builtin.IndexType.get()
+        for loops in shared:
+            name = f"{SHARED}_{self.count}"
+            if outline(self.module, [loops[0]], loops[0].operands[0], name) is None:
+                continue
+            self.count += 1
+            for loop in loops[1:]:
+                with InsertionPoint(loop), loop.location:
+                    call = func.CallOp([index_type], name, [loop.operands[0]])
+                loop.results[0].replace_all_uses_with(call.result)
+                loop.erase()
+
+
+def ShareLoopsPass(
+    min_size: int = DEFAULT_SHARE_SIZE, min_count: int = DEFAULT_SHARE_COUNT
+):
+    """
+    Returns a pass moving loops of `main` that occur many times into one
+    function each, called in place of every copy, so that generated
+    programs repeating the same loops are lowered and compiled once per
+    loop. Loops are compared by their structure, ignoring the names of their
+    values. A loop needs `min_size` operations and `min_count` copies, at
+    least two, to be shared.
+    """
+
+    def share_loops(op: OpView, pass_):
+        main = op.regions[0].blocks[0].operations[0]
+        assert isinstance(main, func.FuncOp)
+        _LoopSharer(op, min_size, min_count).run(main)
+
+    return share_loops
@@ -0,0 +1,88 @@
+from mlir.dialects import builtin
+from mlir.ir import Block, InsertionPoint, IntegerAttr, Operation, OpView, Value
+
+from ..dialects.linked_brainfuck import offset_attr
+
+MEMORY_OPS = {
+    "bf_linked.inc",
+    "bf_linked.dec",
+    "bf_linked.add",
+    "bf_linked.output",
+    "bf_linked.input",
+    "bf_linked.clear",
+    "bf_linked.set",
+    "bf_linked.mul_add",
+}
+
+
+def move_delta(op: Operation) -> int | None:
+    match op:
+        case Operation(name="bf_linked.left"):
+            return -1
+        case Operation(name="bf_linked.right"):
+            return 1
+        case Operation(name="bf_linked.move"):
+            return IntegerAttr(op.attributes["delta"]).value
+    return None
+
+
+def _shift(op: Operation, name: str, by: int):
+    op.attributes[name] = offset_attr(IntegerAttr(op.attributes[name]).value + by)
+
+
+def shift_offsets(op: Operation, by: int):
+    """Moves the cells the memory operation `op` addresses by `by`."""
+    _shift(op, "offset", by)
+    if op.name == "bf_linked.mul_add":
+        _shift(op, "source", by)
+
+
+def sink_block(block: Block):
+    # Maps every index value of the block to the materialized index it was
+    # derived from and the accumulated offset of the removed moves.
+    positions: dict[Value, tuple[Value, int]] = {}
+    moves: list[Operation] = []
+    for block_op in list(block.operations):
+        op = block_op.operation
+        delta = move_delta(op)
+        if delta is not None:
+            base, offset = positions.get(op.operands[0], (op.operands[0], 0))
+            positions[op.results[0]] = (base, offset + delta)
+            moves.append(op)
+            continue
+        for i, operand in enumerate(op.operands):
+            if operand not in positions:
+                continue
+            base, offset = positions[operand]
+            if op.name in MEMORY_OPS:
+                shift_offsets(op, offset)
+            elif offset != 0:
+                with InsertionPoint(op), op.location:
+                    move = Operation.create(
+                        "bf_linked.move",
+                        operands=[base],
+                        results=[builtin.IndexType.get()],
+                        attributes={"delta": offset_attr(offset)},
+                    )
+                base = move.results[0]
+                positions[operand] = (base, 0)
+            op.operands[i] = base
+    for move in reversed(moves):
+        move.erase()
+
+
+def SinkMovesPass(op: OpView, pass_):
+    """
+    A pass removing pointer moves from straight-line code in the linked
+    dialect. Operations address their cell with a constant `offset` from the
+    last materialized index instead, and a single `bf_linked.move` is only
+    emitted where the index leaves the block, e.g. before loops and at the
+    end of loop bodies.
+    """
+    blocks = [block for region in op.regions for block in region.blocks]
+    while blocks:
+        block = blocks.pop()
+        for block_op in block.operations:
+            for region in block_op.regions:
+                blocks.extend(region.blocks)
+        sink_block(block)
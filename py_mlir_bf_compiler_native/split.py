@@ -0,0 +1,117 @@
+from mlir.ir import Attribute, FlatSymbolRefAttr, Module, Operation, StringAttr
+
+from .rewrites.outline import nested_ops
+
+# About as much as LLVM compiles in a second, so that large programs keep
+# many processes busy while small ones stay a single module.
+PART_SIZE = 50_000
+
+_SYMBOLS = ("llvm.func", "llvm.mlir.global")
+
+
+def _is_definition(op: Operation) -> bool:
+    return op.name == "llvm.func" and len(op.regions[0].blocks) > 0
+
+
+def _symbol(op: Operation) -> str | None:
+    if op.name in _SYMBOLS:
+        return StringAttr(op.attributes["sym_name"]).value
+    return None
+
+
+def _attributes(op: Operation) -> dict[str, Attribute]:
+    named = [op.attributes[i] for i in range(len(op.attributes))]
+    return {attribute.name: attribute.attr for attribute in named}
+
+
+def _uses(op: Operation) -> set[str]:
+    """Returns the symbols referred to in `op`."""
+    uses: set[str] = set()
+    for nested in nested_ops([op]):
+        for attribute in _attributes(nested).values():
+            if FlatSymbolRefAttr.isinstance(attribute):
+                uses.add(FlatSymbolRefAttr(attribute).value)
+    return uses
+
+
+def _make_external(op: Operation):
+    """Gives `op` external linkage, so that other modules can link to it."""
+    op.attributes["linkage"] = Attribute.parse("#llvm.linkage<external>")
+    if "sym_visibility" in op.attributes:
+        del op.attributes["sym_visibility"]
+
+
+def _declaration(op: Operation) -> Operation:
+    """Returns an external declaration of the function or global `op`."""
+    attributes = _attributes(op)
+    # A global without a value or initializer is external.
+    attributes.pop("value", None)
+    attributes.pop("sym_visibility", None)
+    attributes["linkage"] = Attribute.parse("#llvm.linkage<external>")
+    return Operation.create(op.name, attributes=attributes, regions=1)
+
+
+def split_module(module: Module, part_size: int = PART_SIZE) -> list[Module]:
+    """
+    Splits the LLVM dialect `module` into modules of consecutive functions
+    of at least `part_size` operations each, except the last, which are
+    compiled separately and linked. The first part keeps the globals and
+    every part declares the functions and globals it uses from others,
+    which get external linkage. Takes the operations out of `module` unless
+    it is small enough to stay in one part, in which case it is returned as
+    is. Has to be called inside a context and location.
+    """
+    ops = [block_op.operation for block_op in module.body.operations]
+    # Moving an operation changes its hash, so the parts are looked up by
+    # the position of the operation in the module.
+    owners: list[int] = []
+    part, size = 0, 0
+    for op in ops:
+        if _is_definition(op):
+            if size >= part_size:
+                part, size = part + 1, 0
+            size += len(nested_ops([op]))
+            owners.append(part)
+        else:
+            owners.append(0)
+    if part == 0:
+        return [module]
+
+    symbols = {_symbol(op): op for op in ops if _symbol(op) is not None}
+    defined = {
+        _symbol(op): owner
+        for op, owner in zip(ops, owners)
+        if _is_definition(op) or op.name == "llvm.mlir.global"
+    }
+    used: list[set[str]] = [set() for _ in range(part + 1)]
+    for op, owner in zip(ops, owners):
+        if _is_definition(op):
+            used[owner] |= _uses(op)
+    shared = {
+        symbol
+        for owner, symbols_used in enumerate(used)
+        for symbol in symbols_used
+        if defined.get(symbol, owner) != owner
+    }
+
+    parts = [Module.create() for _ in range(part + 1)]
+    for part_module in parts:
+        for name, attribute in _attributes(module.operation).items():
+            if name != "sym_name":
+                part_module.operation.attributes[name] = attribute
+    for index, part_module in enumerate(parts):
+        for symbol in sorted(used[index]):
+            if symbol in defined and defined[symbol] == index:
+                continue
+            part_module.body.append(_declaration(symbols[symbol]))
+    # Declarations are only kept where they are used, above.
+    kept = [
+        (op, owner)
+        for op, owner in zip(ops, owners)
+        if _symbol(op) is None or _symbol(op) in defined
+    ]
+    for op, owner in kept:
+        if _symbol(op) in shared:
+            _make_external(op)
+        parts[owner].body.append(op)
+    return parts
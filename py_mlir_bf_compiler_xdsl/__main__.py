@@ -1,23 +1,86 @@
 import argparse
+import functools
+import os
 import pathlib
+import subprocess
 import sys
 import typing
+from collections import Counter
 
 import lark
 from xdsl.context import Context
 from xdsl.dialects import affine, arith, builtin, func, memref, printf, scf
+from xdsl.passes import ModulePass
 from xdsl.printer import Printer
 from xdsl.utils.exceptions import VerifyException
 
+from py_mlir_bf_compiler_common.batch import (
+    compile_batch,
+    job_count,
+    mirrored_outputs,
+)
+from py_mlir_bf_compiler_common.build import (
+    CLANG,
+    DEFAULT_CACHE_SIZE,
+    LLC,
+    MLIR_OPT,
+    MLIR_TRANSLATE,
+    ArtifactCache,
+    build,
+    default_cache_dir,
+    package_fingerprint,
+)
+from py_mlir_bf_compiler_common.instrument import Statistics, Timer, oplist_counts
+from py_mlir_bf_compiler_common.oplist import OpList
+from py_mlir_bf_compiler_common.passes import (
+    CanonicalizePass,
+    FoldCountedPass,
+    OpListPass,
+    run_passes,
+)
+from py_mlir_bf_compiler_common.scanner import scan, scan_file
+from py_mlir_bf_compiler_common.serve import (
+    DEFAULT_MEMORY_CACHE_SIZE,
+    Response,
+    capture,
+    default_socket,
+    serve,
+)
+from py_mlir_bf_compiler_common.stack import deep_stack
+
+from .bytecode import write_bytecode
 from .dialects.free_brainfuck import FreeBrainFuck
 from .dialects.linked_brainfuck import LinkedBrainFuck
 from .gen_mlir import GenMLIR
+from .interpreter import Instructions, interpret
 from .parser import BrainfuckParser
 from .rewrites.lower_free_to_linked_bf import LowerFreeToLinkedBfPass
-from .rewrites.lower_linked_to_builtin import LowerLinkedToBuiltinBfPass
+from .rewrites.lower_linked_to_builtin import (
+    MEMORY_SIZE,
+    BoundsMode,
+    IOMode,
+    LowerLinkedToBuiltinBfPass,
+    TapeAllocation,
+)
+from .rewrites.outline import DEFAULT_OUTLINE_SIZE, OutlinePass
+from .rewrites.partial_evaluate import DEFAULT_BUDGET, PartialEvaluatePass
+from .rewrites.propagate_cell_values import PropagateCellValuesPass
+from .rewrites.recognize_idioms import RecognizeIdiomsPass
+from .rewrites.share_loops import (
+    DEFAULT_SHARE_COUNT,
+    DEFAULT_SHARE_SIZE,
+    ShareLoopsPass,
+)
+from .rewrites.sink_moves import SinkMovesPass
+from .split import split_module
 
 
+@functools.cache
 def context():
+    """
+    The context with all dialects loaded, built once per process and shared
+    by all compilations in it.
+    """
     ctx = Context()
     ctx.load_dialect(affine.Affine)
     ctx.load_dialect(arith.Arith)
@@ -31,45 +94,166 @@ def context():
     return ctx
 
 
+def count_ops(module: builtin.ModuleOp) -> Counter[str]:
+    return Counter(op.name for op in module.walk())
+
+
+def apply_pass(
+    pass_: ModulePass,
+    ctx: Context,
+    module: builtin.ModuleOp,
+    timer: Timer,
+    stats: Statistics | None,
+):
+    with timer.stage(pass_.name):
+        pass_.apply(ctx, module)
+    if stats is not None:
+        stats.record(pass_.name, count_ops(module))
+
+
+@deep_stack
 def main(
     sourcefile: pathlib.Path,
-    target: typing.Literal["ast", "free", "linked", "builtin"],
+    target: typing.Literal["ast", "free", "linked", "builtin", "interpret"],
     output: typing.TextIO,
+    fold: bool = True,
+    idioms: bool = True,
+    offsets: bool = True,
+    cell_values: bool = True,
+    affine: bool = True,
+    io_mode: IOMode = "line",
+    tape: TapeAllocation = "global",
+    tape_size: int = MEMORY_SIZE,
+    bounds: BoundsMode = "wrap",
+    eval_budget: int = DEFAULT_BUDGET,
+    share_size: int = DEFAULT_SHARE_SIZE,
+    share_count: int = DEFAULT_SHARE_COUNT,
+    outline_size: int = DEFAULT_OUTLINE_SIZE,
+    frontend: typing.Literal["fast", "lark"] = "fast",
+    staged: bool = False,
+    canonicalize: bool = True,
+    timer: Timer | None = None,
+    stats: Statistics | None = None,
+    source: bytes | None = None,
+    emit: typing.Literal["text", "bytecode"] = "text",
+    parts: pathlib.Path | None = None,
 ):
-    parser = BrainfuckParser()
-
+    """
+    Compiles `sourcefile` (or the given `source` bytes) to `target`, writing
+    it to `output`. With `parts`, the lowered module is instead split into
+    parts compiled separately, written as bytecode to numbered files in
+    that directory.
+    """
     ctx = context()
+    timer = Timer() if timer is None else timer
 
-    with sourcefile.open("r") as h:
-        ast = parser.parse(h.read())
-    assert isinstance(ast, lark.Tree)
-    assert (
-        isinstance(ast.data, lark.Token)
-        and ast.data.type == "RULE"
-        and ast.data.value == "start"
-    )
-    if target == "ast":
-        output.write(str(ast))
-        return 0
-    gen = GenMLIR()
-    gen.gen_main_func(ast.children)
+    with timer.stage("parse"):
+        if frontend == "fast":
+            program = scan_file(sourcefile) if source is None else scan(source)
+            if target == "ast":
+                output.write(str(program))
+                return 0
+            ops = OpList.from_program(program)
+        else:
+            parser = BrainfuckParser()
+            if source is None:
+                with sourcefile.open("r") as h:
+                    ast = parser.parse(h.read())
+            else:
+                ast = parser.parse(source.decode())
+            assert isinstance(ast, lark.Tree)
+            assert (
+                isinstance(ast.data, lark.Token)
+                and ast.data.type == "RULE"
+                and ast.data.value == "start"
+            )
+            if target == "ast":
+                output.write(str(ast))
+                return 0
+            ops = OpList.from_ast(ast.children)
+    if stats is not None:
+        stats.record("parse", oplist_counts(ops))
 
-    if target == "linked" or target == "builtin":
-        LowerFreeToLinkedBfPass().apply(ctx, gen.module)
+    passes: list[OpListPass] = []
+    if fold:
+        passes.append(FoldCountedPass())
+    if canonicalize:
+        passes.append(CanonicalizePass())
+    with timer.stage("oplist passes"):
+        ops = run_passes(ops, passes, timer, stats)
+    with timer.stage("gen-mlir"):
+        gen = GenMLIR()
+        gen.gen_main_func(ops, linked=target != "free" and not staged)
+    if stats is not None:
+        stats.record("gen-mlir", count_ops(gen.module))
+
+    module_passes: list[ModulePass] = []
+    if target in ("linked", "builtin", "interpret"):
+        if staged:
+            module_passes.append(LowerFreeToLinkedBfPass())
+        if idioms:
+            module_passes.append(RecognizeIdiomsPass())
+        if offsets:
+            module_passes.append(SinkMovesPass())
+        if eval_budget:
+            module_passes.append(
+                PartialEvaluatePass(
+                    budget=eval_budget, tape_size=tape_size, bounds=bounds
+                )
+            )
+        if cell_values:
+            module_passes.append(PropagateCellValuesPass(tape_size=tape_size))
+        if share_size:
+            module_passes.append(
+                ShareLoopsPass(min_size=share_size, min_count=share_count)
+            )
+        if outline_size:
+            module_passes.append(OutlinePass(max_size=outline_size))
     if target == "builtin":
-        LowerLinkedToBuiltinBfPass().apply(ctx, gen.module)
+        module_passes.append(
+            LowerLinkedToBuiltinBfPass(
+                io_mode=io_mode,
+                tape=tape,
+                tape_size=tape_size,
+                bounds=bounds,
+                affine=affine,
+            )
+        )
+    with timer.stage("mlir passes"):
+        for pass_ in module_passes:
+            apply_pass(pass_, ctx, gen.module, timer, stats)
 
     verify_error = None
-    try:
-        gen.module.verify()
-    except VerifyException as e:
-        verify_error = e
-        print("Verification failed:", file=sys.stderr)
-        print(verify_error, file=sys.stderr)
-        # raise e
+    with timer.stage("verify"):
+        try:
+            gen.module.verify()
+        except VerifyException as e:
+            verify_error = e
+            print("Verification failed:", file=sys.stderr)
+            print(verify_error, file=sys.stderr)
+            # raise e
+
+    if target == "interpret":
+        if verify_error:
+            return 1
+        with timer.stage("interpret"):
+            interpret(
+                Instructions.from_module(gen.module),
+                stdout=output.buffer,
+                tape_size=tape_size,
+            )
+        return 0
 
-    printer = Printer(stream=output)
-    printer.print_op(gen.module)
+    with timer.stage("print"):
+        if parts is not None:
+            for index, part in enumerate(split_module(gen.module)):
+                with (parts / f"{index}.mlirbc").open("wb") as h:
+                    write_bytecode(part, h)
+        elif emit == "bytecode":
+            write_bytecode(gen.module, output.buffer)
+        else:
+            printer = Printer(stream=output)
+            printer.print_op(gen.module)
 
     if verify_error:
         print("\nVerification failed:", file=sys.stderr)
@@ -77,7 +261,244 @@ def main(
         return 1
 
 
-parser = argparse.ArgumentParser(description="Process Toy file")
+def compile_executable(args: argparse.Namespace) -> int:
+    """
+    Drives the whole pipeline from the source to an executable, reusing the
+    cached artifacts of unchanged stages.
+    """
+    options = compiler_options(args)
+
+    def generate(directory: pathlib.Path) -> list[pathlib.Path]:
+        if main(args.source, "builtin", sys.stdout, **options, parts=directory):
+            raise RuntimeError(f"Generating MLIR for {args.source} failed")
+        return sorted(directory.glob("*.mlirbc"), key=lambda path: int(path.stem))
+
+    try:
+        build(
+            args.source,
+            options,
+            package_fingerprint(__package__, "py_mlir_bf_compiler_common"),
+            generate,
+            [MLIR_OPT, MLIR_TRANSLATE, LLC],
+            CLANG,
+            args.output or args.source.with_suffix(".out"),
+            ArtifactCache(args.cache_dir, args.cache_size) if args.cache else None,
+            args.codegen_jobs,
+            log=lambda message: (
+                print(message, file=sys.stderr) if args.verbose else None
+            ),
+        )
+    except (OSError, RuntimeError, subprocess.CalledProcessError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+# The file every target is written to in batch mode, with the source's suffix
+# replaced.
+BATCH_SUFFIXES = {
+    "ast": ".ast",
+    "free": ".free.mlir",
+    "linked": ".linked.mlir",
+    "builtin": ".mlir",
+}
+
+
+def compile_to_file(
+    target: str, emit: str, options: dict, source: pathlib.Path, path: pathlib.Path
+):
+    with path.open("w") as output:
+        if main(source, target, output, **options, emit=emit):
+            raise RuntimeError(f"Generating MLIR for {source} failed")
+
+
+def warm_up(frontend: str):
+    """Builds the state shared by all compilations of a batch worker."""
+    context()
+    if frontend == "lark":
+        BrainfuckParser()
+
+
+def compile_sources(args: argparse.Namespace) -> int:
+    """Compiles many sources into a mirrored directory tree in parallel."""
+    suffix = BATCH_SUFFIXES[args.target]
+    if args.emit == "bytecode" and args.target != "ast":
+        suffix += "bc"
+    try:
+        jobs = mirrored_outputs(args.sources, args.output_dir, suffix, args.root)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return compile_batch(
+        jobs,
+        functools.partial(
+            compile_to_file, args.target, args.emit, compiler_options(args)
+        ),
+        args.jobs,
+        sys.stderr,
+        functools.partial(warm_up, args.frontend),
+    )
+
+
+def tape_size(value: str) -> int:
+    size = int(value)
+    if size < 1:
+        raise argparse.ArgumentTypeError("the tape needs at least one cell")
+    return size
+
+
+def share_count(value: str) -> int:
+    count = int(value)
+    if count < 2:
+        raise argparse.ArgumentTypeError("a loop needs at least two copies")
+    return count
+
+
+options_parser = argparse.ArgumentParser(add_help=False)
+options_parser.add_argument(
+    "--fold",
+    action=argparse.BooleanOptionalAction,
+    default=True,
+    help="Fold runs of +/- and </> into counted operations (default: on)",
+)
+options_parser.add_argument(
+    "--canonicalize",
+    action=argparse.BooleanOptionalAction,
+    default=True,
+    help="Remove loops that can never be entered and operations without "
+    "effect before generating MLIR (default: on)",
+)
+options_parser.add_argument(
+    "--idioms",
+    action=argparse.BooleanOptionalAction,
+    default=True,
+    help="Replace clear, copy and multiply loops with straight-line code "
+    "(default: on)",
+)
+options_parser.add_argument(
+    "--offsets",
+    action=argparse.BooleanOptionalAction,
+    default=True,
+    help="Address cells by constant offsets and sink pointer moves to the end "
+    "of each block (default: on)",
+)
+options_parser.add_argument(
+    "--cell-values",
+    action=argparse.BooleanOptionalAction,
+    default=True,
+    help="Track the values of cells at compile time to remove loops that are "
+    "never entered and stores of values a cell already holds (default: on)",
+)
+options_parser.add_argument(
+    "--affine",
+    action=argparse.BooleanOptionalAction,
+    default=True,
+    help="Access cells with affine loads and stores at constant offsets from "
+    "an index defined in main, including all cells of balanced loops, so "
+    "that MLIR can keep them in registers (default: on)",
+)
+options_parser.add_argument(
+    "--io",
+    dest="io_mode",
+    choices=typing.get_args(IOMode),
+    default="line",
+    help="Buffering of output and input: one syscall per byte (unbuffered), "
+    "flushing output on newlines (line) or only when the buffer is full "
+    "(full). Buffered output is always flushed before input and on exit. "
+    "(default: line)",
+)
+options_parser.add_argument(
+    "--tape",
+    choices=typing.get_args(TapeAllocation),
+    default="global",
+    help="Where to allocate the tape: a zero-initialized global (global), the "
+    "stack (stack) or the heap (heap). The latter two are zeroed with memset "
+    "at startup. (default: global)",
+)
+options_parser.add_argument(
+    "--tape-size",
+    type=tape_size,
+    default=MEMORY_SIZE,
+    help="The number of cells of the tape, need not be a power of two "
+    "(default: %(default)s)",
+)
+options_parser.add_argument(
+    "--bounds",
+    choices=typing.get_args(BoundsMode),
+    default="wrap",
+    help="What happens when the pointer leaves the tape: it wraps around to "
+    "the other end (wrap), the program aborts with an error (check) or the "
+    "behavior is undefined (unchecked). Where the cells a program can reach "
+    "are proven to fit on the tape, indices are neither wrapped nor checked "
+    "and the tape is shrunk to fit. The interpreter always wraps. "
+    "(default: wrap)",
+)
+options_parser.add_argument(
+    "--eval-budget",
+    type=int,
+    default=DEFAULT_BUDGET,
+    metavar="STEPS",
+    help="Run the program at compile time up to its first input, for at most "
+    "this many steps, and start the executable with the resulting tape and "
+    "output. A program without input that finishes within the budget "
+    "compiles to a single write. 0 disables it. (default: %(default)s)",
+)
+options_parser.add_argument(
+    "--share-size",
+    type=int,
+    default=DEFAULT_SHARE_SIZE,
+    metavar="OPS",
+    help="Move loops of at least this many operations of the linked dialect "
+    "that occur several times into one function each, called in place of "
+    "every copy. Loops are compared by their structure. 0 disables it. "
+    "(default: %(default)s)",
+)
+options_parser.add_argument(
+    "--share-count",
+    type=share_count,
+    default=DEFAULT_SHARE_COUNT,
+    metavar="N",
+    help="The number of copies a loop needs to be shared (default: %(default)s)",
+)
+options_parser.add_argument(
+    "--outline-size",
+    type=int,
+    default=DEFAULT_OUTLINE_SIZE,
+    metavar="OPS",
+    help="Split main into functions of at most this many operations of the "
+    "linked dialect, outlining runs of top-level operations and large loops, "
+    "so that LLVM compiles large programs quickly. 0 disables it. "
+    "(default: %(default)s)",
+)
+options_parser.add_argument(
+    "--frontend",
+    choices=["fast", "lark"],
+    default="fast",
+    help="How to parse the source: a linear scan over its bytes (fast) or the "
+    "Lark grammar (lark). Both generate the same IR. (default: fast)",
+)
+options_parser.add_argument(
+    "--staged",
+    action=argparse.BooleanOptionalAction,
+    default=False,
+    help="Generate the free dialect and lower it to the linked dialect with a "
+    "pass, instead of generating the linked dialect directly, e.g. to debug "
+    "the lowering. Both generate the same IR. (default: off)",
+)
+
+emit_parser = argparse.ArgumentParser(add_help=False)
+emit_parser.add_argument(
+    "--emit",
+    choices=["text", "bytecode"],
+    default="text",
+    help="Write MLIR as text or in the MLIR bytecode format, which is much "
+    "faster to write and for mlir-opt and mlir-translate to read. mlir-opt "
+    "prints bytecode as text for debugging. (default: text)",
+)
+
+parser = argparse.ArgumentParser(
+    description="Process Toy file", parents=[options_parser, emit_parser]
+)
 parser.add_argument("source", type=pathlib.Path, help="Brainfuck Source File")
 parser.add_argument(
     "--target",
@@ -87,9 +508,11 @@ parser.add_argument(
         "free",
         "linked",
         "builtin",
+        "interpret",
     ],
     default="builtin",
-    help="What MLIR to generate (default: builtin)",
+    help="What MLIR to generate, or run the program on stdin and stdout "
+    "without compiling it (interpret) (default: builtin)",
 )
 parser.add_argument(
     "--output",
@@ -98,14 +521,240 @@ parser.add_argument(
     default=None,
     help="Output destination (default: stdout)",
 )
+parser.add_argument(
+    "--timing",
+    action="store_true",
+    help="Report the time spent in every stage of the compiler on stderr",
+)
+parser.add_argument(
+    "--stats",
+    action="store_true",
+    help="Report the number of operations per dialect and name after every "
+    "stage of the compiler on stderr",
+)
+parser.add_argument(
+    "--stats-json",
+    type=pathlib.Path,
+    default=None,
+    help="Also write the --stats to this JSON file",
+)
+
+compile_parser = argparse.ArgumentParser(
+    prog=f"{parser.prog} compile",
+    description="Compile a Brainfuck file to an executable, caching the "
+    "artifacts of every stage",
+    parents=[options_parser],
+)
+compile_parser.add_argument("source", type=pathlib.Path, help="Brainfuck Source File")
+compile_parser.add_argument(
+    "--output",
+    "-o",
+    type=pathlib.Path,
+    default=None,
+    help="Executable to write (default: the source with suffix .out)",
+)
+compile_parser.add_argument(
+    "--cache-dir",
+    type=pathlib.Path,
+    default=default_cache_dir(),
+    help="Directory of the artifact cache (default: %(default)s)",
+)
+compile_parser.add_argument(
+    "--cache-size",
+    type=int,
+    default=DEFAULT_CACHE_SIZE,
+    help="Size in bytes above which the least recently used artifacts are "
+    "evicted (default: %(default)s)",
+)
+compile_parser.add_argument(
+    "--cache",
+    action=argparse.BooleanOptionalAction,
+    default=True,
+    help="Look up and store artifacts in the cache (default: on)",
+)
+compile_parser.add_argument(
+    "--codegen-jobs",
+    type=job_count,
+    default=1,
+    metavar="N",
+    help="Run the LLVM tools on this many parts of the program at the same "
+    "time. Large programs are split into parts of whole functions, which only "
+    "depend on the program, so the executable is the same for every N. "
+    "(default: %(default)s)",
+)
+compile_parser.add_argument(
+    "--verbose",
+    "-v",
+    action="store_true",
+    help="Report which artifacts were cached or built",
+)
+
+
+batch_parser = argparse.ArgumentParser(
+    prog=f"{parser.prog} batch",
+    description="Generate MLIR for many Brainfuck files in parallel, writing "
+    "each to the same relative path below the output directory",
+    parents=[options_parser, emit_parser],
+)
+batch_parser.add_argument(
+    "sources", type=pathlib.Path, nargs="+", help="Brainfuck Source Files"
+)
+batch_parser.add_argument(
+    "--target",
+    choices=list(BATCH_SUFFIXES),
+    default="builtin",
+    help="What to generate, written with the suffix "
+    + ", ".join(f"{suffix} ({target})" for target, suffix in BATCH_SUFFIXES.items())
+    + ", with bc appended for --emit bytecode (default: builtin)",
+)
+batch_parser.add_argument(
+    "--output-dir",
+    "-o",
+    type=pathlib.Path,
+    required=True,
+    help="Directory to mirror the sources into",
+)
+batch_parser.add_argument(
+    "--root",
+    type=pathlib.Path,
+    default=None,
+    help="Directory whose layout is mirrored (default: the deepest directory "
+    "containing all sources)",
+)
+batch_parser.add_argument(
+    "--jobs",
+    "-j",
+    type=job_count,
+    default=os.cpu_count() or 1,
+    help="Number of worker processes, each compiling many files "
+    "(default: %(default)s)",
+)
+
+
+serve_parser = argparse.ArgumentParser(
+    prog=f"{parser.prog} serve",
+    description="Serve compile requests of the client "
+    f"(python -m {__package__}.client) on a Unix socket, keeping the compiler "
+    "warm and recent results in memory",
+)
+serve_parser.add_argument(
+    "--socket",
+    type=pathlib.Path,
+    default=default_socket(__package__),
+    help="Socket to listen on (default: %(default)s)",
+)
+serve_parser.add_argument(
+    "--jobs",
+    "-j",
+    type=job_count,
+    default=os.cpu_count() or 1,
+    help="Number of worker processes compiling requests at the same time "
+    "(default: %(default)s)",
+)
+serve_parser.add_argument(
+    "--cache-size",
+    type=int,
+    default=DEFAULT_MEMORY_CACHE_SIZE,
+    help="Size in bytes of the outputs kept in memory (default: %(default)s)",
+)
+serve_parser.add_argument(
+    "--verbose",
+    "-v",
+    action="store_true",
+    help="Report every request",
+)
+
+
+def compiler_options(args: argparse.Namespace) -> dict:
+    return {
+        "fold": args.fold,
+        "canonicalize": args.canonicalize,
+        "idioms": args.idioms,
+        "offsets": args.offsets,
+        "cell_values": args.cell_values,
+        "affine": args.affine,
+        "io_mode": args.io_mode,
+        "tape": args.tape,
+        "tape_size": args.tape_size,
+        "bounds": args.bounds,
+        "eval_budget": args.eval_budget,
+        "share_size": args.share_size,
+        "share_count": args.share_count,
+        "outline_size": args.outline_size,
+        "frontend": args.frontend,
+        "staged": args.staged,
+    }
+
+
+def run(args: argparse.Namespace, output: typing.TextIO, source: bytes | None = None):
+    """
+    Runs the compilation given by the command line, reading the source file
+    unless `source` is given.
+    """
+    timer = Timer() if args.timing else None
+    stats = Statistics() if args.stats or args.stats_json else None
+    ret = main(
+        args.source,
+        args.target,
+        output,
+        **compiler_options(args),
+        timer=timer,
+        stats=stats,
+        source=source,
+        emit=args.emit,
+    )
+    if timer is not None:
+        timer.report(sys.stderr)
+    if stats is not None:
+        if args.stats:
+            stats.report(sys.stderr)
+        if args.stats_json:
+            stats.write_json(args.stats_json)
+    return ret
+
+
+def compile_request(argv: list[str], name: str, source: bytes) -> Response:
+    """Compiles a request to the server in one of its worker processes."""
+
+    def run_request(output: typing.TextIO):
+        args = parser.parse_args([name, *argv])
+        if args.target == "interpret":
+            raise ValueError("The server can not interpret programs")
+        return run(args, output, source)
+
+    return capture(run_request)
+
+
+def cli() -> int:
+    if sys.argv[1:2] == ["compile"]:
+        return compile_executable(compile_parser.parse_args(sys.argv[2:]))
+    if sys.argv[1:2] == ["batch"]:
+        return compile_sources(batch_parser.parse_args(sys.argv[2:]))
+    if sys.argv[1:2] == ["serve"]:
+        args = serve_parser.parse_args(sys.argv[2:])
+        return serve(
+            args.socket,
+            compile_request,
+            args.jobs,
+            args.cache_size,
+            functools.partial(warm_up, "lark"),
+            log=lambda message: (
+                print(message, file=sys.stderr) if args.verbose else None
+            ),
+        )
+
+    args = parser.parse_args()
+    output = sys.stdout
+    if args.output:
+        assert isinstance(args.output, pathlib.Path)
+        output = args.output.open("w")
+    try:
+        return run(args, output)
+    finally:
+        output.close()
+
 
-args = parser.parse_args()
-output = sys.stdout
-if args.output:
-    assert isinstance(args.output, pathlib.Path)
-    output = args.output.open("w")
-try:
-    ret = main(args.source, args.target, output)
-finally:
-    output.close()
-sys.exit(ret)
+# Worker processes that import this module instead of forking must not run the
+# command line again.
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,306 @@
+import io
+import typing
+from collections.abc import Iterator
+
+from xdsl.dialects.builtin import DictionaryAttr, IntegerAttr, ModuleOp
+from xdsl.ir import Attribute, Block, Operation, SSAValue
+from xdsl.printer import Printer
+
+MAGIC = b"ML\xefR"
+# The first version of the format, which every MLIR since can read.
+VERSION = 0
+PRODUCER = b"py_mlir_bf_compiler_xdsl"
+
+SECTION_STRING = 0
+SECTION_DIALECT = 1
+SECTION_ATTR_TYPE = 2
+SECTION_ATTR_TYPE_OFFSET = 3
+SECTION_IR = 4
+
+HAS_ATTRS = 0x01
+HAS_RESULTS = 0x02
+HAS_OPERANDS = 0x04
+HAS_SUCCESSORS = 0x08
+HAS_INLINE_REGIONS = 0x10
+
+
+def write_varint(data: bytearray, value: int):
+    """
+    Appends a prefix varint: the number of trailing zeros of the first byte
+    is the number of bytes that follow, and the value fills the other bits
+    in little-endian order.
+    """
+    if value < 0x80:
+        data.append(value << 1 | 1)
+        return
+    size = (value.bit_length() + 6) // 7
+    if size > 8:
+        data.append(0)
+        data += value.to_bytes(8, "little")
+        return
+    data += ((value << 1 | 1) << (size - 1)).to_bytes(size, "little")
+
+
+class _Table:
+    """Numbers strings (or anything hashable) in the order they are first used."""
+
+    def __init__(self) -> None:
+        self.ids: dict[typing.Hashable, int] = {}
+
+    def get(self, key: typing.Hashable) -> int:
+        id = self.ids.get(key)
+        if id is None:
+            id = self.ids[key] = len(self.ids)
+        return id
+
+
+# Properties that are no attributes in MLIR, with their default value.
+_DEFAULT_PROPERTIES: dict[tuple[str, str], Attribute] = {
+    ("llvm.getelementptr", "noWrapFlags"): IntegerAttr(0, 32),
+}
+
+
+class BytecodeWriter:
+    """
+    Writes a module in the MLIR bytecode format, which MLIR reads much
+    faster than the textual format. Attributes and types are encoded by
+    their textual form, which every dialect can read back. There are no
+    locations in xDSL, so everything is at an unknown location.
+
+    Properties are written as attributes, as in MLIR before version 5 of the
+    format. MLIR keeps those that are no attributes in MLIR, like the no-wrap
+    flags of `llvm.getelementptr`, as discardable attributes as well, so they
+    are left out while at their default, which is what xDSL generates.
+    """
+
+    def __init__(self) -> None:
+        self.strings = _Table()
+        self.dialects = _Table()
+        # The id of every operation name and its dialect and name strings.
+        self.op_names: dict[str, int] = {}
+        self.op_name_strings: list[tuple[int, int]] = []
+        # The textual form of every attribute and type, by attribute.
+        self.attributes: dict[Attribute | tuple, int] = {}
+        self.attribute_text: list[str] = []
+        self.types: dict[Attribute, int] = {}
+        self.type_text: list[str] = []
+        self.values: dict[SSAValue, int] = {}
+        self.blocks: dict[Block, int] = {}
+        self.text = io.StringIO()
+        self.printer = Printer(stream=self.text)
+        self.builtin = self.dialects.get(self.strings.get("builtin"))
+        self.unknown_location = self.attribute_id(None, "loc(unknown)")
+
+    def print(self, attribute: Attribute) -> str:
+        self.text.seek(0)
+        self.text.truncate()
+        self.printer.print_attribute(attribute)
+        return self.text.getvalue()
+
+    def attribute_id(
+        self, key: Attribute | tuple | None, text: str | None = None
+    ) -> int:
+        id = self.attributes.get(key) if key is not None else None
+        if id is None:
+            id = len(self.attribute_text)
+            if key is not None:
+                self.attributes[key] = id
+            self.attribute_text.append(text if text is not None else self.print(key))
+        return id
+
+    def attribute_dict_id(self, op: Operation) -> int | None:
+        # Properties are part of the attribute dictionary before version 5.
+        properties = tuple(
+            (name, value)
+            for name, value in op.properties.items()
+            if _DEFAULT_PROPERTIES.get((op.name, name)) != value
+        )
+        if not properties and not op.attributes:
+            return None
+        items = properties + tuple(op.attributes.items())
+        id = self.attributes.get(items)
+        if id is None:
+            id = self.attribute_id(items, self.print(DictionaryAttr(dict(items))))
+        return id
+
+    def type_id(self, type: Attribute) -> int:
+        id = self.types.get(type)
+        if id is None:
+            id = self.types[type] = len(self.type_text)
+            self.type_text.append(self.print(type))
+        return id
+
+    def op_name_id(self, name: str) -> int:
+        id = self.op_names.get(name)
+        if id is None:
+            id = self.op_names[name] = len(self.op_name_strings)
+            dialect, _, op_name = name.partition(".")
+            self.op_name_strings.append(
+                (
+                    self.dialects.get(self.strings.get(dialect)),
+                    self.strings.get(op_name),
+                )
+            )
+        return id
+
+    def number_region(self, blocks: list[Block], start: int) -> int:
+        """
+        Numbers the values of a region after the `start` values of the
+        regions enclosing it, and returns their count. Values of nested
+        regions are numbered when those are written.
+        """
+        id = start
+        for index, block in enumerate(blocks):
+            self.blocks[block] = index
+            for arg in block.args:
+                self.values[arg] = id
+                id += 1
+            for op in block.ops:
+                for result in op.results:
+                    self.values[result] = id
+                    id += 1
+        return id - start
+
+    def write_op(self, data: bytearray, op: Operation):
+        write_varint(data, self.op_name_id(op.name))
+        mask = 0
+        mask_offset = len(data)
+        data.append(0)
+        write_varint(data, self.unknown_location)
+        attributes = self.attribute_dict_id(op)
+        if attributes is not None:
+            mask |= HAS_ATTRS
+            write_varint(data, attributes)
+        if op.results:
+            mask |= HAS_RESULTS
+            write_varint(data, len(op.results))
+            for result in op.results:
+                write_varint(data, self.type_id(result.type))
+        if op.operands:
+            mask |= HAS_OPERANDS
+            write_varint(data, len(op.operands))
+            for operand in op.operands:
+                write_varint(data, self.values[operand])
+        if op.successors:
+            mask |= HAS_SUCCESSORS
+            write_varint(data, len(op.successors))
+            for successor in op.successors:
+                write_varint(data, self.blocks[successor])
+        if op.regions:
+            mask |= HAS_INLINE_REGIONS
+            # No region is marked as isolated from above, so the values of
+            # all regions are numbered in one scope.
+            write_varint(data, len(op.regions) << 1)
+        data[mask_offset] = mask
+
+    def write_regions(
+        self, data: bytearray, op: Operation, start: int
+    ) -> Iterator[tuple[Operation, int]]:
+        """
+        Writes the regions of `op`, yielding every operation in them and the
+        number of values before those of its own regions where the
+        operation is to be written, so that nesting needs no recursion.
+        """
+        for region in op.regions:
+            blocks = list(region.blocks)
+            write_varint(data, len(blocks))
+            if not blocks:
+                continue
+            count = self.number_region(blocks, start)
+            write_varint(data, count)
+            for block in blocks:
+                write_varint(data, len(block.ops) << 1 | bool(block.args))
+                if block.args:
+                    write_varint(data, len(block.args))
+                    for arg in block.args:
+                        write_varint(data, self.type_id(arg.type))
+                        write_varint(data, self.unknown_location)
+                for child in block.ops:
+                    yield child, start + count
+
+    def write_ir(self, module: ModuleOp) -> bytearray:
+        data = bytearray()
+        # The module is the only operation of a block without arguments.
+        write_varint(data, 1 << 1)
+        pending: list[Iterator[tuple[Operation, int]]] = [iter([(module, 0)])]
+        while pending:
+            item = next(pending[-1], None)
+            if item is None:
+                pending.pop()
+                continue
+            op, start = item
+            self.write_op(data, op)
+            if op.regions:
+                pending.append(self.write_regions(data, op, start))
+        return data
+
+    def write_dialects(self) -> bytearray:
+        data = bytearray()
+        write_varint(data, len(self.dialects.ids))
+        for name in self.dialects.ids:
+            write_varint(data, typing.cast(int, name))
+        # The operation names are numbered in the order of the groups of
+        # names of one dialect. They are numbered as they are first used, so
+        # a dialect may have several groups.
+        groups: list[tuple[int, list[int]]] = []
+        for dialect, name in self.op_name_strings:
+            if not groups or groups[-1][0] != dialect:
+                groups.append((dialect, []))
+            groups[-1][1].append(name)
+        for dialect, names in groups:
+            write_varint(data, dialect)
+            write_varint(data, len(names))
+            for name in names:
+                write_varint(data, name)
+        return data
+
+    def write_attributes_and_types(self) -> tuple[bytearray, bytearray]:
+        data = bytearray()
+        offsets = bytearray()
+        write_varint(offsets, len(self.attribute_text))
+        write_varint(offsets, len(self.type_text))
+        for entries in (self.attribute_text, self.type_text):
+            if not entries:
+                continue
+            # All are parsed from their textual form, whatever their dialect.
+            write_varint(offsets, self.builtin)
+            write_varint(offsets, len(entries))
+            for text in entries:
+                entry = text.encode() + b"\0"
+                data += entry
+                write_varint(offsets, len(entry) << 1)
+        return data, offsets
+
+    def write_strings(self) -> bytearray:
+        strings = [typing.cast(str, string).encode() for string in self.strings.ids]
+        data = bytearray()
+        write_varint(data, len(strings))
+        for string in reversed(strings):
+            write_varint(data, len(string) + 1)
+        for string in strings:
+            data += string + b"\0"
+        return data
+
+    def write(self, module: ModuleOp, stream: typing.BinaryIO):
+        ir = self.write_ir(module)
+        attributes_and_types, offsets = self.write_attributes_and_types()
+        stream.write(MAGIC)
+        header = bytearray()
+        write_varint(header, VERSION)
+        stream.write(header + PRODUCER + b"\0")
+        for id, section in (
+            (SECTION_STRING, self.write_strings()),
+            (SECTION_DIALECT, self.write_dialects()),
+            (SECTION_ATTR_TYPE, attributes_and_types),
+            (SECTION_ATTR_TYPE_OFFSET, offsets),
+            (SECTION_IR, ir),
+        ):
+            header = bytearray([id])
+            write_varint(header, len(section))
+            stream.write(header)
+            stream.write(section)
+
+
+def write_bytecode(module: ModuleOp, stream: typing.BinaryIO):
+    """Writes `module` to the binary `stream` in the MLIR bytecode format."""
+    BytecodeWriter().write(module, stream)
@@ -1,5 +1,9 @@
+from xdsl.dialects import builtin
 from xdsl.ir import Dialect
-from xdsl.irdl import IRDLOperation, irdl_op_definition, region_def
+from xdsl.irdl import IRDLOperation, attr_def, irdl_op_definition, region_def
+
+AmountType = builtin.i8
+DeltaType = builtin.IndexType()
 
 
 @irdl_op_definition
@@ -22,6 +26,28 @@ class DecrementOp(IRDLOperation):
     name = "bf.free.dec"
 
 
+@irdl_op_definition
+class AddOp(IRDLOperation):
+    """Counted form of a run of `+`/`-`."""
+
+    name = "bf.free.add"
+    amount = attr_def(builtin.IntegerAttr[builtin.I8])
+
+    def __init__(self, amount: int):
+        super().__init__(attributes={"amount": builtin.IntegerAttr(amount, AmountType)})
+
+
+@irdl_op_definition
+class MoveOp(IRDLOperation):
+    """Counted form of a run of `>`/`<`."""
+
+    name = "bf.free.move"
+    delta = attr_def(builtin.IntegerAttr[builtin.IndexType])
+
+    def __init__(self, delta: int):
+        super().__init__(attributes={"delta": builtin.IntegerAttr(delta, DeltaType)})
+
+
 @irdl_op_definition
 class OutputOp(IRDLOperation):
     name = "bf.free.output"
@@ -45,6 +71,8 @@ FreeBrainFuck = Dialect(
         MoveRightOp,
         IncrementOp,
         DecrementOp,
+        AddOp,
+        MoveOp,
         OutputOp,
         InputOp,
         LoopOp,
@@ -4,8 +4,10 @@ from xdsl.dialects import builtin
 from xdsl.ir import Dialect, Region, SSAValue
 from xdsl.irdl import (
     IRDLOperation,
+    attr_def,
     irdl_op_definition,
     operand_def,
+    opt_attr_def,
     region_def,
     result_def,
     traits_def,
@@ -13,6 +15,21 @@ from xdsl.irdl import (
 from xdsl.traits import IsTerminator
 
 PositionType: TypeAlias = builtin.IndexType
+AmountType = builtin.i8
+
+
+def offset_attributes(**offsets: int) -> dict[str, builtin.IntegerAttr]:
+    """Builds the offset attributes of an operation, omitting zero offsets."""
+    return {
+        name: builtin.IntegerAttr(offset, PositionType())
+        for name, offset in offsets.items()
+        if offset != 0
+    }
+
+
+def offset_value(attr: builtin.IntegerAttr | None) -> int:
+    """Returns the value of an optional offset attribute."""
+    return 0 if attr is None else attr.value.data
 
 
 @irdl_op_definition
@@ -39,48 +56,197 @@ class MoveRightOp(IRDLOperation):
 class IncrementOp(IRDLOperation):
     name = "bf.linked.inc"
     index = operand_def(PositionType())
+    offset = opt_attr_def(builtin.IntegerAttr[builtin.IndexType])
 
-    def __init__(self, index: SSAValue):
-        super().__init__(operands=[index])
+    def __init__(self, index: SSAValue, offset: int = 0):
+        super().__init__(operands=[index], attributes=offset_attributes(offset=offset))
 
 
 @irdl_op_definition
 class DecrementOp(IRDLOperation):
     name = "bf.linked.dec"
     index = operand_def(PositionType())
+    offset = opt_attr_def(builtin.IntegerAttr[builtin.IndexType])
 
-    def __init__(self, index: SSAValue):
-        super().__init__(operands=[index])
+    def __init__(self, index: SSAValue, offset: int = 0):
+        super().__init__(operands=[index], attributes=offset_attributes(offset=offset))
+
+
+@irdl_op_definition
+class AddOp(IRDLOperation):
+    name = "bf.linked.add"
+    index = operand_def(PositionType())
+    amount = attr_def(builtin.IntegerAttr[builtin.I8])
+    offset = opt_attr_def(builtin.IntegerAttr[builtin.IndexType])
+
+    def __init__(self, index: SSAValue, amount: int, offset: int = 0):
+        super().__init__(
+            operands=[index],
+            attributes={
+                "amount": builtin.IntegerAttr(amount, AmountType),
+                **offset_attributes(offset=offset),
+            },
+        )
+
+
+@irdl_op_definition
+class MoveOp(IRDLOperation):
+    name = "bf.linked.move"
+    index = operand_def(PositionType())
+    new_index = result_def(PositionType())
+    delta = attr_def(builtin.IntegerAttr[builtin.IndexType])
+
+    def __init__(self, index: SSAValue, delta: int):
+        super().__init__(
+            operands=[index],
+            result_types=[PositionType()],
+            attributes={"delta": builtin.IntegerAttr(delta, PositionType())},
+        )
+
+
+@irdl_op_definition
+class ClearOp(IRDLOperation):
+    """Sets the cell to zero, e.g. `[-]`."""
+
+    name = "bf.linked.clear"
+    index = operand_def(PositionType())
+    offset = opt_attr_def(builtin.IntegerAttr[builtin.IndexType])
+
+    def __init__(self, index: SSAValue, offset: int = 0):
+        super().__init__(operands=[index], attributes=offset_attributes(offset=offset))
+
+
+@irdl_op_definition
+class SetOp(IRDLOperation):
+    """Sets the cell to `value`, e.g. an increment of a cell known to be zero."""
+
+    name = "bf.linked.set"
+    index = operand_def(PositionType())
+    value = attr_def(builtin.IntegerAttr[builtin.I8])
+    offset = opt_attr_def(builtin.IntegerAttr[builtin.IndexType])
+
+    def __init__(self, index: SSAValue, value: int, offset: int = 0):
+        super().__init__(
+            operands=[index],
+            attributes={
+                "value": builtin.IntegerAttr(value, AmountType),
+                **offset_attributes(offset=offset),
+            },
+        )
+
+
+@irdl_op_definition
+class MulAddOp(IRDLOperation):
+    """Adds `factor` times the cell at `source` to the cell at `offset`."""
+
+    name = "bf.linked.mul_add"
+    index = operand_def(PositionType())
+    offset = attr_def(builtin.IntegerAttr[builtin.IndexType])
+    factor = attr_def(builtin.IntegerAttr[builtin.I8])
+    source = opt_attr_def(builtin.IntegerAttr[builtin.IndexType])
+
+    def __init__(self, index: SSAValue, offset: int, factor: int, source: int = 0):
+        super().__init__(
+            operands=[index],
+            attributes={
+                "offset": builtin.IntegerAttr(offset, PositionType()),
+                "factor": builtin.IntegerAttr(factor, AmountType),
+                **offset_attributes(source=source),
+            },
+        )
+
+
+@irdl_op_definition
+class ScanOp(IRDLOperation):
+    """Moves the index by `stride` until it reaches a zero cell, e.g. `[>]`."""
+
+    name = "bf.linked.scan"
+    index = operand_def(PositionType())
+    new_index = result_def(PositionType())
+    stride = attr_def(builtin.IntegerAttr[builtin.IndexType])
+
+    def __init__(self, index: SSAValue, stride: int):
+        super().__init__(
+            operands=[index],
+            result_types=[PositionType()],
+            attributes={"stride": builtin.IntegerAttr(stride, PositionType())},
+        )
 
 
 @irdl_op_definition
 class OutputOp(IRDLOperation):
     name = "bf.linked.output"
     index = operand_def(PositionType())
+    offset = opt_attr_def(builtin.IntegerAttr[builtin.IndexType])
 
-    def __init__(self, index: SSAValue):
-        super().__init__(operands=[index])
+    def __init__(self, index: SSAValue, offset: int = 0):
+        super().__init__(operands=[index], attributes=offset_attributes(offset=offset))
 
 
 @irdl_op_definition
 class InputOp(IRDLOperation):
     name = "bf.linked.input"
     index = operand_def(PositionType())
+    offset = opt_attr_def(builtin.IntegerAttr[builtin.IndexType])
+
+    def __init__(self, index: SSAValue, offset: int = 0):
+        super().__init__(operands=[index], attributes=offset_attributes(offset=offset))
+
+
+@irdl_op_definition
+class WriteOp(IRDLOperation):
+    """Outputs constant bytes, e.g. the output of a precomputed prefix."""
+
+    name = "bf.linked.write"
+    data = attr_def(builtin.DenseArrayBase)
+
+    def __init__(self, data: bytes):
+        super().__init__(
+            attributes={"data": builtin.DenseArrayBase.from_list(AmountType, data)}
+        )
 
-    def __init__(self, index: SSAValue):
-        super().__init__(operands=[index])
+
+@irdl_op_definition
+class TapeImageOp(IRDLOperation):
+    """
+    The initial contents of the tape, starting at its first cell, the cells
+    after `cells` are zero. Only allowed at the start of `main`.
+    """
+
+    name = "bf.linked.tape_image"
+    cells = attr_def(builtin.DenseArrayBase)
+
+    def __init__(self, cells: bytes):
+        super().__init__(
+            attributes={"cells": builtin.DenseArrayBase.from_list(AmountType, cells)}
+        )
+
+
+def data_bytes(attr: builtin.DenseArrayBase) -> bytes:
+    """Returns the bytes of the `i8` array of a write or tape image."""
+    return bytes(value & 0xFF for value in attr.get_values())
 
 
 @irdl_op_definition
 class LoopOp(IRDLOperation):
+    """
+    Runs the body while the cell is nonzero. `entered` marks loops whose
+    cell is known to be nonzero when they are reached, which skip the first
+    check.
+    """
+
     name = "bf.linked.loop"
     index = operand_def(PositionType())
     new_index = result_def(PositionType())
     body = region_def("single_block")
+    entered = opt_attr_def(builtin.UnitAttr)
 
-    def __init__(self, index: SSAValue, body: Region):
+    def __init__(self, index: SSAValue, body: Region, entered: bool = False):
         super().__init__(
-            operands=[index], result_types=[PositionType()], regions=[body]
+            operands=[index],
+            result_types=[PositionType()],
+            regions=[body],
+            attributes={"entered": builtin.UnitAttr()} if entered else {},
         )
 
 
@@ -101,8 +267,16 @@ LinkedBrainFuck = Dialect(
         MoveRightOp,
         IncrementOp,
         DecrementOp,
+        AddOp,
+        MoveOp,
+        ClearOp,
+        SetOp,
+        MulAddOp,
+        ScanOp,
         OutputOp,
         InputOp,
+        WriteOp,
+        TapeImageOp,
         LoopOp,
         LoopEndOp,
     ],
@@ -1,17 +1,30 @@
-from typing import TypeAlias
-
-import lark
 from xdsl.builder import Builder
-from xdsl.dialects import builtin, func
-from xdsl.ir import (
-    Block,
-    Region,
-)
+from xdsl.dialects import arith, builtin, func
+from xdsl.ir import Block, Region, SSAValue
 from xdsl.rewriter import InsertPoint
 
-from .dialects import free_brainfuck as bf
+from py_mlir_bf_compiler_common.oplist import Opcode, OpList
+
+from .dialects import free_brainfuck as bf, linked_brainfuck as linked_bf
 
-AST: TypeAlias = list[lark.Tree | lark.Token]
+SIMPLE_OPS = {
+    Opcode.LEFT: bf.MoveLeftOp,
+    Opcode.RIGHT: bf.MoveRightOp,
+    Opcode.INC: bf.IncrementOp,
+    Opcode.DEC: bf.DecrementOp,
+    Opcode.OUTPUT: bf.OutputOp,
+    Opcode.INPUT: bf.InputOp,
+}
+LINKED_MOVES = {
+    Opcode.LEFT: linked_bf.MoveLeftOp,
+    Opcode.RIGHT: linked_bf.MoveRightOp,
+}
+LINKED_CELL_OPS = {
+    Opcode.INC: linked_bf.IncrementOp,
+    Opcode.DEC: linked_bf.DecrementOp,
+    Opcode.OUTPUT: linked_bf.OutputOp,
+    Opcode.INPUT: linked_bf.InputOp,
+}
 
 
 class GenMLIR:
@@ -22,33 +35,71 @@ class GenMLIR:
         self.module = builtin.ModuleOp([])
         self.builder = Builder(InsertPoint.at_end(self.module.body.blocks[0]))
 
-    def gen_main_func(self, ast: AST):
+    def gen_main_func(self, ops: OpList, linked: bool = False):
+        """
+        Generates `main` in the free dialect, or directly in the linked
+        dialect if `linked` is set, which skips `LowerFreeToLinkedBfPass`.
+        """
         body = Block()
         body_builder = Builder(InsertPoint.at_end(body))
-        self.gen_instructions(body_builder, ast)
+        if linked:
+            self.gen_linked_ops(body_builder, ops)
+        else:
+            self.gen_ops(body_builder, ops)
         body_builder.insert(func.ReturnOp())
         func_type = builtin.FunctionType.from_lists([], [])
         self.builder.insert(func.FuncOp("main", func_type, Region(body)))
 
-    def gen_instructions(self, builder: Builder, ast: AST):
-        for op in ast:
-            match op:
-                case lark.Token("MOVE_LEFT"):
-                    builder.insert(bf.MoveLeftOp())
-                case lark.Token("MOVE_RIGHT"):
-                    builder.insert(bf.MoveRightOp())
-                case lark.Token("INCREMENT"):
-                    builder.insert(bf.IncrementOp())
-                case lark.Token("DECREMENT"):
-                    builder.insert(bf.DecrementOp())
-                case lark.Token("OUTPUT"):
-                    builder.insert(bf.OutputOp())
-                case lark.Token("INPUT"):
-                    builder.insert(bf.InputOp())
-                case lark.Tree(lark.Token("RULE", "loop"), children):
-                    body = Block()
-                    body_builder = Builder(InsertPoint.at_end(body))
-                    self.gen_instructions(body_builder, children)
-                    builder.insert(bf.LoopOp(regions=[Region(body)]))
-                case other:
-                    raise Exception(f"Invalid Token in AST: {other!r}")
+    def gen_ops(self, builder: Builder, ops: OpList):
+        """
+        Generates the free dialect operations, keeping the enclosing blocks
+        of open loops on a stack.
+        """
+        stack: list[tuple[Builder, Block]] = []
+        for opcode, arg in zip(ops.opcodes, ops.args):
+            if opcode == Opcode.LOOP_START:
+                body = Block()
+                stack.append((builder, body))
+                builder = Builder(InsertPoint.at_end(body))
+            elif opcode == Opcode.LOOP_END:
+                builder, body = stack.pop()
+                builder.insert(bf.LoopOp(regions=[Region(body)]))
+            elif opcode == Opcode.ADD:
+                builder.insert(bf.AddOp(arg))
+            elif opcode == Opcode.MOVE:
+                builder.insert(bf.MoveOp(arg))
+            else:
+                builder.insert(SIMPLE_OPS[opcode]())
+
+    def gen_linked_ops(self, builder: Builder, ops: OpList):
+        """
+        Generates the linked dialect operations, threading the index through
+        them just like `LowerFreeToLinkedBfPass`. Loops are inserted once
+        their body is complete, so that inserting into deeply nested bodies
+        does not walk up all the enclosing loops.
+        """
+        start = builder.insert(
+            arith.ConstantOp(builtin.IntegerAttr(0, builtin.IndexType()))
+        )
+        index: SSAValue = start.result
+        stack: list[tuple[Builder, Block, SSAValue]] = []
+        for opcode, arg in zip(ops.opcodes, ops.args):
+            if opcode == Opcode.LOOP_START:
+                body = Block(arg_types=[linked_bf.PositionType()])
+                stack.append((builder, body, index))
+                builder = Builder(InsertPoint.at_end(body))
+                index = body.args[0]
+            elif opcode == Opcode.LOOP_END:
+                builder.insert(linked_bf.LoopEndOp(index))
+                builder, body, entry_index = stack.pop()
+                index = builder.insert(
+                    linked_bf.LoopOp(entry_index, Region(body))
+                ).new_index
+            elif opcode == Opcode.ADD:
+                builder.insert(linked_bf.AddOp(index, arg))
+            elif opcode == Opcode.MOVE:
+                index = builder.insert(linked_bf.MoveOp(index, arg)).results[0]
+            elif opcode in LINKED_MOVES:
+                index = builder.insert(LINKED_MOVES[opcode](index)).results[0]
+            else:
+                builder.insert(LINKED_CELL_OPS[opcode](index))
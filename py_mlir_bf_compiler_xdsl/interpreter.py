@@ -0,0 +1,406 @@
+import sys
+from array import array
+from collections.abc import Callable
+from enum import IntEnum
+from typing import BinaryIO
+
+from xdsl.dialects import arith, builtin, func
+from xdsl.dialects.builtin import ModuleOp
+from xdsl.ir import Operation
+
+from py_mlir_bf_compiler_common.oplist import Opcode, OpList
+
+from .dialects import free_brainfuck as free_bf, linked_brainfuck as linked_bf
+from .rewrites.lower_linked_to_builtin import MEMORY_SIZE
+
+# CPython refuses to compile more than 20 statically nested blocks, deeper
+# loops are split off into functions of their own.
+MAX_NESTING = 16
+OUTPUT_BUFFER_SIZE = 1 << 16
+
+
+class Instr(IntEnum):
+    ADD = 0
+    """`cell[offset] += arg`"""
+    MOVE = 1
+    """`pointer += arg`"""
+    STORE = 2
+    """`cell[offset] = arg`"""
+    MUL_ADD = 3
+    """`cell[offset] += cell[source] * arg`"""
+    OUTPUT = 4
+    INPUT = 5
+    LOOP = 6
+    """Skips to after the matching `END` (at `arg` relative) if the cell is 0."""
+    END = 7
+    """Jumps back to the matching `LOOP` or `ENTER` (at `arg` relative)."""
+    SCAN = 8
+    """`pointer += arg` until the cell is 0."""
+    WRITE = 9
+    """Outputs the bytes `blobs[arg]`."""
+    ENTER = 10
+    """A `LOOP` known to be entered, which tests the cell only at its `END`."""
+
+
+class Instructions:
+    """
+    The instruction array executed by the interpreter. Counted operations
+    are fused while appending: consecutive adds to the same cell and moves
+    are merged and moves are turned into offsets of the following memory
+    accesses, only materialized before loops. The tape starts out with the
+    cells of `image`, the rest zero.
+    """
+
+    __slots__ = ("opcodes", "args", "offsets", "sources", "blobs", "image", "_delta")
+
+    opcodes: array
+    args: array
+    offsets: array
+    sources: array
+    blobs: list[bytes]
+    image: bytes
+    _delta: int
+
+    def __init__(self) -> None:
+        self.opcodes = array("B")
+        self.args = array("q")
+        self.offsets = array("q")
+        self.sources = array("q")
+        self.blobs = []
+        self.image = b""
+        self._delta = 0
+
+    def __len__(self) -> int:
+        return len(self.opcodes)
+
+    def _append(self, opcode: Instr, arg: int = 0, offset: int = 0, source: int = 0):
+        self.opcodes.append(opcode)
+        self.args.append(arg)
+        self.offsets.append(offset)
+        self.sources.append(source)
+
+    def _flush_moves(self):
+        if self._delta:
+            self._append(Instr.MOVE, self._delta)
+            self._delta = 0
+
+    def move(self, delta: int):
+        self._delta += delta
+
+    def add(self, amount: int, offset: int = 0):
+        offset += self._delta
+        if (
+            self.opcodes
+            and self.opcodes[-1] == Instr.ADD
+            and self.offsets[-1] == offset
+        ):
+            self.args[-1] = (self.args[-1] + amount) & 0xFF
+        else:
+            self._append(Instr.ADD, amount & 0xFF, offset)
+
+    def store(self, value: int, offset: int = 0):
+        self._append(Instr.STORE, value & 0xFF, offset + self._delta)
+
+    def mul_add(self, factor: int, offset: int, source: int = 0):
+        self._append(
+            Instr.MUL_ADD, factor & 0xFF, offset + self._delta, source + self._delta
+        )
+
+    def output(self, offset: int = 0):
+        self._append(Instr.OUTPUT, 0, offset + self._delta)
+
+    def input(self, offset: int = 0):
+        self._append(Instr.INPUT, 0, offset + self._delta)
+
+    def write(self, data: bytes):
+        self._append(Instr.WRITE, len(self.blobs))
+        self.blobs.append(data)
+
+    def scan(self, stride: int):
+        self._flush_moves()
+        self._append(Instr.SCAN, stride)
+
+    def loop(self, entered: bool = False):
+        self._flush_moves()
+        self._append(Instr.ENTER if entered else Instr.LOOP)
+
+    def end(self):
+        self._flush_moves()
+        self._append(Instr.END)
+
+    def finish(self) -> "Instructions":
+        """Drops the trailing moves and computes the jump table."""
+        self._delta = 0
+        stack: list[int] = []
+        for index, opcode in enumerate(self.opcodes):
+            if opcode in (Instr.LOOP, Instr.ENTER):
+                stack.append(index)
+            elif opcode == Instr.END:
+                start = stack.pop()
+                self.args[start] = index - start
+                self.args[index] = start - index
+        return self
+
+    @classmethod
+    def from_oplist(cls, ops: OpList) -> "Instructions":
+        instructions = cls()
+        for opcode, arg in zip(ops.opcodes, ops.args):
+            match opcode:
+                case Opcode.LEFT:
+                    instructions.move(-1)
+                case Opcode.RIGHT:
+                    instructions.move(1)
+                case Opcode.MOVE:
+                    instructions.move(arg)
+                case Opcode.INC:
+                    instructions.add(1)
+                case Opcode.DEC:
+                    instructions.add(-1)
+                case Opcode.ADD:
+                    instructions.add(arg)
+                case Opcode.OUTPUT:
+                    instructions.output()
+                case Opcode.INPUT:
+                    instructions.input()
+                case Opcode.LOOP_START:
+                    instructions.loop()
+                case Opcode.LOOP_END:
+                    instructions.end()
+        return instructions.finish()
+
+    @classmethod
+    def from_module(cls, module: ModuleOp) -> "Instructions":
+        """
+        Converts the `main` function of a module in the free or linked
+        dialect, with the functions outlined from it inlined.
+        """
+        instructions = cls()
+        main = module.body.block.first_op
+        assert main is not None
+        functions = {
+            function.sym_name.data: function
+            for function in module.body.block.ops
+            if isinstance(function, func.FuncOp)
+        }
+        # Pending operations in reverse order, `None` marks the end of a loop.
+        pending: list[Operation | None] = list(reversed(main.regions[0].block.ops))
+        while pending:
+            op = pending.pop()
+            match op:
+                case None:
+                    instructions.end()
+                case free_bf.MoveLeftOp() | linked_bf.MoveLeftOp():
+                    instructions.move(-1)
+                case free_bf.MoveRightOp() | linked_bf.MoveRightOp():
+                    instructions.move(1)
+                case free_bf.MoveOp(delta=delta) | linked_bf.MoveOp(delta=delta):
+                    instructions.move(delta.value.data)
+                case free_bf.IncrementOp():
+                    instructions.add(1)
+                case free_bf.DecrementOp():
+                    instructions.add(-1)
+                case free_bf.AddOp(amount=amount):
+                    instructions.add(amount.value.data)
+                case free_bf.OutputOp():
+                    instructions.output()
+                case free_bf.InputOp():
+                    instructions.input()
+                case linked_bf.IncrementOp():
+                    instructions.add(1, linked_bf.offset_value(op.offset))
+                case linked_bf.DecrementOp():
+                    instructions.add(-1, linked_bf.offset_value(op.offset))
+                case linked_bf.AddOp(amount=amount):
+                    instructions.add(
+                        amount.value.data, linked_bf.offset_value(op.offset)
+                    )
+                case linked_bf.ClearOp():
+                    instructions.store(0, linked_bf.offset_value(op.offset))
+                case linked_bf.SetOp(value=value):
+                    instructions.store(
+                        value.value.data, linked_bf.offset_value(op.offset)
+                    )
+                case linked_bf.MulAddOp(factor=factor):
+                    instructions.mul_add(
+                        factor.value.data,
+                        linked_bf.offset_value(op.offset),
+                        linked_bf.offset_value(op.source),
+                    )
+                case linked_bf.ScanOp(stride=stride):
+                    instructions.scan(stride.value.data)
+                case linked_bf.OutputOp():
+                    instructions.output(linked_bf.offset_value(op.offset))
+                case linked_bf.InputOp():
+                    instructions.input(linked_bf.offset_value(op.offset))
+                case linked_bf.WriteOp(data=data):
+                    instructions.write(linked_bf.data_bytes(data))
+                case linked_bf.TapeImageOp(cells=cells):
+                    instructions.image = linked_bf.data_bytes(cells)
+                case arith.ConstantOp(
+                    value=builtin.IntegerAttr(type=builtin.IndexType())
+                ):
+                    # The start index, not zero after partial evaluation.
+                    instructions.move(op.value.value.data)
+                case free_bf.LoopOp():
+                    instructions.loop()
+                    pending.append(None)
+                    pending.extend(reversed(op.regions[0].block.ops))
+                case linked_bf.LoopOp():
+                    # Runs the body once without testing the cell, like the
+                    # builtin lowering does.
+                    instructions.loop(entered=op.entered is not None)
+                    pending.append(None)
+                    pending.extend(reversed(op.regions[0].block.ops))
+                case func.CallOp(callee=callee):
+                    function = functions[callee.root_reference.data]
+                    pending.extend(reversed(function.body.block.ops))
+                case linked_bf.LoopEndOp() | func.ReturnOp():
+                    # The index values of the linked dialect always thread
+                    # the pointer in program order, it is implicit here.
+                    pass
+                case other:
+                    raise Exception(f"Can not interpret {other.name}")
+        return instructions.finish()
+
+
+def _wrap(expression: str, tape_size: int) -> str:
+    if tape_size & (tape_size - 1) == 0:
+        return f"({expression}) & {tape_size - 1}"
+    return f"({expression}) % {tape_size}"
+
+
+def _cell(offset: int, tape_size: int) -> str:
+    return f"t[{_wrap(f'p + {offset}', tape_size)}]" if offset else "t[p]"
+
+
+def to_python(instructions: Instructions, tape_size: int = MEMORY_SIZE) -> str:
+    """
+    Translates the instructions to the source of a Python module whose
+    `run(t, p)` executes them on the tape `t` of `tape_size` cells. Loops are
+    turned into `while` statements using the jump table, which is much
+    faster than dispatching every instruction in CPython.
+    """
+    functions: list[list[str]] = [["def run(t, p):"]]
+    # Per open loop: the enclosing lines and depth, whether the loop was
+    # split off into a function and whether it is known to be entered.
+    stack: list[tuple[list[str], int, bool, bool]] = []
+    lines = functions[0]
+    depth = 1
+    for opcode, arg, offset, source in zip(
+        instructions.opcodes,
+        instructions.args,
+        instructions.offsets,
+        instructions.sources,
+    ):
+        indent = "    " * depth
+        match opcode:
+            case Instr.ADD:
+                cell = _cell(offset, tape_size)
+                lines.append(f"{indent}{cell} = ({cell} + {arg}) & 255")
+            case Instr.MOVE:
+                lines.append(f"{indent}p = {_wrap(f'p + {arg}', tape_size)}")
+            case Instr.STORE:
+                lines.append(f"{indent}{_cell(offset, tape_size)} = {arg}")
+            case Instr.MUL_ADD:
+                cell = _cell(offset, tape_size)
+                lines.append(
+                    f"{indent}{cell} = ({cell} + {_cell(source, tape_size)} * {arg}) & 255"
+                )
+            case Instr.SCAN:
+                # Unit strides search with the bytes methods first, wrapping
+                # around at the ends of the tape.
+                if arg == 1:
+                    lines.append(f"{indent}q = t.find(0, p)")
+                    lines.append(f"{indent}if q < 0:")
+                    lines.append(f"{indent}    q = t.find(0, 0, p)")
+                elif arg == -1:
+                    lines.append(f"{indent}q = t.rfind(0, 0, p + 1)")
+                    lines.append(f"{indent}if q < 0:")
+                    lines.append(f"{indent}    q = t.rfind(0, p + 1)")
+                if arg in (-1, 1):
+                    lines.append(f"{indent}if q >= 0:")
+                    lines.append(f"{indent}    p = q")
+                lines.append(f"{indent}while t[p]:")
+                lines.append(f"{indent}    p = {_wrap(f'p + {arg}', tape_size)}")
+            case Instr.OUTPUT:
+                lines.append(f"{indent}output({_cell(offset, tape_size)})")
+            case Instr.WRITE:
+                lines.append(f"{indent}write({instructions.blobs[arg]!r})")
+            case Instr.INPUT:
+                lines.append(f"{indent}value = read()")
+                lines.append(f"{indent}if value >= 0:")
+                lines.append(f"{indent}    {_cell(offset, tape_size)} = value")
+            case Instr.LOOP | Instr.ENTER:
+                entered = opcode == Instr.ENTER
+                new_function = depth > MAX_NESTING
+                if new_function:
+                    name = f"loop_{len(functions)}"
+                    lines.append(f"{indent}p = {name}(t, p)")
+                    stack.append((lines, depth, True, entered))
+                    lines = [f"def {name}(t, p):"]
+                    functions.append(lines)
+                    depth = 1
+                    indent = "    "
+                else:
+                    stack.append((lines, depth, False, entered))
+                lines.append(f"{indent}while {'True' if entered else 't[p]'}:")
+                lines.append(f"{indent}    pass")
+                depth += 1
+            case Instr.END:
+                outer_lines, outer_depth, new_function, entered = stack.pop()
+                if entered:
+                    lines.append(f"{indent}if not t[p]:")
+                    lines.append(f"{indent}    break")
+                depth -= 1
+                if new_function:
+                    lines.append("    return p")
+                    lines = outer_lines
+                    depth = outer_depth
+    functions[0].append("    return p")
+    return "\n\n".join("\n".join(function) for function in functions) + "\n"
+
+
+def interpret(
+    instructions: Instructions,
+    stdin: BinaryIO | None = None,
+    stdout: BinaryIO | None = None,
+    tape_size: int = MEMORY_SIZE,
+) -> bytearray:
+    """
+    Runs the instructions on a tape of `tape_size` cells, initialized with
+    the image of the instructions, the pointer wraps around at its ends.
+    Output is buffered and flushed when full, before reading input and at
+    the end. On end of input the cell is left unchanged. Returns the tape.
+    """
+    stdin = sys.stdin.buffer if stdin is None else stdin
+    stdout = sys.stdout.buffer if stdout is None else stdout
+    buffer = bytearray()
+
+    def flush():
+        stdout.write(buffer)
+        stdout.flush()
+        buffer.clear()
+
+    def output(value: int):
+        buffer.append(value)
+        if len(buffer) >= OUTPUT_BUFFER_SIZE:
+            flush()
+
+    def write(data: bytes):
+        buffer.extend(data)
+        if len(buffer) >= OUTPUT_BUFFER_SIZE:
+            flush()
+
+    def read() -> int:
+        flush()
+        value = stdin.read(1)
+        return value[0] if value else -1
+
+    namespace: dict[str, Callable] = {"output": output, "write": write, "read": read}
+    exec(compile(to_python(instructions, tape_size), "<bf>", "exec"), namespace)
+    tape = bytearray(tape_size)
+    tape[: len(instructions.image)] = instructions.image
+    try:
+        namespace["run"](tape, 0)
+    finally:
+        flush()
+    return tape
@@ -1,7 +1,11 @@
+import functools
+
 import lark
 
 
+@functools.cache
 def BrainfuckParser():
+    # Building the LALR tables is slow, and the parser can be reused.
     return lark.Lark.open_from_package(
         __name__, "brainfuck.lark", parser="lalr", strict=True
     )
@@ -1,4 +1,4 @@
-from typing import Protocol
+from collections.abc import Iterator
 
 from xdsl.context import Context
 from xdsl.dialects import arith, builtin, func
@@ -10,41 +10,56 @@ from xdsl.rewriter import InsertPoint, Rewriter
 from ..dialects import free_brainfuck as free_bf, linked_brainfuck as linked_bf
 
 
-class Visitor(Protocol):
-    def enter(self, op: Operation) -> bool: ...
-    def leave(self, op: Operation) -> None: ...
-
+class FreeToLinkedLowering:
+    """
+    Lowers the free dialect in a function to the linked dialect in a single
+    pass over its operations. The blocks of the enclosing loops are kept on
+    an explicit stack instead of recursing into them, so the nesting depth
+    is only limited by memory. All state lives in the instance, lowerings
+    of separate modules can run concurrently.
 
-def walk(op: Operation, visitor: Visitor):
-    if visitor.enter(op):
-        for region in op.regions:
-            for block in region.blocks:
-                for block_op in block.ops:
-                    walk(block_op, visitor)
-        visitor.leave(op)
+    A lowered loop only replaces the free one once its body is done, as
+    inserting an operation walks up the ancestors of the block, which would
+    take time proportional to the nesting depth.
+    """
 
+    def __init__(self) -> None:
+        # The current index of every block being lowered, innermost last.
+        self.index: list[SSAValue] = []
+        # The operations left to lower in those blocks, the loop whose body
+        # the block is and the free loop it replaces (`None` for the
+        # function body).
+        self.pending: list[
+            tuple[Iterator[Operation], linked_bf.LoopOp | None, Operation | None]
+        ] = []
 
-class FreeToLinkedVisitor(Visitor):
-    index: list[SSAValue] = []
+    def lower(self, function: func.FuncOp):
+        start = arith.ConstantOp(builtin.IntegerAttr(0, builtin.IndexType()))
+        Rewriter.insert_op(start, InsertPoint.at_start(function.body.block))
+        self.index = [start.results[0]]
+        self.pending = [(iter(function.body.block.ops), None, None)]
+        while self.pending:
+            ops, loop, free_loop = self.pending[-1]
+            # The iterator already points past `op`, so replacing it is safe.
+            op = next(ops, None)
+            if op is not None:
+                self.lower_op(op)
+                continue
+            self.pending.pop()
+            index = self.index.pop()
+            if loop is not None and free_loop is not None:
+                loop.body.block.add_op(linked_bf.LoopEndOp(index))
+                Rewriter.replace_op(free_loop, loop, [])
 
-    def enter(self, op: Operation) -> bool:
+    def lower_op(self, op: Operation):
         match op:
-            case func.FuncOp(body=body):
-                new_op = arith.ConstantOp(builtin.IntegerAttr(0, builtin.IndexType()))
-                Rewriter.insert_op(new_op, InsertPoint.at_start(body.block))
-                assert len(self.index) == 0
-                self.index = [new_op.results[0]]
-                return True
             case free_bf.LoopOp(body=body):
                 block = body.detach_block(body.block)
                 block_index_arg = block.insert_arg(linked_bf.PositionType(), 0)
                 new_op = linked_bf.LoopOp(self.index[-1], Region(block))
-                Rewriter.replace_op(op, new_op, [])
                 self.index[-1] = new_op.results[0]
                 self.index.append(block_index_arg)
-                walk(new_op, self)
-                self.index.pop()
-                return False
+                self.pending.append((iter(block.ops), new_op, op))
             case free_bf.MoveLeftOp():
                 new_op = linked_bf.MoveLeftOp(self.index[-1])
                 Rewriter.replace_op(op, new_op, [])
@@ -53,6 +68,14 @@ class FreeToLinkedVisitor(Visitor):
                 new_op = linked_bf.MoveRightOp(self.index[-1])
                 Rewriter.replace_op(op, new_op, [])
                 self.index[-1] = new_op.results[0]
+            case free_bf.MoveOp(delta=delta):
+                new_op = linked_bf.MoveOp(self.index[-1], delta.value.data)
+                Rewriter.replace_op(op, new_op, [])
+                self.index[-1] = new_op.results[0]
+            case free_bf.AddOp(amount=amount):
+                Rewriter.replace_op(
+                    op, linked_bf.AddOp(self.index[-1], amount.value.data)
+                )
             case free_bf.IncrementOp():
                 Rewriter.replace_op(op, linked_bf.IncrementOp(self.index[-1]))
             case free_bf.DecrementOp():
@@ -61,26 +84,16 @@ class FreeToLinkedVisitor(Visitor):
                 Rewriter.replace_op(op, linked_bf.OutputOp(self.index[-1]))
             case free_bf.InputOp():
                 Rewriter.replace_op(op, linked_bf.InputOp(self.index[-1]))
-            case linked_bf.LoopOp():
-                return True
-            case ModuleOp():
-                return True
-        return False
-
-    def leave(self, op: Operation):
-        match op:
-            case func.FuncOp():
-                self.index.pop()
-            case linked_bf.LoopOp(body=body):
-                body.block.add_op(linked_bf.LoopEndOp(self.index[-1]))
 
 
 class LowerFreeToLinkedBfPass(ModulePass):
     """
-    A pass for lowering operations in the Toy dialect to built-in dialects.
+    A pass for lowering operations in the free dialect to the linked dialect.
     """
 
     name = "lower-free-to-linked"
 
     def apply(self, ctx: Context, op: ModuleOp) -> None:
-        walk(op, FreeToLinkedVisitor())
+        for function in list(op.body.block.ops):
+            if isinstance(function, func.FuncOp):
+                FreeToLinkedLowering().lower(function)
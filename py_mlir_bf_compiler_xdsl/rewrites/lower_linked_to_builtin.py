@@ -1,8 +1,12 @@
+from dataclasses import dataclass
+from typing import Literal, TypeAlias
+
 from xdsl.builder import Builder, ImplicitBuilder
 from xdsl.context import Context
-from xdsl.dialects import arith, builtin, func, llvm, memref, scf
-from xdsl.dialects.builtin import ModuleOp
-from xdsl.ir import Block, Region, SSAValue
+from xdsl.dialects import affine, arith, builtin, func, llvm, memref, scf
+from xdsl.dialects.builtin import AffineMapAttr, ModuleOp
+from xdsl.ir import Block, BlockArgument, Operation, OpResult, Region, SSAValue
+from xdsl.ir.affine import AffineExpr, AffineMap
 from xdsl.passes import ModulePass
 from xdsl.pattern_rewriter import (
     GreedyRewritePatternApplier,
@@ -11,18 +15,413 @@ from xdsl.pattern_rewriter import (
     RewritePattern,
     op_type_rewrite_pattern,
 )
-from xdsl.rewriter import InsertPoint
+from xdsl.rewriter import InsertPoint, Rewriter
 
 from ..dialects import linked_brainfuck as linked_bf
+from .pointer_range import loop_positions, pointer_range
+from .sink_moves import MEMORY_OPS, move_delta, shift_offsets
 
 MEMORY_SIZE = 1 << 15
 MEMORY_TYPE = builtin.IntegerType(8, builtin.Signedness.SIGNLESS)
 
+TapeAllocation: TypeAlias = Literal["global", "stack", "heap"]
+TAPE = "bf_tape"
+TAPE_IMAGE = "bf_tape_image"
+
+BoundsMode: TypeAlias = Literal["wrap", "check", "unchecked"]
+BOUNDS_ERROR = "bf_bounds_error"
+BOUNDS_MESSAGE = "bf_bounds_message"
+BOUNDS_MESSAGE_TEXT = b"bf: pointer out of bounds\n"
+
+IOMode: TypeAlias = Literal["unbuffered", "line", "full"]
+IO_BUFFER_SIZE = 1 << 16
+SYS_READ = 0
+SYS_WRITE = 1
+STDIN = 0
+STDOUT = 1
+STDERR = 2
+SYS_EXIT_GROUP = 231
+FLUSH_OUTPUT = "bf_flush_output"
+REFILL_INPUT = "bf_refill_input"
+OUTPUT_DATA = "bf_output_data"
+MEMCHR = "memchr"
+MEMRCHR = "memrchr"
+
+MEMREF_LLVM_STRUCT = llvm.LLVMStructType(
+    builtin.StringAttr(""),
+    builtin.ArrayAttr(
+        [
+            llvm.LLVMPointerType(),
+            llvm.LLVMPointerType(),
+            builtin.i64,
+            llvm.LLVMArrayType(builtin.IntAttr(1), builtin.i64),
+            llvm.LLVMArrayType(builtin.IntAttr(1), builtin.i64),
+        ]
+    ),
+)
+
+
+def element_ptr(buffer: SSAValue, index: SSAValue) -> SSAValue:
+    """
+    Computes an llvm pointer to the byte at `index` of the 1-d `buffer`.
+    Has to be called inside an `ImplicitBuilder`.
+    """
+    cast_memref_op = builtin.UnrealizedConversionCastOp(
+        operands=[buffer], result_types=[MEMREF_LLVM_STRUCT]
+    )
+    cast_index_op = builtin.UnrealizedConversionCastOp(
+        operands=[index], result_types=[builtin.i64]
+    )
+    val_op = llvm.ExtractValueOp(
+        builtin.DenseArrayBase.from_list(builtin.i64, [1]),
+        cast_memref_op.results[0],
+        result_type=llvm.LLVMPointerType(),
+    )
+    elementptr_op = llvm.GEPOp(
+        val_op.results[0],
+        [llvm.GEP_USE_SSA_VAL],
+        MEMORY_TYPE,
+        ssa_indices=[cast_index_op.results[0]],
+    )
+    return elementptr_op.results[0]
+
+
+def syscall(number: int, fd: int, ptr: SSAValue, length: SSAValue) -> SSAValue:
+    """
+    Emits a read/write style syscall returning its i64 result.
+    Has to be called inside an `ImplicitBuilder`.
+    """
+    number_op = arith.ConstantOp(builtin.IntegerAttr(number, builtin.i64))
+    fd_op = (
+        number_op
+        if fd == number
+        else arith.ConstantOp(builtin.IntegerAttr(fd, builtin.i64))
+    )
+    asm_op = llvm.InlineAsmOp(
+        "syscall",
+        "={rax},{rax},{rdi},{rsi},{rdx},~{rcx},~{r11}",
+        [number_op, fd_op, ptr, length],
+        has_side_effects=True,
+        res_types=[builtin.i64],
+    )
+    return asm_op.results[0]
+
+
+def write_all(buffer: SSAValue, length: SSAValue):
+    """
+    Writes the first `length` bytes of the 1-d `buffer` to stdout, retrying
+    after partial writes. Has to be called inside an `ImplicitBuilder`.
+    """
+    zero = arith.ConstantOp(builtin.IntegerAttr(0, linked_bf.PositionType()))
+    zero_i64 = arith.ConstantOp(builtin.IntegerAttr(0, builtin.i64))
+    while_op = scf.WhileOp(
+        [zero],
+        [linked_bf.PositionType()],
+        Region(Block([], arg_types=[linked_bf.PositionType()])),
+        Region(Block([], arg_types=[linked_bf.PositionType()])),
+    )
+    with ImplicitBuilder(while_op.before_region.block) as (written,):
+        pending = arith.CmpiOp(written, length, "ult")
+        scf.ConditionOp(pending.result, written)
+    with ImplicitBuilder(while_op.after_region.block) as (written,):
+        remaining = arith.SubiOp(length, written)
+        count = syscall(
+            SYS_WRITE,
+            STDOUT,
+            element_ptr(buffer, written),
+            arith.IndexCastOp(remaining, builtin.i64).result,
+        )
+        # Give up on errors instead of retrying forever.
+        success = arith.CmpiOp(count, zero_i64, "sgt")
+        advanced = arith.AddiOp(
+            written, arith.IndexCastOp(count, linked_bf.PositionType())
+        )
+        scf.YieldOp(arith.SelectOp(success, advanced, length))
+
+
+def constant_global(module: ModuleOp, name: str, data: bytes) -> builtin.MemRefType:
+    """Declares a constant global holding `data`, returns its type."""
+    data_type = builtin.MemRefType(MEMORY_TYPE, [len(data)])
+    module.body.block.add_op(
+        memref.GlobalOp.get(
+            builtin.StringAttr(name),
+            data_type,
+            builtin.DenseIntOrFPElementsAttr.from_list(
+                builtin.TensorType(MEMORY_TYPE, [len(data)]), list(data)
+            ),
+            constant=builtin.UnitAttr(),
+        )
+    )
+    return data_type
+
+
+def memset_zero(buffer: SSAValue, size: int):
+    """
+    Zeroes the first `size` bytes of `buffer` with `llvm.memset`.
+    Has to be called inside an `ImplicitBuilder`.
+    """
+    zero = arith.ConstantOp(builtin.IntegerAttr(0, MEMORY_TYPE))
+    length = arith.ConstantOp(builtin.IntegerAttr(size, builtin.i64))
+    is_volatile = arith.ConstantOp(builtin.IntegerAttr(0, builtin.i1))
+    start = arith.ConstantOp(builtin.IntegerAttr(0, linked_bf.PositionType()))
+    llvm.CallIntrinsicOp(
+        "llvm.memset.p0.i64",
+        [element_ptr(buffer, start.result), zero, length, is_volatile],
+        [],
+        op_bundle_sizes=builtin.DenseArrayBase.from_list(builtin.i32, []),
+    )
+
+
+def copy_image(buffer: SSAValue, image: SSAValue, size: int):
+    """
+    Copies the first `size` bytes of `image` to `buffer` with `llvm.memcpy`.
+    Has to be called inside an `ImplicitBuilder`.
+    """
+    length = arith.ConstantOp(builtin.IntegerAttr(size, builtin.i64))
+    is_volatile = arith.ConstantOp(builtin.IntegerAttr(0, builtin.i1))
+    start = arith.ConstantOp(builtin.IntegerAttr(0, linked_bf.PositionType()))
+    llvm.CallIntrinsicOp(
+        "llvm.memcpy.p0.p0.i64",
+        [
+            element_ptr(buffer, start.result),
+            element_ptr(image, start.result),
+            length,
+            is_volatile,
+        ],
+        [],
+        op_bundle_sizes=builtin.DenseArrayBase.from_list(builtin.i32, []),
+    )
+
+
+def call_if(condition: SSAValue, callee: str):
+    """
+    Calls the function `callee` if `condition` holds.
+    Has to be called inside an `ImplicitBuilder`.
+    """
+    if_op = scf.IfOp(condition, [], Region(Block()))
+    with ImplicitBuilder(if_op.true_region.block):
+        func.CallOp(callee, [], [])
+        scf.YieldOp()
+
+
+class TapeIndexing:
+    """
+    Computes the indices of cells on a tape of `size` cells, keeping them in
+    bounds as selected by `bounds`: wrapped around at the ends of the tape
+    (`wrap`), aborting the program when they leave it (`check`) or not at
+    all (`unchecked`). Has to be created inside an `ImplicitBuilder`.
+
+    Cells at an offset from an index defined in the block `scope` (the body
+    of a function, if given) are loaded and stored with the affine dialect,
+    which MLIR can analyze, unless indices are checked.
+    """
+
+    def __init__(self, size: int, bounds: BoundsMode, scope: Block | None = None):
+        self.size = size
+        self.bounds = bounds
+        self.scope = scope
+        # Tapes of a power of two size wrap with a mask, others with a
+        # remainder.
+        self.masked = bounds == "wrap" and size & (size - 1) == 0
+        self.const_bound = None
+        if bounds != "unchecked":
+            self.const_bound = arith.ConstantOp(
+                builtin.IntegerAttr(
+                    size - 1 if self.masked else size, linked_bf.PositionType()
+                )
+            )
+            self.const_bound.result.name_hint = "index_mask" if self.masked else "size"
+
+    def cell_index(self, index: SSAValue, offset: int) -> SSAValue:
+        """
+        Computes the index of the cell at `offset` from `index`.
+        Has to be called inside an `ImplicitBuilder`.
+        """
+        if self.bounds == "wrap" and not self.masked:
+            # Keeps the sum below twice the size for the remainder.
+            offset %= self.size
+        if offset == 0:
+            return index
+        offset_op = arith.ConstantOp(
+            builtin.IntegerAttr(offset, linked_bf.PositionType())
+        )
+        add_op = arith.AddiOp(index, offset_op.result)
+        if self.const_bound is None:
+            return add_op.result
+        match self.bounds:
+            case "wrap" if self.masked:
+                return arith.AndIOp(add_op.result, self.const_bound.result).result
+            case "wrap":
+                return arith.RemUIOp(add_op.result, self.const_bound.result).result
+            case "check":
+                # Indices below zero wrap around to huge unsigned values.
+                outside = arith.CmpiOp(add_op.result, self.const_bound.result, "uge")
+                call_if(outside.result, BOUNDS_ERROR)
+        return add_op.result
+
+    def affine_map(self, index: SSAValue, offset: int) -> AffineMapAttr | None:
+        """
+        Returns the map from `index` as its only symbol to the cell at
+        `offset` from it, or `None` if the cell can not be addressed with
+        the affine dialect.
+        """
+        if self.scope is None or self.bounds == "check":
+            return None
+        # Arguments of a function are valid affine symbols as well.
+        if isinstance(index, OpResult):
+            if index.op.parent_block() is not self.scope:
+                return None
+        elif not isinstance(index, BlockArgument) or index.block is not self.scope:
+            return None
+        cell = AffineExpr.symbol(0)
+        if self.bounds == "wrap":
+            offset %= self.size
+            if offset != 0:
+                cell = (cell + offset) % self.size
+        elif offset != 0:
+            cell = cell + offset
+        return AffineMapAttr(AffineMap(0, 1, (cell,)))
+
+    def load(self, memory: SSAValue, index: SSAValue, offset: int) -> SSAValue:
+        """
+        Loads the cell at `offset` from `index`.
+        Has to be called inside an `ImplicitBuilder`.
+        """
+        map_ = self.affine_map(index, offset)
+        if map_ is not None:
+            return affine.LoadOp(memory, [index], map_, MEMORY_TYPE).result
+        return memref.LoadOp(
+            operands=[memory, self.cell_index(index, offset)],
+            result_types=[MEMORY_TYPE],
+        ).res
+
+    def store(self, value: SSAValue, memory: SSAValue, index: SSAValue, offset: int):
+        """
+        Stores `value` to the cell at `offset` from `index`.
+        Has to be called inside an `ImplicitBuilder`.
+        """
+        map_ = self.affine_map(index, offset)
+        if map_ is not None:
+            affine.StoreOp(value, memory, [index], map_)
+        else:
+            memref.StoreOp(operands=[value, memory, self.cell_index(index, offset)])
+
+    @staticmethod
+    def declare_bounds_error(module: ModuleOp, flush_output: bool):
+        """
+        Declares the function called when an index leaves the tape, which
+        reports the error on stderr and exits with status 1.
+        """
+        message_type = constant_global(module, BOUNDS_MESSAGE, BOUNDS_MESSAGE_TEXT)
+        body = Block()
+        with ImplicitBuilder(body):
+            if flush_output:
+                func.CallOp(FLUSH_OUTPUT, [], [])
+            zero = arith.ConstantOp(builtin.IntegerAttr(0, linked_bf.PositionType()))
+            length = arith.ConstantOp(
+                builtin.IntegerAttr(len(BOUNDS_MESSAGE_TEXT), builtin.i64)
+            )
+            message = memref.GetGlobalOp(BOUNDS_MESSAGE, message_type).memref
+            ptr = element_ptr(message, zero.result)
+            syscall(SYS_WRITE, STDERR, ptr, length.result)
+            # The exit status is passed where the file descriptor goes.
+            syscall(SYS_EXIT_GROUP, 1, ptr, length.result)
+            func.ReturnOp()
+        module.body.block.add_op(
+            func.FuncOp(BOUNDS_ERROR, ([], []), Region(body), "private")
+        )
+
+
+class IOBuffers:
+    """The buffers and their bookkeeping used by the buffered I/O modes."""
+
+    SIZE_TYPE = builtin.MemRefType(linked_bf.PositionType(), [1])
+    BUFFER_TYPE = builtin.MemRefType(MEMORY_TYPE, [IO_BUFFER_SIZE])
+    GLOBALS = {
+        "bf_output_buffer": BUFFER_TYPE,
+        "bf_output_length": SIZE_TYPE,
+        "bf_input_buffer": BUFFER_TYPE,
+        "bf_input_position": SIZE_TYPE,
+        "bf_input_length": SIZE_TYPE,
+    }
+
+    def __init__(self) -> None:
+        """Loads the buffers, has to be called inside an `ImplicitBuilder`."""
+        self.output_buffer = self.get_global("bf_output_buffer")
+        self.output_length = self.get_global("bf_output_length")
+        self.input_buffer = self.get_global("bf_input_buffer")
+        self.input_position = self.get_global("bf_input_position")
+        self.input_length = self.get_global("bf_input_length")
+
+    @classmethod
+    def get_global(cls, name: str) -> SSAValue:
+        result = memref.GetGlobalOp(name, cls.GLOBALS[name]).memref
+        result.name_hint = name.removeprefix("bf_")
+        return result
+
+    @classmethod
+    def declare(cls, module: ModuleOp):
+        for name, memref_type in cls.GLOBALS.items():
+            initial_value = (
+                builtin.UnitAttr()
+                if memref_type is cls.BUFFER_TYPE
+                else builtin.DenseIntOrFPElementsAttr.from_list(
+                    builtin.TensorType(linked_bf.PositionType(), [1]), [0]
+                )
+            )
+            module.body.block.add_op(
+                memref.GlobalOp.get(
+                    builtin.StringAttr(name), memref_type, initial_value
+                )
+            )
+        module.body.block.add_op(cls._flush_output_func())
+        module.body.block.add_op(cls._refill_input_func())
+
+    @classmethod
+    def _flush_output_func(cls) -> func.FuncOp:
+        """Writes the whole output buffer to stdout and empties it."""
+        body = Block()
+        with ImplicitBuilder(body):
+            zero = arith.ConstantOp(builtin.IntegerAttr(0, linked_bf.PositionType()))
+            output_buffer = cls.get_global("bf_output_buffer")
+            output_length = cls.get_global("bf_output_length")
+            length = memref.LoadOp(
+                operands=[output_length, zero],
+                result_types=[linked_bf.PositionType()],
+            )
+            write_all(output_buffer, length.res)
+            memref.StoreOp(operands=[zero, output_length, zero])
+            func.ReturnOp()
+        return func.FuncOp(FLUSH_OUTPUT, ([], []), Region(body), "private")
+
+    @classmethod
+    def _refill_input_func(cls) -> func.FuncOp:
+        """Reads the next block of stdin into the input buffer."""
+        body = Block()
+        with ImplicitBuilder(body):
+            zero = arith.ConstantOp(builtin.IntegerAttr(0, linked_bf.PositionType()))
+            zero_i64 = arith.ConstantOp(builtin.IntegerAttr(0, builtin.i64))
+            size = arith.ConstantOp(builtin.IntegerAttr(IO_BUFFER_SIZE, builtin.i64))
+            input_buffer = cls.get_global("bf_input_buffer")
+            input_position = cls.get_global("bf_input_position")
+            input_length = cls.get_global("bf_input_length")
+            count = syscall(
+                SYS_READ, STDIN, element_ptr(input_buffer, zero), size.result
+            )
+            # End of file and errors both leave an empty buffer.
+            success = arith.CmpiOp(count, zero_i64, "sgt")
+            length = arith.SelectOp(
+                success, arith.IndexCastOp(count, linked_bf.PositionType()), zero
+            )
+            memref.StoreOp(operands=[length, input_length, zero])
+            memref.StoreOp(operands=[zero, input_position, zero])
+            func.ReturnOp()
+        return func.FuncOp(REFILL_INPUT, ([], []), Region(body), "private")
+
 
 class MoveOpLowering(RewritePattern):
-    def __init__(self, const_one, const_index_mask) -> None:
-        self.const_one = const_one
-        self.const_size = const_index_mask
+    def __init__(self, tape: TapeIndexing) -> None:
+        self.tape = tape
 
     @op_type_rewrite_pattern
     def match_and_rewrite(
@@ -31,20 +430,20 @@ class MoveOpLowering(RewritePattern):
         rewriter: PatternRewriter,
     ):
         if isinstance(op, linked_bf.MoveLeftOp):
-            direction_op = arith.SubiOp
+            delta = -1
         elif isinstance(op, linked_bf.MoveRightOp):
-            direction_op = arith.AddiOp
+            delta = 1
         else:
             raise AssertionError("op was not of the expected type.")
         with ImplicitBuilder(Builder(InsertPoint.before(op))):
-            add_op = direction_op(op.index, self.const_one.result)
-            and_op = arith.AndIOp(add_op.result, self.const_size.result)
-        rewriter.replace_matched_op([], [and_op.result])
+            index = self.tape.cell_index(op.index, delta)
+        rewriter.replace_matched_op([], [index])
 
 
 class IncDecOpLowering(RewritePattern):
-    def __init__(self, const_one, memref: SSAValue) -> None:
+    def __init__(self, const_one, tape: TapeIndexing, memref: SSAValue) -> None:
         self.const_one = const_one
+        self.tape = tape
         self.memref = memref
 
     @op_type_rewrite_pattern
@@ -60,43 +459,324 @@ class IncDecOpLowering(RewritePattern):
                 new_op = arith.SubiOp
             case _:
                 raise AssertionError("op has wrong type")
+        offset = linked_bf.offset_value(op.offset)
+        with ImplicitBuilder(Builder(InsertPoint.before(op))):
+            value = self.tape.load(self.memref, op.index, offset)
+            change_op = new_op(value, self.const_one.result, MEMORY_TYPE)
+            self.tape.store(change_op.result, self.memref, op.index, offset)
+        rewriter.replace_matched_op([], [])
+
+
+class CountedMoveOpLowering(RewritePattern):
+    def __init__(self, tape: TapeIndexing) -> None:
+        self.tape = tape
+
+    @op_type_rewrite_pattern
+    def match_and_rewrite(self, op: linked_bf.MoveOp, rewriter: PatternRewriter):
+        with ImplicitBuilder(Builder(InsertPoint.before(op))):
+            index = self.tape.cell_index(op.index, op.delta.value.data)
+        rewriter.replace_matched_op([], [index])
+
+
+class AddOpLowering(RewritePattern):
+    def __init__(self, tape: TapeIndexing, memref: SSAValue) -> None:
+        self.tape = tape
+        self.memref = memref
+
+    @op_type_rewrite_pattern
+    def match_and_rewrite(self, op: linked_bf.AddOp, rewriter: PatternRewriter):
+        with ImplicitBuilder(Builder(InsertPoint.before(op))):
+            amount = arith.ConstantOp(
+                builtin.IntegerAttr(op.amount.value.data, MEMORY_TYPE)
+            )
+            offset = linked_bf.offset_value(op.offset)
+            value = self.tape.load(self.memref, op.index, offset)
+            change_op = arith.AddiOp(value, amount.result, MEMORY_TYPE)
+            self.tape.store(change_op.result, self.memref, op.index, offset)
+        rewriter.replace_matched_op([], [])
+
+
+class ClearOpLowering(RewritePattern):
+    def __init__(self, const_zero_ui8, tape: TapeIndexing, memref: SSAValue) -> None:
+        self.const_zero_ui8 = const_zero_ui8
+        self.tape = tape
+        self.memref = memref
+
+    @op_type_rewrite_pattern
+    def match_and_rewrite(self, op: linked_bf.ClearOp, rewriter: PatternRewriter):
         with ImplicitBuilder(Builder(InsertPoint.before(op))):
-            load_op = memref.LoadOp(
-                operands=[self.memref, op.operands[0]], result_types=[MEMORY_TYPE]
+            self.tape.store(
+                self.const_zero_ui8.result,
+                self.memref,
+                op.index,
+                linked_bf.offset_value(op.offset),
             )
-            change_op = new_op(load_op.results[0], self.const_one.result, MEMORY_TYPE)
-            memref.StoreOp(operands=[change_op.result, self.memref, op.operands[0]])
+        rewriter.replace_matched_op([], [])
+
+
+class SetOpLowering(RewritePattern):
+    def __init__(self, tape: TapeIndexing, memref: SSAValue) -> None:
+        self.tape = tape
+        self.memref = memref
+
+    @op_type_rewrite_pattern
+    def match_and_rewrite(self, op: linked_bf.SetOp, rewriter: PatternRewriter):
+        with ImplicitBuilder(Builder(InsertPoint.before(op))):
+            value = arith.ConstantOp(
+                builtin.IntegerAttr(op.value.value.data, MEMORY_TYPE)
+            )
+            self.tape.store(
+                value.result, self.memref, op.index, linked_bf.offset_value(op.offset)
+            )
+        rewriter.replace_matched_op([], [])
+
+
+class MulAddOpLowering(RewritePattern):
+    def __init__(self, tape: TapeIndexing, memref: SSAValue) -> None:
+        self.tape = tape
+        self.memref = memref
+
+    @op_type_rewrite_pattern
+    def match_and_rewrite(self, op: linked_bf.MulAddOp, rewriter: PatternRewriter):
+        with ImplicitBuilder(Builder(InsertPoint.before(op))):
+            factor = arith.ConstantOp(
+                builtin.IntegerAttr(op.factor.value.data, MEMORY_TYPE)
+            )
+            target = op.offset.value.data
+            control = self.tape.load(
+                self.memref, op.index, linked_bf.offset_value(op.source)
+            )
+            value = self.tape.load(self.memref, op.index, target)
+            product = arith.MuliOp(control, factor.result, MEMORY_TYPE)
+            sum_op = arith.AddiOp(value, product.result, MEMORY_TYPE)
+            self.tape.store(sum_op.result, self.memref, op.index, target)
         rewriter.replace_matched_op([], [])
 
 
 class LoopOpLowering(RewritePattern):
-    def __init__(self, memref: SSAValue) -> None:
+    """
+    Lowers `bf.linked.loop` to a `scf.while` checking the cell before every
+    iteration. A loop known to be `entered` checks after every iteration
+    instead, with the body in the before region.
+    """
+
+    def __init__(self, tape: TapeIndexing, memref: SSAValue) -> None:
+        self.tape = tape
         self.memref = memref
 
+    def condition(self, index: SSAValue):
+        """Has to be called inside an `ImplicitBuilder`."""
+        val = self.tape.load(self.memref, index, 0)
+        zero = arith.ConstantOp(builtin.IntegerAttr(0, MEMORY_TYPE))
+        cmp = arith.CmpiOp(val, zero, "ugt")
+        scf.ConditionOp(cmp.result, index)
+
     @op_type_rewrite_pattern
     def match_and_rewrite(
         self,
         op: linked_bf.LoopOp,
         rewriter: PatternRewriter,
     ):
-        while_op = scf.WhileOp(
-            [op.index],
-            [linked_bf.PositionType()],
-            Region(Block([], arg_types=[linked_bf.PositionType()])),
-            Region(op.body.detach_block(0)),
-        )
-        with ImplicitBuilder(while_op.before_region.block) as (index_arg,):
-            val = memref.LoadOp(
-                operands=[self.memref, index_arg],
-                result_types=[MEMORY_TYPE],
+        if op.entered is None:
+            while_op = scf.WhileOp(
+                [op.index],
+                [linked_bf.PositionType()],
+                Region(Block([], arg_types=[linked_bf.PositionType()])),
+                Region(op.body.detach_block(0)),
             )
-            zero = arith.ConstantOp(builtin.IntegerAttr(0, MEMORY_TYPE))
-            cmp = arith.CmpiOp(val, zero, "ugt")
-            scf.ConditionOp(cmp.result, index_arg)
+            with ImplicitBuilder(while_op.before_region.block) as (index_arg,):
+                self.condition(index_arg)
+        else:
+            body = op.body.detach_block(0)
+            loop_end = body.last_op
+            assert isinstance(loop_end, linked_bf.LoopEndOp)
+            with ImplicitBuilder(Builder(InsertPoint.before(loop_end))):
+                self.condition(loop_end.index)
+            rewriter.erase_op(loop_end)
+            while_op = scf.WhileOp(
+                [op.index],
+                [linked_bf.PositionType()],
+                Region(body),
+                Region(Block([], arg_types=[linked_bf.PositionType()])),
+            )
+            with ImplicitBuilder(while_op.after_region.block) as (index_arg,):
+                scf.YieldOp(index_arg)
 
         rewriter.replace_matched_op(while_op)
 
 
+def lower_balanced_loops(function: func.FuncOp, tape: TapeIndexing, memory: SSAValue):
+    """
+    Lowers the loops at the top level of `function` that are balanced with
+    all loops nested in them (see `loop_positions`) to `scf.while` loops
+    without iteration arguments. Their operations address the cells at
+    constant offsets from the index the outermost loop is entered with,
+    which is defined in `function`, so `tape` loads and stores them with the
+    affine dialect and MLIR can keep the cells in registers across
+    iterations.
+    """
+    for root in list(function.body.block.ops):
+        if not isinstance(root, linked_bf.LoopOp):
+            continue
+        positions = loop_positions(root)
+        if positions is None:
+            continue
+        base = root.index
+        loops: list[linked_bf.LoopOp] = []
+        moves: list[Operation] = []
+        pending = [root]
+        while pending:
+            loop = pending.pop()
+            loops.append(loop)
+            for op in loop.body.block.ops:
+                if move_delta(op) is not None:
+                    moves.append(op)
+                elif isinstance(op, MEMORY_OPS):
+                    shift_offsets(op, positions[op.operands[0]])
+                    op.operands[0] = base
+                elif isinstance(op, linked_bf.LoopOp):
+                    pending.append(op)
+
+        # Outer loops first, as the nested ones are moved along with them.
+        for loop in loops:
+            position = positions[loop.index]
+            loop.new_index.replace_by(loop.index)
+            body = loop.body.detach_block(0)
+            body.args[0].replace_by(loop.index)
+            body.erase_arg(body.args[0])
+            loop_end = body.last_op
+            assert isinstance(loop_end, linked_bf.LoopEndOp)
+            Rewriter.erase_op(loop_end)
+            # Loops known to be entered check after every iteration.
+            before, after = (Block(), body) if loop.entered is None else (body, Block())
+            with ImplicitBuilder(after):
+                scf.YieldOp()
+            with ImplicitBuilder(before):
+                value = tape.load(memory, base, position)
+                zero = arith.ConstantOp(builtin.IntegerAttr(0, MEMORY_TYPE))
+                scf.ConditionOp(arith.CmpiOp(value, zero, "ugt"))
+            Rewriter.insert_op(
+                scf.WhileOp([], [], Region(before), Region(after)),
+                InsertPoint.before(loop),
+            )
+            Rewriter.erase_op(loop)
+        # The moves are only used by each other now.
+        for move in reversed(moves):
+            Rewriter.erase_op(move)
+
+
+class ScanOpLowering(RewritePattern):
+    """
+    Lowers `bf.linked.scan` to a loop stepping the index by the stride until
+    it reaches a zero cell. Unit strides first jump close to the zero cell
+    with `memchr`/`memrchr`, which search many bytes at a time. As the tape
+    wraps around, a search that runs off one end continues at the other. If
+    there is no zero cell, the loop runs forever just like the original.
+    """
+
+    def __init__(self, tape: TapeIndexing, memref: SSAValue) -> None:
+        self.tape = tape
+        self.memref = memref
+        self.used_functions: set[str] = set()
+
+    def search(self, callee: str, start: SSAValue, length: SSAValue) -> SSAValue:
+        """
+        Returns the position of the zero byte `callee` finds in the `length`
+        bytes at `start`, or a negative value if there is none.
+        Has to be called inside an `ImplicitBuilder`.
+        """
+        self.used_functions.add(callee)
+        zero_i32 = arith.ConstantOp(builtin.IntegerAttr(0, builtin.i32))
+        found = func.CallOp(
+            callee,
+            [element_ptr(self.memref, start), zero_i32, length],
+            [llvm.LLVMPointerType()],
+        )
+        base = arith.ConstantOp(builtin.IntegerAttr(0, linked_bf.PositionType()))
+        base_ptr = llvm.PtrToIntOp(element_ptr(self.memref, base.result))
+        found_ptr = llvm.PtrToIntOp(found.results[0])
+        null = arith.ConstantOp(builtin.IntegerAttr(0, builtin.i64))
+        minus_one = arith.ConstantOp(builtin.IntegerAttr(-1, builtin.i64))
+        position = arith.SubiOp(found_ptr, base_ptr)
+        return arith.SelectOp(
+            arith.CmpiOp(found_ptr, null, "ne"), position, minus_one
+        ).result
+
+    def jump(self, index: SSAValue, stride: int) -> SSAValue:
+        """
+        Returns the first zero cell in the direction of `stride` from `index`,
+        or `index` if there is none.
+        Has to be called inside an `ImplicitBuilder`.
+        """
+        index_i64 = arith.IndexCastOp(index, builtin.i64)
+        zero = arith.ConstantOp(builtin.IntegerAttr(0, builtin.i64))
+        one = arith.ConstantOp(builtin.IntegerAttr(1, builtin.i64))
+        size = arith.ConstantOp(builtin.IntegerAttr(self.tape.size, builtin.i64))
+        # The part of the tape in the direction of the scan, then the rest.
+        if stride > 0:
+            callee = MEMCHR
+            first = (index_i64.result, arith.SubiOp(size, index_i64).result)
+            second = (zero.result, index_i64.result)
+        else:
+            callee = MEMRCHR
+            after = arith.AddiOp(index_i64, one)
+            first = (zero.result, after.result)
+            second = (after.result, arith.SubiOp(size, after).result)
+
+        def search(start: SSAValue, length: SSAValue) -> SSAValue:
+            return self.search(
+                callee,
+                arith.IndexCastOp(start, linked_bf.PositionType()).result,
+                length,
+            )
+
+        position = search(*first)
+        if self.tape.bounds != "wrap":
+            # Without a zero cell ahead the loop leaves the tape.
+            return arith.IndexCastOp(
+                arith.SelectOp(
+                    arith.CmpiOp(position, zero, "slt"), index_i64, position
+                ),
+                linked_bf.PositionType(),
+            ).result
+        if_op = scf.IfOp(
+            arith.CmpiOp(position, zero, "slt"),
+            [builtin.i64],
+            Region(Block()),
+            Region(Block()),
+        )
+        with ImplicitBuilder(if_op.true_region.block):
+            wrapped = search(*second)
+            scf.YieldOp(
+                arith.SelectOp(arith.CmpiOp(wrapped, zero, "slt"), index_i64, wrapped)
+            )
+        with ImplicitBuilder(if_op.false_region.block):
+            scf.YieldOp(position)
+        return arith.IndexCastOp(if_op.results[0], linked_bf.PositionType()).result
+
+    @op_type_rewrite_pattern
+    def match_and_rewrite(self, op: linked_bf.ScanOp, rewriter: PatternRewriter):
+        stride = op.stride.value.data
+        with ImplicitBuilder(Builder(InsertPoint.before(op))):
+            start = self.jump(op.index, stride) if stride in (-1, 1) else op.index
+            while_op = scf.WhileOp(
+                [start],
+                [linked_bf.PositionType()],
+                Region(Block([], arg_types=[linked_bf.PositionType()])),
+                Region(Block([], arg_types=[linked_bf.PositionType()])),
+            )
+            with ImplicitBuilder(while_op.before_region.block) as (index,):
+                value = memref.LoadOp(
+                    operands=[self.memref, index], result_types=[MEMORY_TYPE]
+                )
+                zero = arith.ConstantOp(builtin.IntegerAttr(0, MEMORY_TYPE))
+                nonzero = arith.CmpiOp(value, zero, "ne")
+                scf.ConditionOp(nonzero.result, index)
+            with ImplicitBuilder(while_op.after_region.block) as (index,):
+                scf.YieldOp(self.tape.cell_index(index, stride))
+        rewriter.replace_matched_op([], [while_op.results[0]])
+
+
 class LoopEndOpLowering(RewritePattern):
     @op_type_rewrite_pattern
     def match_and_rewrite(
@@ -108,7 +788,8 @@ class LoopEndOpLowering(RewritePattern):
 
 
 class OutputInputOpLowering(RewritePattern):
-    def __init__(self, memref: SSAValue) -> None:
+    def __init__(self, tape: TapeIndexing, memref: SSAValue) -> None:
+        self.tape = tape
         self.memref = memref
 
     @op_type_rewrite_pattern
@@ -120,53 +801,131 @@ class OutputInputOpLowering(RewritePattern):
         ):
             raise AssertionError("Invalid op")
 
-        memref_llvm_struct = llvm.LLVMStructType(
-            builtin.StringAttr(""),
-            builtin.ArrayAttr(
-                [
-                    llvm.LLVMPointerType(),
-                    llvm.LLVMPointerType(),
-                    builtin.i64,
-                    llvm.LLVMArrayType(builtin.IntAttr(1), builtin.i64),
-                    llvm.LLVMArrayType(builtin.IntAttr(1), builtin.i64),
-                ]
-            ),
-        )
+        with ImplicitBuilder(Builder(InsertPoint.before(op))):
+            one = arith.ConstantOp(builtin.IntegerAttr(1, builtin.i64))
+            index = self.tape.cell_index(op.index, linked_bf.offset_value(op.offset))
+            ptr = element_ptr(self.memref, index)
+            if isinstance(op, linked_bf.OutputOp):
+                syscall(SYS_WRITE, STDOUT, ptr, one.result)
+            else:
+                syscall(SYS_READ, STDIN, ptr, one.result)
+        rewriter.replace_matched_op([], [])
+
 
+class BufferedOutputOpLowering(RewritePattern):
+    def __init__(
+        self, tape: TapeIndexing, memref: SSAValue, buffers: IOBuffers, line: bool
+    ) -> None:
+        self.tape = tape
+        self.memref = memref
+        self.buffers = buffers
+        self.line = line
+
+    @op_type_rewrite_pattern
+    def match_and_rewrite(self, op: linked_bf.OutputOp, rewriter: PatternRewriter):
         with ImplicitBuilder(Builder(InsertPoint.before(op))):
-            zero = arith.ConstantOp(builtin.IntegerAttr(0, builtin.IntegerType(64)))
-            one = arith.ConstantOp(builtin.IntegerAttr(1, builtin.IntegerType(64)))
-            cast_memref_op = builtin.UnrealizedConversionCastOp(
-                operands=[self.memref], result_types=[memref_llvm_struct]
-            )
-            cast_index_op = builtin.UnrealizedConversionCastOp(
-                operands=[op.index], result_types=[builtin.i64]
-            )
-            val_op = llvm.ExtractValueOp(
-                builtin.DenseArrayBase.from_list(builtin.i64, [1]),
-                cast_memref_op.results[0],
-                result_type=llvm.LLVMPointerType(),
-            )
-            elementptr_op = llvm.GEPOp(
-                val_op.results[0],
-                [llvm.GEP_USE_SSA_VAL],
-                MEMORY_TYPE,
-                ssa_indices=[cast_index_op.results[0]],
-            )
-            llvm.InlineAsmOp(
-                "syscall",
-                "={rax},{rax},{rdi},{rsi},{rdx},~{rcx},~{r11}",
-                (
-                    [one, one, elementptr_op.results[0], one]
-                    if isinstance(op, linked_bf.OutputOp)
-                    else [zero, zero, elementptr_op.results[0], one]
-                ),
-                has_side_effects=True,
-                res_types=[builtin.i64],
+            zero = arith.ConstantOp(builtin.IntegerAttr(0, linked_bf.PositionType()))
+            one = arith.ConstantOp(builtin.IntegerAttr(1, linked_bf.PositionType()))
+            size = arith.ConstantOp(
+                builtin.IntegerAttr(IO_BUFFER_SIZE, linked_bf.PositionType())
+            )
+            value = self.tape.load(
+                self.memref, op.index, linked_bf.offset_value(op.offset)
+            )
+            length = memref.LoadOp(
+                operands=[self.buffers.output_length, zero],
+                result_types=[linked_bf.PositionType()],
+            )
+            memref.StoreOp(operands=[value, self.buffers.output_buffer, length])
+            new_length = arith.AddiOp(length, one)
+            memref.StoreOp(operands=[new_length, self.buffers.output_length, zero])
+            flush = arith.CmpiOp(new_length, size, "eq").result
+            if self.line:
+                newline = arith.ConstantOp(builtin.IntegerAttr(ord("\n"), MEMORY_TYPE))
+                flush = arith.OrIOp(flush, arith.CmpiOp(value, newline, "eq")).result
+            call_if(flush, FLUSH_OUTPUT)
+        rewriter.replace_matched_op([], [])
+
+
+class WriteOpLowering(RewritePattern):
+    """
+    Lowers `bf.linked.write` to writes of its bytes from a constant global,
+    after flushing the buffered output.
+    """
+
+    def __init__(self, module: ModuleOp, buffered: bool) -> None:
+        self.module = module
+        self.buffered = buffered
+        self.count = 0
+
+    @op_type_rewrite_pattern
+    def match_and_rewrite(self, op: linked_bf.WriteOp, rewriter: PatternRewriter):
+        name = f"{OUTPUT_DATA}_{self.count}" if self.count else OUTPUT_DATA
+        self.count += 1
+        data = linked_bf.data_bytes(op.data)
+        data_type = constant_global(self.module, name, data)
+        with ImplicitBuilder(Builder(InsertPoint.before(op))):
+            if self.buffered:
+                func.CallOp(FLUSH_OUTPUT, [], [])
+            length = arith.ConstantOp(
+                builtin.IntegerAttr(len(data), linked_bf.PositionType())
             )
+            write_all(memref.GetGlobalOp(name, data_type).memref, length.result)
         rewriter.replace_matched_op([], [])
 
 
+class BufferedInputOpLowering(RewritePattern):
+    def __init__(
+        self, tape: TapeIndexing, memref: SSAValue, buffers: IOBuffers
+    ) -> None:
+        self.tape = tape
+        self.memref = memref
+        self.buffers = buffers
+
+    @op_type_rewrite_pattern
+    def match_and_rewrite(self, op: linked_bf.InputOp, rewriter: PatternRewriter):
+        buffers = self.buffers
+        with ImplicitBuilder(Builder(InsertPoint.before(op))):
+            # Pending output (e.g. a prompt) has to be visible before blocking.
+            func.CallOp(FLUSH_OUTPUT, [], [])
+            zero = arith.ConstantOp(builtin.IntegerAttr(0, linked_bf.PositionType()))
+            one = arith.ConstantOp(builtin.IntegerAttr(1, linked_bf.PositionType()))
+            position = memref.LoadOp(
+                operands=[buffers.input_position, zero],
+                result_types=[linked_bf.PositionType()],
+            )
+            length = memref.LoadOp(
+                operands=[buffers.input_length, zero],
+                result_types=[linked_bf.PositionType()],
+            )
+            empty = arith.CmpiOp(position, length, "uge")
+            call_if(empty.result, REFILL_INPUT)
+            position = memref.LoadOp(
+                operands=[buffers.input_position, zero],
+                result_types=[linked_bf.PositionType()],
+            )
+            length = memref.LoadOp(
+                operands=[buffers.input_length, zero],
+                result_types=[linked_bf.PositionType()],
+            )
+            # On end of file the cell is left unchanged.
+            available = arith.CmpiOp(position, length, "ult")
+            if_op = scf.IfOp(available, [], Region(Block()))
+            with ImplicitBuilder(if_op.true_region.block):
+                value = memref.LoadOp(
+                    operands=[buffers.input_buffer, position],
+                    result_types=[MEMORY_TYPE],
+                )
+                self.tape.store(
+                    value.res, self.memref, op.index, linked_bf.offset_value(op.offset)
+                )
+                next_position = arith.AddiOp(position, one)
+                memref.StoreOp(operands=[next_position, buffers.input_position, zero])
+                scf.YieldOp()
+        rewriter.replace_matched_op([], [])
+
+
+@dataclass(frozen=True)
 class LowerLinkedToBuiltinBfPass(ModulePass):
     """
     A pass for lowering operations in the Toy dialect to built-in dialects.
@@ -174,59 +933,229 @@ class LowerLinkedToBuiltinBfPass(ModulePass):
 
     name = "lower-linked-to-builtin"
 
+    tape: TapeAllocation = "heap"
+    """
+    Where the tape lives: a zero-initialized module-level global (`global`,
+    placed in `.bss` and paged in lazily), a `memref.alloca` on the stack of
+    `main` (`stack`) or a `memref.alloc` freed on return (`heap`). The
+    latter two are zeroed with `llvm.memset`. A `bf.linked.tape_image`
+    becomes the initializer of the global, or is copied onto the tape with
+    `llvm.memcpy`. Functions outlined from `main` take the latter two as an
+    argument after the index.
+    """
+
+    io_mode: IOMode = "unbuffered"
+    """
+    How `.` and `,` are performed: one syscall per byte (`unbuffered`), or
+    through buffers flushed when full, before input and on return (`full`),
+    additionally on every newline (`line`).
+    """
+
+    tape_size: int = MEMORY_SIZE
+    """The number of cells of the tape."""
+
+    bounds: BoundsMode = "wrap"
+    """
+    What happens when the pointer leaves the tape: it wraps around to the
+    other end (`wrap`), the program is aborted with an error (`check`) or
+    the behavior is undefined (`unchecked`). If the range of cells the
+    program can reach is proven to fit, indices are neither wrapped nor
+    checked and the tape is shrunk to just that range.
+    """
+
+    affine: bool = True
+    """
+    Whether cells at an offset from an index defined in a function,
+    including all cells in balanced loops, are accessed with the affine
+    dialect.
+    Unused if indices are checked.
+    """
+
     def apply(self, ctx: Context, op: ModuleOp) -> None:
         assert isinstance(op.body.block.first_op, func.FuncOp)
+        main_func = op.body.block.first_op
+        # The functions outlined from `main` follow it.
+        outlined = [
+            function
+            for function in op.body.block.ops
+            if isinstance(function, func.FuncOp) and function is not main_func
+        ]
 
-        with ImplicitBuilder(
-            Builder(InsertPoint.at_start(op.body.block.first_op.body.block))
-        ):
-            const_zero = arith.ConstantOp(
-                builtin.IntegerAttr(0, linked_bf.PositionType())
+        image = b""
+        image_op = main_func.body.block.first_op
+        if isinstance(image_op, linked_bf.TapeImageOp):
+            image = linked_bf.data_bytes(image_op.cells)
+            Rewriter.erase_op(image_op)
+
+        tape_size, bounds = self.tape_size, self.bounds
+        reached = pointer_range(main_func)
+        if reached is not None:
+            low, high = reached
+            if (
+                high - low < tape_size
+                if bounds == "wrap"
+                else 0 <= low and high < tape_size
+            ):
+                # The lowest cell reached becomes the first one.
+                image = image.ljust(tape_size, b"\0")
+                image = bytes(
+                    image[cell % tape_size] for cell in range(low, high + 1)
+                ).rstrip(b"\0")
+                tape_size, bounds = high - low + 1, "unchecked"
+                start = main_func.body.block.first_op
+                assert isinstance(start, arith.ConstantOp)
+                Rewriter.replace_op(
+                    start,
+                    arith.ConstantOp(
+                        builtin.IntegerAttr(
+                            start.value.value.data - low, linked_bf.PositionType()
+                        )
+                    ),
+                )
+
+        image_type = None
+        if image and self.tape != "global":
+            image_type = constant_global(op, TAPE_IMAGE, image)
+        tape_type = builtin.MemRefType(MEMORY_TYPE, [tape_size])
+        with ImplicitBuilder(Builder(InsertPoint.at_start(main_func.body.block))):
+            match self.tape:
+                case "global":
+                    memref_op = memref.GetGlobalOp(TAPE, tape_type)
+                case "stack":
+                    memref_op = memref.AllocaOp.get(MEMORY_TYPE, shape=[tape_size])
+                case "heap":
+                    memref_op = memref.AllocOp([], [], tape_type)
+            if self.tape != "global":
+                memset_zero(memref_op.results[0], tape_size)
+                if image_type is not None:
+                    copy_image(
+                        memref_op.results[0],
+                        memref.GetGlobalOp(TAPE_IMAGE, image_type).memref,
+                        len(image),
+                    )
+        memory = {main_func: memref_op.results[0]}
+
+        # Functions outlined from `main` get the tape passed along with the
+        # index, unless it is a global.
+        for function in outlined:
+            if self.tape == "global":
+                with ImplicitBuilder(
+                    Builder(InsertPoint.at_start(function.body.block))
+                ):
+                    memory[function] = memref.GetGlobalOp(TAPE, tape_type).memref
+            else:
+                memory[function] = function.body.block.insert_arg(tape_type, 1)
+                function.update_function_type()
+        if self.tape != "global":
+            names = {function.sym_name.data for function in outlined}
+            for function, memory_value in memory.items():
+                pending = list(function.body.block.ops)
+                while pending:
+                    nested = pending.pop()
+                    if (
+                        isinstance(nested, func.CallOp)
+                        and nested.callee.root_reference.data in names
+                    ):
+                        nested.operands = [*nested.operands, memory_value]
+                    for region in nested.regions:
+                        for block in region.blocks:
+                            pending.extend(block.ops)
+        for memory_value in memory.values():
+            memory_value.name_hint = "memory"
+
+        if self.tape == "global":
+            op.body.block.add_op(
+                memref.GlobalOp.get(
+                    builtin.StringAttr(TAPE),
+                    tape_type,
+                    builtin.DenseIntOrFPElementsAttr.from_list(
+                        builtin.TensorType(MEMORY_TYPE, [tape_size]),
+                        list(image.ljust(tape_size, b"\0")) if image else [0],
+                    ),
+                )
             )
-            const_one = arith.ConstantOp(
-                builtin.IntegerAttr(1, linked_bf.PositionType())
+        return_op = main_func.body.block.last_op
+        assert isinstance(return_op, func.ReturnOp)
+        if self.tape == "heap":
+            Rewriter.insert_op(
+                memref.DeallocOp.get(memref_op.results[0]),
+                InsertPoint.before(return_op),
             )
-            const_zero_ui8 = arith.ConstantOp(builtin.IntegerAttr(0, MEMORY_TYPE))
-            const_one_ui8 = arith.ConstantOp(builtin.IntegerAttr(1, MEMORY_TYPE))
-            const_index_mask = arith.ConstantOp(
-                builtin.IntegerAttr(MEMORY_SIZE - 1, linked_bf.PositionType())
-            )
-            const_size = arith.ConstantOp(
-                builtin.IntegerAttr(MEMORY_SIZE, linked_bf.PositionType())
-            )
-            memref_op = memref.AllocOp(
-                [], [], builtin.MemRefType(MEMORY_TYPE, [MEMORY_SIZE])
-            )
-            init_zero_for = scf.ForOp(
-                const_zero.result,
-                const_size.result,
-                const_one.result,
-                [],
-                [Block([], arg_types=[linked_bf.PositionType()])],
-            )
-            with ImplicitBuilder(init_zero_block := init_zero_for.body.block):
-                memref.StoreOp(
-                    operands=[
-                        const_zero_ui8.result,
-                        memref_op.results[0],
-                        init_zero_block.args[0],
-                    ]
+
+        if self.io_mode != "unbuffered":
+            IOBuffers.declare(op)
+            Rewriter.insert_op(
+                func.CallOp(FLUSH_OUTPUT, [], []), InsertPoint.before(return_op)
+            )
+        if bounds == "check":
+            TapeIndexing.declare_bounds_error(op, self.io_mode != "unbuffered")
+
+        write_lowering = WriteOpLowering(op, buffered=self.io_mode != "unbuffered")
+        used_functions: set[str] = set()
+        for function, memory_value in memory.items():
+            used_functions |= self.lower_function(
+                function, memory_value, tape_size, bounds, write_lowering
+            )
+        for callee in sorted(used_functions):
+            op.body.block.add_op(
+                func.FuncOp.external(
+                    callee,
+                    [llvm.LLVMPointerType(), builtin.i32, builtin.i64],
+                    [llvm.LLVMPointerType()],
                 )
-                scf.YieldOp()
+            )
 
-        const_one.result.name_hint = "const_one"
+    def lower_function(
+        self,
+        function: func.FuncOp,
+        memory: SSAValue,
+        tape_size: int,
+        bounds: BoundsMode,
+        write_lowering: WriteOpLowering,
+    ) -> set[str]:
+        """
+        Lowers the linked dialect in `function`, which addresses the tape
+        `memory`. Returns the names of the external functions scans call.
+        """
+        with ImplicitBuilder(Builder(InsertPoint.at_start(function.body.block))):
+            const_zero_ui8 = arith.ConstantOp(builtin.IntegerAttr(0, MEMORY_TYPE))
+            const_one_ui8 = arith.ConstantOp(builtin.IntegerAttr(1, MEMORY_TYPE))
+            tape_indexing = TapeIndexing(
+                tape_size, bounds, function.body.block if self.affine else None
+            )
+            if self.io_mode != "unbuffered":
+                buffers = IOBuffers()
         const_one_ui8.result.name_hint = "const_one_ui8"
-        const_index_mask.result.name_hint = "index_mask"
-        const_size.result.name_hint = "const_size"
-        memref_op.results[0].name_hint = "memory"
+
+        if self.io_mode == "unbuffered":
+            io_patterns = [OutputInputOpLowering(tape_indexing, memory)]
+        else:
+            io_patterns = [
+                BufferedOutputOpLowering(
+                    tape_indexing, memory, buffers, line=self.io_mode == "line"
+                ),
+                BufferedInputOpLowering(tape_indexing, memory, buffers),
+            ]
+
+        if self.affine and bounds != "check":
+            lower_balanced_loops(function, tape_indexing, memory)
+        scan_lowering = ScanOpLowering(tape_indexing, memory)
         PatternRewriteWalker(
             GreedyRewritePatternApplier(
                 [
-                    MoveOpLowering(const_one, const_index_mask),
-                    IncDecOpLowering(const_one_ui8, memref_op.results[0]),
-                    LoopOpLowering(memref_op.results[0]),
+                    MoveOpLowering(tape_indexing),
+                    IncDecOpLowering(const_one_ui8, tape_indexing, memory),
+                    CountedMoveOpLowering(tape_indexing),
+                    AddOpLowering(tape_indexing, memory),
+                    ClearOpLowering(const_zero_ui8, tape_indexing, memory),
+                    SetOpLowering(tape_indexing, memory),
+                    MulAddOpLowering(tape_indexing, memory),
+                    scan_lowering,
+                    LoopOpLowering(tape_indexing, memory),
                     LoopEndOpLowering(),
-                    OutputInputOpLowering(memref_op.results[0]),
+                    write_lowering,
+                    *io_patterns,
                 ]
             ),
-        ).rewrite_module(op)
+        ).rewrite_region(function.body)
+        return scan_lowering.used_functions
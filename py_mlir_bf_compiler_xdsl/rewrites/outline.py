@@ -0,0 +1,234 @@
+from dataclasses import dataclass
+
+from xdsl.context import Context
+from xdsl.dialects import arith, func
+from xdsl.dialects.builtin import ModuleOp
+from xdsl.ir import Block, BlockArgument, Operation, OpResult, Region, SSAValue
+from xdsl.passes import ModulePass
+from xdsl.rewriter import InsertPoint, Rewriter
+
+from ..dialects import linked_brainfuck as linked_bf
+
+DEFAULT_OUTLINE_SIZE = 2000
+OUTLINED = "bf_outlined"
+
+
+def nested_ops(ops: list[Operation]) -> list[Operation]:
+    """Returns `ops` and all operations nested in them, parents first."""
+    order: list[Operation] = []
+    pending = list(reversed(ops))
+    while pending:
+        op = pending.pop()
+        order.append(op)
+        for region in reversed(op.regions):
+            for block in reversed(region.blocks):
+                pending.extend(reversed(block.ops))
+    return order
+
+
+def op_sizes(block: Block) -> dict[Operation, int]:
+    """Counts every operation in `block` with all operations nested in it."""
+    sizes: dict[Operation, int] = {}
+    for op in reversed(nested_ops(list(block.ops))):
+        sizes[op] = 1 + sum(
+            sizes[inner]
+            for region in op.regions
+            for inner_block in region.blocks
+            for inner in inner_block.ops
+        )
+    return sizes
+
+
+def last_index(ops: list[Operation]) -> SSAValue | None:
+    """Returns the last index value `ops` define, if any."""
+    for op in reversed(ops):
+        for result in reversed(op.results):
+            if isinstance(result.type, linked_bf.PositionType):
+                return result
+    return None
+
+
+def outlinable(op: Operation) -> bool:
+    # The start index, the initial tape and the terminators stay in place.
+    return not isinstance(
+        op,
+        arith.ConstantOp | linked_bf.TapeImageOp | linked_bf.LoopEndOp | func.ReturnOp,
+    )
+
+
+def outline(
+    module: ModuleOp,
+    ops: list[Operation],
+    entry: SSAValue,
+    name: str,
+    inside: set[Operation] | None = None,
+) -> func.CallOp | None:
+    """
+    Moves `ops` into a function `name` taking the index they start at and
+    returning the one they end at, unless they use other index values from
+    outside or define ones used later. Returns the call replacing them.
+    `inside` are `ops` and all operations nested in them, if known already.
+    """
+    if inside is None:
+        inside = set(nested_ops(ops))
+    for op in inside:
+        for operand in op.operands:
+            if operand is entry:
+                continue
+            if isinstance(operand, OpResult) and operand.op in inside:
+                continue
+            if (
+                isinstance(operand, BlockArgument)
+                and operand.block.parent_op() in inside
+            ):
+                continue
+            return None
+    exit = last_index(ops)
+    if exit is None:
+        exit = entry
+    for op in ops:
+        for result in op.results:
+            if result is not exit and any(
+                use.operation not in inside for use in result.uses
+            ):
+                return None
+
+    call = func.CallOp(name, [entry], [linked_bf.PositionType()])
+    Rewriter.insert_op(call, InsertPoint.before(ops[0]))
+    if exit is not entry:
+        exit.replace_by_if(call.res[0], lambda use: use.operation not in inside)
+    body = Block(arg_types=[linked_bf.PositionType()])
+    for op in ops:
+        op.detach()
+        body.add_op(op)
+    entry.replace_by_if(body.args[0], lambda use: use.operation in inside)
+    body.add_op(func.ReturnOp(body.args[0] if exit is entry else exit))
+    module.body.block.add_op(
+        func.FuncOp(
+            name,
+            ([linked_bf.PositionType()], [linked_bf.PositionType()]),
+            Region(body),
+            "private",
+        )
+    )
+    return call
+
+
+class Outliner:
+    """
+    Splits blocks of more than `max_size` operations into segments of at
+    most that many, and moves segments into functions called in their place
+    once the function they are in holds `max_size` operations. A loop that
+    is larger on its own stays in place and its body is split in turn,
+    unless the function is full, in which case the loop is moved into a
+    new function first. Functions thus hold whole levels of deep nests, and
+    every operation is visited once.
+    """
+
+    def __init__(self, module: ModuleOp, max_size: int) -> None:
+        self.module = module
+        self.max_size = max_size
+        self.count = 0
+
+    def segments(
+        self, block: Block, sizes: dict[Operation, int]
+    ) -> list[tuple[list[Operation], SSAValue]]:
+        """
+        Partitions the operations of `block` into segments, each with the
+        index it starts at.
+        """
+        segments: list[tuple[list[Operation], SSAValue]] = []
+        index = block.args[0] if block.args else None
+        segment: list[Operation] = []
+        size = 0
+        start = index
+        for op in block.ops:
+            if not outlinable(op) or size + sizes[op] > self.max_size:
+                if segment and start is not None:
+                    segments.append((segment, start))
+                segment, size = [], 0
+            if outlinable(op):
+                if not segment:
+                    start = index
+                segment.append(op)
+                size += sizes[op]
+            for result in op.results:
+                if isinstance(result.type, linked_bf.PositionType):
+                    index = result
+        if segment and start is not None:
+            segments.append((segment, start))
+        return segments
+
+    def run(self, main: func.FuncOp):
+        # The operations nested in a segment directly follow it in this
+        # order, so that those of every segment are a slice of it.
+        order = nested_ops(list(main.body.block.ops))
+        positions = {op: position for position, op in enumerate(order)}
+        sizes = op_sizes(main.body.block)
+        # Every block comes with the number of operations the function it is
+        # in still has room for, shared by all blocks of that function.
+        pending = [(main.body.block, [self.max_size])]
+        while pending:
+            block, room = pending.pop()
+            size = sum(sizes.get(op, 1) for op in block.ops)
+            if size <= room[0]:
+                room[0] -= size
+                continue
+            # The start index and terminators stay in the function.
+            room[0] -= sum(1 for op in block.ops if not outlinable(op))
+            # The index a segment ends at is replaced by the result of its
+            # call, the next segment starts at that.
+            renamed: dict[SSAValue, SSAValue] = {}
+            for ops, start in self.segments(block, sizes):
+                size = sum(sizes[op] for op in ops)
+                loop = ops[0]
+                large = isinstance(loop, linked_bf.LoopOp) and size > self.max_size
+                if large and room[0] > 0:
+                    # The loop stays where it is and only its body is split.
+                    room[0] -= 1
+                    pending.append((loop.body.block, room))
+                    continue
+                if not large and size <= room[0]:
+                    room[0] -= size
+                    continue
+                end = last_index(ops)
+                name = f"{OUTLINED}_{self.count}"
+                inside = set(
+                    order[positions[ops[0]] : positions[ops[-1]] + sizes[ops[-1]]]
+                )
+                call = outline(
+                    self.module, ops, renamed.get(start, start), name, inside
+                )
+                if call is None:
+                    continue
+                self.count += 1
+                if end is not None:
+                    renamed[end] = call.res[0]
+                if large:
+                    # A loop is only outlined once the function around it is
+                    # full, its body is split in the new function.
+                    assert isinstance(loop, linked_bf.LoopOp)
+                    pending.append((loop.body.block, [self.max_size - 1]))
+
+
+@dataclass(frozen=True)
+class OutlinePass(ModulePass):
+    """
+    A pass splitting `main` into functions of at most `max_size` operations
+    of the linked dialect, so that none is too large for LLVM to compile
+    quickly. Runs of top-level operations are outlined into functions
+    taking the index they start at and returning the one they end at; the
+    tape stays implicit. Loops larger than that stay in place and their
+    bodies are split the same way, so that deep nests of loops are split
+    into functions holding many levels each.
+    """
+
+    name = "outline-segments"
+
+    max_size: int = DEFAULT_OUTLINE_SIZE
+    """The number of operations above which a block is split."""
+
+    def apply(self, ctx: Context, op: ModuleOp) -> None:
+        main = op.body.block.first_op
+        assert isinstance(main, func.FuncOp)
+        Outliner(op, self.max_size).run(main)
@@ -0,0 +1,127 @@
+from dataclasses import dataclass
+
+from xdsl.context import Context
+from xdsl.dialects import arith, builtin, func
+from xdsl.dialects.builtin import ModuleOp
+from xdsl.ir import Operation
+from xdsl.passes import ModulePass
+from xdsl.rewriter import InsertPoint, Rewriter
+
+from py_mlir_bf_compiler_common.evaluate import Instruction, Machine, Step
+
+from ..dialects import linked_brainfuck as linked_bf
+from .lower_linked_to_builtin import MEMORY_SIZE, BoundsMode
+from .sink_moves import move_delta
+
+DEFAULT_BUDGET = 1_000_000
+
+
+def to_instruction(op: Operation) -> Instruction | None:
+    """
+    Converts a top-level operation of `main` with the operations nested in
+    it, or returns `None` if it can not be evaluated at compile time, e.g.
+    because it reads input.
+    """
+    top: list[Instruction] = []
+    pending: list[tuple[Operation, list[Instruction]]] = [(op, top)]
+    while pending:
+        op, into = pending.pop()
+        delta = move_delta(op)
+        if delta is not None:
+            into.append((Step.MOVE, delta))
+            continue
+        offset = linked_bf.offset_value(op.attributes.get("offset"))
+        match op:
+            case linked_bf.IncrementOp():
+                into.append((Step.ADD, offset, 1))
+            case linked_bf.DecrementOp():
+                into.append((Step.ADD, offset, -1))
+            case linked_bf.AddOp(amount=amount):
+                into.append((Step.ADD, offset, amount.value.data))
+            case linked_bf.ClearOp():
+                into.append((Step.STORE, offset, 0))
+            case linked_bf.SetOp(value=value):
+                into.append((Step.STORE, offset, value.value.data))
+            case linked_bf.MulAddOp(factor=factor):
+                source = linked_bf.offset_value(op.source)
+                into.append((Step.MUL_ADD, offset, factor.value.data, source))
+            case linked_bf.ScanOp(stride=stride):
+                into.append((Step.SCAN, stride.value.data))
+            case linked_bf.OutputOp():
+                into.append((Step.OUTPUT, offset))
+            case linked_bf.LoopOp():
+                body: list[Instruction] = []
+                into.append((Step.LOOP, body))
+                # Popped in order, before the operations after the loop.
+                pending.extend(
+                    (body_op, body) for body_op in reversed(op.body.block.ops)
+                )
+            case linked_bf.LoopEndOp():
+                pass
+            case _:
+                return None
+    return top[0]
+
+
+@dataclass(frozen=True)
+class PartialEvaluatePass(ModulePass):
+    """
+    A pass running the start of the program in the linked dialect at compile
+    time, up to the first operation reading input. The evaluated operations
+    are replaced with a `bf.linked.tape_image` of the resulting tape, the
+    resulting pointer as the start index and a single `bf.linked.write` of
+    everything they output. A program without input compiles to just the
+    write, if it terminates within the budget.
+    """
+
+    name = "partial-evaluate"
+
+    budget: int = DEFAULT_BUDGET
+    """
+    The maximum number of steps to evaluate. A top-level operation that
+    does not finish within it is left to run at runtime.
+    """
+
+    tape_size: int = MEMORY_SIZE
+    """The number of cells of the tape, as in `LowerLinkedToBuiltinBfPass`."""
+
+    bounds: BoundsMode = "wrap"
+    """
+    The bounds mode, as in `LowerLinkedToBuiltinBfPass`. Unless the pointer
+    wraps, an operation leaving the tape is left to runtime, which reports
+    the error.
+    """
+
+    def apply(self, ctx: Context, op: ModuleOp) -> None:
+        main = op.body.block.first_op
+        assert isinstance(main, func.FuncOp)
+        start = main.body.block.first_op
+        assert isinstance(start, arith.ConstantOp)
+        machine = Machine(self.tape_size, self.bounds == "wrap", self.budget)
+        evaluated: list[Operation] = []
+        for main_op in list(main.body.block.ops)[1:]:
+            instruction = to_instruction(main_op)
+            if instruction is None or not machine.run(instruction):
+                break
+            evaluated.append(main_op)
+        if not evaluated:
+            return
+
+        # The remaining operations continue from the final pointer.
+        for evaluated_op in reversed(evaluated):
+            for result in evaluated_op.results:
+                result.replace_by(start.result)
+            Rewriter.erase_op(evaluated_op)
+        new_start = arith.ConstantOp(
+            builtin.IntegerAttr(machine.pointer, linked_bf.PositionType())
+        )
+        Rewriter.replace_op(start, new_start)
+        image = machine.image()
+        if image and not isinstance(new_start.next_op, func.ReturnOp):
+            Rewriter.insert_op(
+                linked_bf.TapeImageOp(image), InsertPoint.before(new_start)
+            )
+        if machine.output:
+            Rewriter.insert_op(
+                linked_bf.WriteOp(bytes(machine.output)), InsertPoint.after(new_start)
+            )
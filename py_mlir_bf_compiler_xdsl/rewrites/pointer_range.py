@@ -0,0 +1,121 @@
+from xdsl.dialects import arith, builtin, func
+from xdsl.ir import Operation, SSAValue
+
+from ..dialects import linked_brainfuck as linked_bf
+from .sink_moves import MEMORY_OPS, move_delta
+
+
+def pointer_range(main: func.FuncOp) -> tuple[int, int] | None:
+    """
+    Proves the range of cells the pointer of `main` can reach. This
+    succeeds if every index value is at a constant offset from the start
+    index, which holds if all loops are balanced, i.e. return the pointer to
+    where they started, and there are no scans. Calls of outlined functions
+    are followed into their bodies. Returns the lowest and highest cell
+    reached (including the start and the cells addressed by offsets) or
+    `None` if there is no proof.
+    """
+    module = main.parent_op()
+    assert module is not None
+    functions = {
+        function.sym_name.data: function
+        for function in module.regions[0].block.ops
+        if isinstance(function, func.FuncOp)
+    }
+    # The calls whose functions are being followed, innermost last.
+    calls: list[func.CallOp] = []
+    positions: dict[SSAValue, int] = {}
+    low: int | None = None
+    high: int | None = None
+
+    def reach(index: SSAValue, offset: int = 0) -> bool:
+        nonlocal low, high
+        if index not in positions:
+            return False
+        cell = positions[index] + offset
+        low = cell if low is None else min(low, cell)
+        high = cell if high is None else max(high, cell)
+        return True
+
+    pending: list[Operation] = list(reversed(main.body.block.ops))
+    while pending:
+        op = pending.pop()
+        delta = move_delta(op)
+        if delta is not None:
+            if op.operands[0] not in positions:
+                return None
+            positions[op.results[0]] = positions[op.operands[0]] + delta
+            reach(op.results[0])
+            continue
+        match op:
+            case arith.ConstantOp(value=builtin.IntegerAttr(type=builtin.IndexType())):
+                positions[op.result] = op.value.value.data
+                reach(op.results[0])
+            case linked_bf.MulAddOp():
+                if not reach(op.index, linked_bf.offset_value(op.offset)) or not reach(
+                    op.index, linked_bf.offset_value(op.source)
+                ):
+                    return None
+            case _ if isinstance(op, MEMORY_OPS):
+                offset = linked_bf.offset_value(op.attributes.get("offset"))
+                if not reach(op.operands[0], offset):
+                    return None
+            case linked_bf.LoopOp():
+                if not reach(op.index):
+                    return None
+                # Every iteration starts where the loop was entered, which
+                # is checked at its end.
+                positions[op.body.block.args[0]] = positions[op.index]
+                positions[op.new_index] = positions[op.index]
+                pending.extend(reversed(op.body.block.ops))
+            case linked_bf.LoopEndOp():
+                loop = op.parent_op()
+                assert isinstance(loop, linked_bf.LoopOp)
+                if positions.get(op.index) != positions[loop.index]:
+                    return None
+            case func.CallOp():
+                if not reach(op.operands[0]):
+                    return None
+                callee = functions[op.callee.root_reference.data]
+                positions[callee.body.block.args[0]] = positions[op.operands[0]]
+                calls.append(op)
+                pending.extend(reversed(callee.body.block.ops))
+            case func.ReturnOp() if op.operands:
+                # The end of an outlined function, which returns the index.
+                call = calls.pop()
+                positions[call.results[0]] = positions[op.operands[0]]
+            case linked_bf.WriteOp() | func.ReturnOp():
+                pass
+            case _:
+                return None
+    if low is None or high is None:
+        return None
+    return low, high
+
+
+def loop_positions(loop: linked_bf.LoopOp) -> dict[SSAValue, int] | None:
+    """
+    Returns the position of every index value in the loop, including the
+    loops nested in it, relative to the index the loop is entered with, or
+    `None` if the loop or a nested one is not balanced or contains a scan
+    or a call.
+    """
+    positions: dict[SSAValue, int] = {loop.index: 0}
+    pending = [loop]
+    while pending:
+        current = pending.pop()
+        start = positions[current.index]
+        positions[current.body.block.args[0]] = start
+        for op in current.body.block.ops:
+            delta = move_delta(op)
+            if delta is not None:
+                positions[op.results[0]] = positions[op.operands[0]] + delta
+            elif isinstance(op, linked_bf.LoopOp):
+                positions[op.new_index] = positions[op.index]
+                pending.append(op)
+            elif isinstance(op, linked_bf.LoopEndOp):
+                if positions[op.index] != start:
+                    return None
+            elif isinstance(op, linked_bf.ScanOp | func.CallOp):
+                return None
+    return positions
@@ -0,0 +1,246 @@
+from dataclasses import dataclass
+from itertools import count
+
+from xdsl.context import Context
+from xdsl.dialects import arith, builtin, func
+from xdsl.dialects.builtin import ModuleOp
+from xdsl.ir import Block, Operation, SSAValue
+from xdsl.passes import ModulePass
+from xdsl.rewriter import Rewriter
+
+from py_mlir_bf_compiler_common.cell_values import CellValues
+
+from ..dialects import linked_brainfuck as linked_bf
+from .lower_linked_to_builtin import MEMORY_SIZE
+from .sink_moves import MEMORY_OPS, move_delta
+
+
+def loop_writes(
+    loop: linked_bf.LoopOp, writes: dict[linked_bf.LoopOp, set[int] | None]
+) -> set[int] | None:
+    """
+    Returns the offsets from the loop's index of the cells its body may
+    write, or `None` if the loop is not balanced, i.e. an iteration may not
+    end where it started, so the cells can not be named. `writes` holds the
+    results for the loops nested in the body.
+    """
+    positions: dict[SSAValue, int] = {loop.body.block.args[0]: 0}
+    written: set[int] = set()
+    for op in loop.body.block.ops:
+        delta = move_delta(op)
+        if delta is not None:
+            if op.operands[0] in positions:
+                positions[op.results[0]] = positions[op.operands[0]] + delta
+            continue
+        match op:
+            case linked_bf.OutputOp() | linked_bf.WriteOp():
+                pass
+            case _ if isinstance(op, MEMORY_OPS):
+                if op.operands[0] not in positions:
+                    return None
+                offset = linked_bf.offset_value(op.attributes.get("offset"))
+                written.add(positions[op.operands[0]] + offset)
+            case linked_bf.LoopOp():
+                nested = writes[op]
+                if nested is None or op.index not in positions:
+                    return None
+                written.update(positions[op.index] + offset for offset in nested)
+                positions[op.new_index] = positions[op.index]
+            case linked_bf.LoopEndOp():
+                if positions.get(op.index) != 0:
+                    return None
+            case _:
+                # Scans leave the index at an unknown position.
+                pass
+    return written
+
+
+class _Propagation:
+    def __init__(self, tape_size: int, writes: dict[linked_bf.LoopOp, set[int] | None]):
+        self.tape_size = tape_size
+        self.writes = writes
+        self.frames = count(1)
+        # The frame and position of every index value of a known frame.
+        self.positions: dict[SSAValue, tuple[int, int]] = {}
+        # The loop bodies left to visit with the values known at their start.
+        self.pending: list[tuple[Block, CellValues]] = []
+
+    def cell(self, values: CellValues, index: SSAValue, offset: int) -> int | None:
+        if index not in self.positions:
+            return None
+        frame, position = self.positions[index]
+        if frame != values.frame:
+            return None
+        # The pointer wraps around, so positions a tape apart are one cell.
+        return (position + offset) % self.tape_size
+
+    def new_frame(self, index: SSAValue) -> CellValues:
+        """Starts a frame at `index`, whose cell is known to be zero."""
+        values = CellValues(next(self.frames), {0: 0})
+        self.positions[index] = (values.frame, 0)
+        return values
+
+    def visit(self, block: Block, values: CellValues):
+        for op in list(block.ops):
+            delta = move_delta(op)
+            if delta is not None:
+                if op.operands[0] in self.positions:
+                    frame, position = self.positions[op.operands[0]]
+                    self.positions[op.results[0]] = (frame, position + delta)
+                continue
+            offset = linked_bf.offset_value(op.attributes.get("offset"))
+            match op:
+                case (
+                    linked_bf.IncrementOp()
+                    | linked_bf.DecrementOp()
+                    | linked_bf.AddOp()
+                ):
+                    cell = self.cell(values, op.operands[0], offset)
+                    value = values.get(cell)
+                    if value is None:
+                        values.put(cell, None)
+                        continue
+                    match op:
+                        case linked_bf.IncrementOp():
+                            value += 1
+                        case linked_bf.DecrementOp():
+                            value -= 1
+                        case linked_bf.AddOp(amount=amount):
+                            value += amount.value.data
+                    self.store(values, op, cell, value & 0xFF, offset)
+                case linked_bf.ClearOp():
+                    cell = self.cell(values, op.index, offset)
+                    self.store(values, op, cell, 0, offset)
+                case linked_bf.SetOp(value=value):
+                    cell = self.cell(values, op.index, offset)
+                    self.store(values, op, cell, value.value.data & 0xFF, offset)
+                case linked_bf.MulAddOp(factor=factor):
+                    cell = self.cell(values, op.index, offset)
+                    source = values.get(
+                        self.cell(values, op.index, linked_bf.offset_value(op.source))
+                    )
+                    if source is None:
+                        values.put(cell, None)
+                        continue
+                    amount = source * factor.value.data & 0xFF
+                    value = values.get(cell)
+                    if amount == 0:
+                        Rewriter.erase_op(op)
+                    elif value is not None:
+                        self.store(values, op, cell, (value + amount) & 0xFF, offset)
+                    else:
+                        Rewriter.replace_op(
+                            op, linked_bf.AddOp(op.index, amount, offset)
+                        )
+                case linked_bf.InputOp():
+                    values.put(self.cell(values, op.index, offset), None)
+                case linked_bf.OutputOp() | linked_bf.WriteOp():
+                    pass
+                case linked_bf.ScanOp():
+                    values = self.new_frame(op.new_index)
+                case linked_bf.LoopOp():
+                    values = self.visit_loop(op, values)
+                case (
+                    arith.ConstantOp()
+                    | linked_bf.TapeImageOp()
+                    | linked_bf.LoopEndOp()
+                    | func.ReturnOp()
+                ):
+                    pass
+                case _:
+                    values.put(None, None)
+
+    def store(
+        self,
+        values: CellValues,
+        op: Operation,
+        cell: int | None,
+        value: int,
+        offset: int,
+    ):
+        """
+        Replaces `op`, which sets its cell to the known `value`, with a
+        `bf.linked.set`, or removes it if the cell already holds the value.
+        """
+        if cell is not None and values.get(cell) == value:
+            Rewriter.erase_op(op)
+            return
+        values.put(cell, value)
+        if not isinstance(op, linked_bf.ClearOp | linked_bf.SetOp):
+            Rewriter.replace_op(op, linked_bf.SetOp(op.operands[0], value, offset))
+
+    def visit_loop(self, loop: linked_bf.LoopOp, values: CellValues) -> CellValues:
+        """Returns the values known after the loop."""
+        cell = self.cell(values, loop.index, 0)
+        value = values.get(cell)
+        if value == 0:
+            loop.new_index.replace_by(loop.index)
+            Rewriter.erase_op(loop)
+            return values
+        if value is not None and loop.entered is None:
+            loop.attributes["entered"] = builtin.UnitAttr()
+
+        writes = self.writes[loop]
+        if writes is None or cell is None:
+            # Every iteration starts at another position, where nothing is
+            # known but that the cell is nonzero.
+            body_values = CellValues(next(self.frames))
+            self.positions[loop.body.block.args[0]] = (body_values.frame, 0)
+            self.pending.append((loop.body.block, body_values))
+            return self.new_frame(loop.new_index)
+        for offset in writes:
+            values.put((cell + offset) % self.tape_size, None)
+        self.positions[loop.body.block.args[0]] = self.positions[loop.index]
+        self.positions[loop.new_index] = self.positions[loop.index]
+        self.pending.append((loop.body.block, values.copy()))
+        values.put(cell, 0)
+        return values
+
+
+@dataclass(frozen=True)
+class PropagateCellValuesPass(ModulePass):
+    """
+    A pass tracking the values of the cells through the linked dialect. All
+    cells start at zero (or their value in the `bf.linked.tape_image`) and
+    the cell of a loop or scan is zero after it. Loops never entered and
+    stores of values the cell already holds are removed, adds to known
+    values become `bf.linked.set` and loops known to be entered skip their
+    first check. Inside loops, only the values of cells the loop does not
+    write are known.
+    """
+
+    name = "propagate-cell-values"
+
+    tape_size: int = MEMORY_SIZE
+    """The number of cells of the tape, as in `LowerLinkedToBuiltinBfPass`."""
+
+    def apply(self, ctx: Context, op: ModuleOp) -> None:
+        main = op.body.block.first_op
+        assert isinstance(main, func.FuncOp)
+        # Inner loops first, as their writes are part of the outer ones.
+        writes: dict[linked_bf.LoopOp, set[int] | None] = {}
+        loops: list[linked_bf.LoopOp] = []
+        blocks = [main.body.block]
+        while blocks:
+            for block_op in blocks.pop().ops:
+                if isinstance(block_op, linked_bf.LoopOp):
+                    loops.append(block_op)
+                    blocks.append(block_op.body.block)
+        for loop in reversed(loops):
+            writes[loop] = loop_writes(loop, writes)
+
+        propagation = _Propagation(self.tape_size, writes)
+        values = CellValues(0, default=0)
+        for main_op in main.body.block.ops:
+            match main_op:
+                case linked_bf.TapeImageOp(cells=cells):
+                    image = linked_bf.data_bytes(cells)
+                    values.cells = {
+                        cell: value for cell, value in enumerate(image) if value
+                    }
+                case arith.ConstantOp(value=builtin.IntegerAttr(value=position)):
+                    propagation.positions[main_op.result] = (0, position.data)
+                    break
+        propagation.visit(main.body.block, values)
+        while propagation.pending:
+            propagation.visit(*propagation.pending.pop())
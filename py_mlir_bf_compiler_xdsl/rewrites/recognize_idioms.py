@@ -0,0 +1,96 @@
+from xdsl.context import Context
+from xdsl.dialects.builtin import ModuleOp
+from xdsl.ir import Operation
+from xdsl.passes import ModulePass
+from xdsl.rewriter import InsertPoint, Rewriter
+
+from py_mlir_bf_compiler_common.passes import wrap_amount
+
+from ..dialects import linked_brainfuck as linked_bf
+
+
+def loop_effect(loop: linked_bf.LoopOp) -> tuple[int, dict[int, int]] | None:
+    """
+    Returns the net pointer movement and the net change per cell offset of a
+    loop body, if the body only consists of pointer moves and constant
+    additions. Returns `None` otherwise.
+    """
+    offset = 0
+    deltas: dict[int, int] = {}
+    for op in loop.body.block.ops:
+        match op:
+            case linked_bf.MoveLeftOp():
+                offset -= 1
+            case linked_bf.MoveRightOp():
+                offset += 1
+            case linked_bf.MoveOp(delta=delta):
+                offset += delta.value.data
+            case linked_bf.IncrementOp():
+                cell = offset + linked_bf.offset_value(op.offset)
+                deltas[cell] = deltas.get(cell, 0) + 1
+            case linked_bf.DecrementOp():
+                cell = offset + linked_bf.offset_value(op.offset)
+                deltas[cell] = deltas.get(cell, 0) - 1
+            case linked_bf.AddOp(amount=amount):
+                cell = offset + linked_bf.offset_value(op.offset)
+                deltas[cell] = deltas.get(cell, 0) + amount.value.data
+            case linked_bf.LoopEndOp():
+                pass
+            case _:
+                return None
+    return offset, {offset: wrap_amount(delta) for offset, delta in deltas.items()}
+
+
+def rewrite_idiom(loop: linked_bf.LoopOp) -> bool:
+    effect = loop_effect(loop)
+    if effect is None:
+        return False
+    stride, deltas = effect
+    if stride != 0:
+        if any(deltas.values()):
+            return False
+        scan = linked_bf.ScanOp(loop.index, stride)
+        Rewriter.insert_op(scan, InsertPoint.before(loop))
+        loop.new_index.replace_by(scan.new_index)
+        Rewriter.erase_op(loop)
+        return True
+    control = deltas.pop(0, 0)
+    if control not in (-1, 1):
+        return False
+    # With a step of +1 the loop runs (256 - value) times instead of value
+    # times, so the contribution to the other cells changes sign.
+    sign = -control
+    new_ops: list[Operation] = [
+        linked_bf.MulAddOp(loop.index, offset, wrap_amount(sign * delta))
+        for offset, delta in sorted(deltas.items())
+        if delta != 0
+    ]
+    new_ops.append(linked_bf.ClearOp(loop.index))
+    Rewriter.insert_op(new_ops, InsertPoint.before(loop))
+    loop.new_index.replace_by(loop.index)
+    Rewriter.erase_op(loop)
+    return True
+
+
+class RecognizeIdiomsPass(ModulePass):
+    """
+    A pass replacing clear, copy and multiply loops in the linked dialect,
+    e.g. `[-]` or `[->++>+++<<]`, with `bf.linked.clear` and
+    `bf.linked.mul_add` operations, and loops only moving the pointer, e.g.
+    `[>]` or `[<<<]`, with `bf.linked.scan`.
+    """
+
+    name = "recognize-linked-idioms"
+
+    def apply(self, ctx: Context, op: ModuleOp) -> None:
+        loops: list[linked_bf.LoopOp] = []
+        ops: list[Operation] = [op]
+        while ops:
+            current = ops.pop()
+            if isinstance(current, linked_bf.LoopOp):
+                loops.append(current)
+            for region in current.regions:
+                for block in region.blocks:
+                    ops.extend(block.ops)
+        for loop in loops:
+            rewrite_idiom(loop)
@@ -0,0 +1,110 @@
+from dataclasses import dataclass
+
+from xdsl.context import Context
+from xdsl.dialects import func
+from xdsl.dialects.builtin import ModuleOp
+from xdsl.ir import Block, Operation, SSAValue
+from xdsl.passes import ModulePass
+from xdsl.rewriter import Rewriter
+
+from ..dialects import linked_brainfuck as linked_bf
+from .outline import nested_ops, op_sizes, outline
+
+DEFAULT_SHARE_SIZE = 32
+DEFAULT_SHARE_COUNT = 2
+SHARED = "bf_shared"
+
+
+def loop_shapes(block: Block) -> dict[linked_bf.LoopOp, int]:
+    """
+    Numbers the loops in `block` and nested in it by their structure, so
+    that loops with the same number only differ in the names of their
+    values. Loops using values from outside other than the index they are
+    entered with are left out, as are the loops containing them.
+    """
+    shapes: dict[tuple, int] = {}
+    numbers: dict[linked_bf.LoopOp, int] = {}
+    # Nested loops are numbered first, so that the shape of a loop refers
+    # to them by their number.
+    for loop in reversed(nested_ops(list(block.ops))):
+        if not isinstance(loop, linked_bf.LoopOp):
+            continue
+        values: dict[SSAValue, int] = {loop.body.block.args[0]: 0}
+        shape: list[tuple] = []
+        for op in loop.body.block.ops:
+            if any(operand not in values for operand in op.operands):
+                break
+            if isinstance(op, linked_bf.LoopOp):
+                if op not in numbers:
+                    break
+                kind = numbers[op]
+            else:
+                kind = (op.name, tuple(op.attributes.items()))
+            shape.append((kind, tuple(values[operand] for operand in op.operands)))
+            for result in op.results:
+                values[result] = len(values)
+        else:
+            # Loops known to be entered are lowered differently.
+            key = (tuple(loop.attributes.items()), tuple(shape))
+            numbers[loop] = shapes.setdefault(key, len(shapes))
+    return numbers
+
+
+class LoopSharer:
+    """
+    Moves every loop of at least `min_size` operations that occurs at least
+    `min_count` times into a function, which replaces all of them. Larger
+    loops are shared first, so the copies of a loop nested in them count
+    once.
+    """
+
+    def __init__(self, module: ModuleOp, min_size: int, min_count: int) -> None:
+        self.module = module
+        self.min_size = min_size
+        self.min_count = min_count
+        self.count = 0
+
+    def run(self, main: func.FuncOp):
+        sizes = op_sizes(main.body.block)
+        # The copies of every loop in the order of the program, so that the
+        # function is made from the first one.
+        copies: dict[int, list[linked_bf.LoopOp]] = {}
+        for loop, number in reversed(loop_shapes(main.body.block).items()):
+            copies.setdefault(number, []).append(loop)
+        removed: set[Operation] = set()
+        for loops in sorted(copies.values(), key=lambda loops: -sizes[loops[0]]):
+            loops = [loop for loop in loops if loop not in removed]
+            if len(loops) < max(self.min_count, 2) or sizes[loops[0]] < self.min_size:
+                continue
+            name = f"{SHARED}_{self.count}"
+            if outline(self.module, [loops[0]], loops[0].index, name) is None:
+                continue
+            self.count += 1
+            for loop in loops[1:]:
+                removed.update(nested_ops([loop]))
+                Rewriter.replace_op(
+                    loop, func.CallOp(name, [loop.index], [linked_bf.PositionType()])
+                )
+
+
+@dataclass(frozen=True)
+class ShareLoopsPass(ModulePass):
+    """
+    A pass moving loops of `main` that occur many times into one function
+    each, called in place of every copy, so that generated programs
+    repeating the same loops are lowered and compiled once per loop. Loops
+    are compared by their structure, ignoring the names of their values.
+    """
+
+    name = "share-loops"
+
+    min_size: int = DEFAULT_SHARE_SIZE
+    """The number of operations a loop needs to be shared."""
+
+    min_count: int = DEFAULT_SHARE_COUNT
+    """The number of copies a loop needs to be shared, at least two."""
+
+    def apply(self, ctx: Context, op: ModuleOp) -> None:
+        main = op.body.block.first_op
+        assert isinstance(main, func.FuncOp)
+        LoopSharer(op, self.min_size, self.min_count).run(main)
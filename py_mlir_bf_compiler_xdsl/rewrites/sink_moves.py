@@ -0,0 +1,96 @@
+from xdsl.context import Context
+from xdsl.dialects import builtin
+from xdsl.dialects.builtin import ModuleOp
+from xdsl.ir import Block, Operation, SSAValue
+from xdsl.passes import ModulePass
+from xdsl.rewriter import InsertPoint, Rewriter
+
+from ..dialects import linked_brainfuck as linked_bf
+
+MEMORY_OPS = (
+    linked_bf.IncrementOp,
+    linked_bf.DecrementOp,
+    linked_bf.AddOp,
+    linked_bf.OutputOp,
+    linked_bf.InputOp,
+    linked_bf.ClearOp,
+    linked_bf.SetOp,
+    linked_bf.MulAddOp,
+)
+
+
+def move_delta(op: Operation) -> int | None:
+    match op:
+        case linked_bf.MoveLeftOp():
+            return -1
+        case linked_bf.MoveRightOp():
+            return 1
+        case linked_bf.MoveOp(delta=delta):
+            return delta.value.data
+    return None
+
+
+def _shift(op: Operation, name: str, by: int, optional: bool = True):
+    offset = linked_bf.offset_value(op.attributes.get(name)) + by
+    if offset == 0 and optional:
+        op.attributes.pop(name, None)
+    else:
+        op.attributes[name] = builtin.IntegerAttr(offset, linked_bf.PositionType())
+
+
+def shift_offsets(op: Operation, by: int):
+    """Moves the cells the memory operation `op` addresses by `by`."""
+    if isinstance(op, linked_bf.MulAddOp):
+        _shift(op, "offset", by, optional=False)
+        _shift(op, "source", by)
+    else:
+        _shift(op, "offset", by)
+
+
+def sink_block(block: Block):
+    # Maps every index value of the block to the materialized index it was
+    # derived from and the accumulated offset of the removed moves.
+    positions: dict[SSAValue, tuple[SSAValue, int]] = {}
+    moves: list[Operation] = []
+    for op in list(block.ops):
+        delta = move_delta(op)
+        if delta is not None:
+            base, offset = positions.get(op.operands[0], (op.operands[0], 0))
+            positions[op.results[0]] = (base, offset + delta)
+            moves.append(op)
+            continue
+        for i, operand in enumerate(op.operands):
+            if operand not in positions:
+                continue
+            base, offset = positions[operand]
+            if isinstance(op, MEMORY_OPS):
+                shift_offsets(op, offset)
+            elif offset != 0:
+                move = linked_bf.MoveOp(base, offset)
+                Rewriter.insert_op(move, InsertPoint.before(op))
+                base = move.new_index
+                positions[operand] = (base, 0)
+            op.operands[i] = base
+    for move in reversed(moves):
+        Rewriter.erase_op(move)
+
+
+class SinkMovesPass(ModulePass):
+    """
+    A pass removing pointer moves from straight-line code in the linked
+    dialect. Operations address their cell with a constant `offset` from the
+    last materialized index instead, and a single `bf.linked.move` is only
+    emitted where the index leaves the block, e.g. before loops and at the
+    end of loop bodies.
+    """
+
+    name = "sink-linked-moves"
+
+    def apply(self, ctx: Context, op: ModuleOp) -> None:
+        blocks = [block for region in op.regions for block in region.blocks]
+        while blocks:
+            block = blocks.pop()
+            for block_op in block.ops:
+                for region in block_op.regions:
+                    blocks.extend(region.blocks)
+            sink_block(block)
@@ -0,0 +1,98 @@
+from xdsl.dialects import func, memref
+from xdsl.dialects.builtin import ModuleOp, StringAttr, SymbolRefAttr
+from xdsl.ir import Operation
+
+# About as much as LLVM compiles in a second, so that large programs keep
+# many processes busy while small ones stay a single module.
+PART_SIZE = 50_000
+
+
+def _is_definition(op: Operation) -> bool:
+    return isinstance(op, func.FuncOp) and bool(op.body.blocks)
+
+
+def _symbol(op: Operation) -> str | None:
+    if isinstance(op, func.FuncOp | memref.GlobalOp):
+        return op.sym_name.data
+    return None
+
+
+def _uses(op: Operation) -> set[str]:
+    """Returns the symbols referred to in `op`."""
+    uses: set[str] = set()
+    for nested in op.walk():
+        for attribute in (*nested.properties.values(), *nested.attributes.values()):
+            if isinstance(attribute, SymbolRefAttr):
+                uses.add(attribute.root_reference.data)
+    return uses
+
+
+def _declaration(op: Operation) -> Operation:
+    """Returns an external declaration of the function or global `op`."""
+    if isinstance(op, func.FuncOp):
+        return func.FuncOp.external(
+            op.sym_name.data,
+            op.function_type.inputs.data,
+            op.function_type.outputs.data,
+        )
+    declaration = op.clone()
+    # MLIR reads a global without an initial value as external, it must be
+    # public to be linked to its definition. xDSL requires the initial value,
+    # so the declaration does not verify, but is written as it is.
+    declaration.properties.pop("initial_value", None)
+    declaration.properties["sym_visibility"] = StringAttr("public")
+    return declaration
+
+
+def split_module(module: ModuleOp, part_size: int = PART_SIZE) -> list[ModuleOp]:
+    """
+    Splits `module` into modules of consecutive functions of at least
+    `part_size` operations each, except the last, which are compiled
+    separately and linked. The first part keeps the globals and every part
+    declares the functions and globals it uses from others, which become
+    public. Takes the operations out of `module` unless it is small enough
+    to stay in one part, in which case it is returned as is.
+    """
+    ops = list(module.ops)
+    # The part of every function, in the order of the module.
+    owners: dict[Operation, int] = {}
+    part, size = 0, 0
+    for op in ops:
+        if not _is_definition(op):
+            continue
+        if size >= part_size:
+            part, size = part + 1, 0
+        owners[op] = part
+        size += sum(1 for _ in op.walk())
+    if part == 0:
+        return [module]
+
+    symbols = {_symbol(op): op for op in ops if _symbol(op) is not None}
+    defined = {
+        _symbol(op): owners.get(op, 0)
+        for op in ops
+        if _is_definition(op) or isinstance(op, memref.GlobalOp)
+    }
+    used: list[set[str]] = [set() for _ in range(part + 1)]
+    for op, owner in owners.items():
+        used[owner] |= _uses(op)
+    shared = {
+        symbol
+        for owner, symbols_used in enumerate(used)
+        for symbol in symbols_used
+        if defined.get(symbol, owner) != owner
+    }
+
+    parts = [ModuleOp([], dict(module.attributes)) for _ in range(part + 1)]
+    for index, part_module in enumerate(parts):
+        for symbol in sorted(used[index]):
+            if symbol in defined and defined[symbol] == index:
+                continue
+            part_module.body.block.add_op(_declaration(symbols[symbol]))
+    for op in ops:
+        if _symbol(op) in shared:
+            op.properties["sym_visibility"] = StringAttr("public")
+        op.detach()
+        if op in owners or _symbol(op) in defined:
+            parts[defined[_symbol(op)]].body.block.add_op(op)
+    return parts